@@ -0,0 +1,142 @@
+"""
+Memory vs recall trade-off of the compact vector index: for every Matryoshka truncation and quantization the
+in-memory bytes, query latency and recall@k against exact full precision search are reported, before and after
+full precision rescoring. Embeddings come from an existing index (--db-path) or are synthetic.
+
+usage: python -m benchmarks.bench_compact_index --db-path db --source-backend chroma --dims 768 512 256 128
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+
+def load_embeddings(args):
+    """
+    used to get the document embeddings and the query embeddings the configurations are compared on
+    :return: (documents, queries) float32 matrices
+    """
+    rng = np.random.default_rng(0)
+    if args.db_path:
+        from model_trainer.vector_index import get_vector_index
+
+        documents = get_vector_index(args.source_backend, path=args.db_path).get_all()[
+            "embeddings"
+        ]
+    else:
+        # decaying per dimension scale, roughly how Matryoshka models concentrate information in leading dims
+        documents = rng.normal(size=(args.size, args.dim)) * np.linspace(
+            2, 0.2, args.dim
+        )
+        # unit length like the output of sentence-transformers models with a Normalize module
+        documents /= np.linalg.norm(documents, axis=1, keepdims=True)
+    documents = np.asarray(documents, dtype=np.float32)
+    if len(documents) == 0:
+        raise ValueError("No embeddings in the source index")
+
+    if args.input:
+        from sentence_transformers import SentenceTransformer
+
+        from model_trainer.evaluation import RetrievalEvaluator
+
+        evaluator = RetrievalEvaluator(input_path=args.input, holdout_fraction=1.0)
+        evaluator.load()
+        model = SentenceTransformer(args.model, device="cpu")
+        queries = model.encode(
+            [question for question, _ in evaluator.queries[: args.queries]]
+        )
+    else:
+        # stored documents with a small perturbation stand in for queries
+        queries = documents[rng.choice(len(documents), args.queries)]
+        queries = queries + rng.normal(
+            0, 0.05 * np.abs(queries).mean(), size=queries.shape
+        )
+    return documents, np.asarray(queries, dtype=np.float32)
+
+
+def recall_at_k(results: list, ground_truth: list, k: int):
+    return float(
+        np.mean(
+            [
+                len(set(result[:k]) & set(truth[:k])) / k
+                for result, truth in zip(results, ground_truth)
+            ]
+        )
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--db-path", default=None)
+    arg_parser.add_argument(
+        "--source-backend", default="chroma", choices=["chroma", "numpy"]
+    )
+    arg_parser.add_argument("--size", type=int, default=50000)
+    arg_parser.add_argument("--dim", type=int, default=768)
+    arg_parser.add_argument("--queries", type=int, default=256)
+    arg_parser.add_argument(
+        "--input",
+        default=None,
+        help="parsed content with questions, encodes real questions as queries with --model",
+    )
+    arg_parser.add_argument("--model", default="models/finetuned_bi_encoder")
+    arg_parser.add_argument("--dims", type=int, nargs="+", default=[768, 512, 256, 128])
+    arg_parser.add_argument(
+        "--quantizations",
+        nargs="+",
+        default=["float32", "int8", "binary"],
+        choices=["float32", "int8", "binary"],
+    )
+    arg_parser.add_argument("--rescore-multiplier", type=int, default=4)
+    arg_parser.add_argument("--k", type=int, default=10)
+    args = arg_parser.parse_args()
+
+    from model_trainer.vector_index import CompactVectorIndex, NumpyVectorIndex
+
+    documents, queries = load_embeddings(args)
+    ids = [str(idx) for idx in range(len(documents))]
+    texts = ids
+    metadatas = [{} for _ in ids]
+
+    exact_index = NumpyVectorIndex()
+    exact_index.add(ids, documents, texts, metadatas)
+    start = time.perf_counter()
+    ground_truth = exact_index.query_batch(queries, args.k)["ids"]
+    exact_ms = (time.perf_counter() - start) * 1000
+    print(
+        f"exact      dim={documents.shape[1]:<5} memory={documents.nbytes / 2**20:.1f}MB "
+        f"batch_query={exact_ms:.1f}ms"
+    )
+
+    for dim in sorted(
+        {min(dim, documents.shape[1]) for dim in args.dims}, reverse=True
+    ):
+        for quantization in args.quantizations:
+            results = {}
+            for rescore_multiplier in (1, args.rescore_multiplier):
+                index = CompactVectorIndex(
+                    truncate_dim=dim,
+                    quantization=quantization,
+                    rescore_multiplier=rescore_multiplier,
+                )
+                index.add(ids, documents, texts, metadatas)
+                index.get_compact_matrix()
+                start = time.perf_counter()
+                query_results = index.query_batch(queries, args.k)["ids"]
+                results[rescore_multiplier] = (
+                    recall_at_k(query_results, ground_truth, args.k),
+                    (time.perf_counter() - start) * 1000,
+                )
+            memory_mb = index.get_memory_footprint() / 2**20
+            print(
+                f"{quantization:<10} dim={dim:<5} memory={memory_mb:.1f}MB "
+                f"({documents.nbytes / index.get_memory_footprint():.0f}x smaller) "
+                f"recall@{args.k}={results[1][0]:.3f} "
+                f"rescored({args.rescore_multiplier}x)={results[args.rescore_multiplier][0]:.3f} "
+                f"batch_query={results[args.rescore_multiplier][1]:.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
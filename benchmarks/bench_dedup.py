@@ -0,0 +1,96 @@
+"""
+Near-duplicate chunk detection on a synthetic corpus where a share of the chunks are lightly edited copies of
+earlier ones (repeated headers, footers, captions): MinHash/LSH lookups against comparing every chunk with every
+kept chunk, the chunks each method drops and the LLM calls and triplets that saves. LSH time grows with the number
+of chunks, the pairwise comparison with its square.
+
+usage: python -m benchmarks.bench_dedup --chunks 1000 4000 --duplicate-fraction 0.2 --threshold 0.85
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+
+def build_corpus(num_chunks: int, duplicate_fraction: float, words_per_chunk: int):
+    rng = random.Random(0)
+    chunks = []
+    for _ in range(num_chunks):
+        if chunks and rng.random() < duplicate_fraction:
+            # a copy with a few changed words and different casing, like a header with another page number
+            words = rng.choice(chunks).split()
+            for _ in range(max(1, len(words) // 100)):
+                words[rng.randrange(len(words))] = str(rng.randrange(1000))
+            chunks.append(" ".join(words).upper())
+        else:
+            chunks.append(
+                " ".join(f"word{rng.randrange(20000)}" for _ in range(words_per_chunk))
+            )
+    return chunks
+
+
+def dedup_lsh(chunks: list, threshold: float):
+    from pipeline.dedup import iter_unique_chunks
+
+    records = [{"title": "", "text_content": chunk} for chunk in chunks]
+    kept = {id(record) for record in iter_unique_chunks(records, threshold)}
+    return {position for position, record in enumerate(records) if id(record) in kept}
+
+
+def dedup_pairwise(chunks: list, threshold: float):
+    from pipeline.dedup import MinHasher
+
+    min_hasher = MinHasher()
+    kept = []
+    kept_signatures = np.empty((0, min_hasher.num_perm), dtype=np.uint32)
+    for position, chunk in enumerate(chunks):
+        signature = min_hasher.get_signature(chunk)
+        if len(kept) and (kept_signatures == signature).mean(axis=1).max() >= threshold:
+            continue
+        kept.append(position)
+        kept_signatures = np.vstack([kept_signatures, signature])
+    return set(kept)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--chunks", type=int, nargs="+", default=[1000, 4000])
+    arg_parser.add_argument("--duplicate-fraction", type=float, default=0.2)
+    arg_parser.add_argument("--words-per-chunk", type=int, default=300)
+    arg_parser.add_argument("--threshold", type=float, default=0.85)
+    arg_parser.add_argument("--questions-per-chunk", type=int, default=5)
+    arg_parser.add_argument("--negatives", type=int, default=3)
+    arg_parser.add_argument(
+        "--skip-pairwise",
+        action="store_true",
+        help="only run LSH, the pairwise comparison is quadratic in the number of chunks",
+    )
+    args = arg_parser.parse_args()
+
+    for num_chunks in args.chunks:
+        chunks = build_corpus(num_chunks, args.duplicate_fraction, args.words_per_chunk)
+        start = time.perf_counter()
+        lsh_kept = dedup_lsh(chunks, args.threshold)
+        lsh_seconds = time.perf_counter() - start
+        num_removed = num_chunks - len(lsh_kept)
+        line = (
+            f"chunks={num_chunks:<7} lsh={lsh_seconds:.2f}s removed={num_removed} "
+            f"saved_llm_calls={num_removed} "
+            f"saved_triplets={num_removed * args.questions_per_chunk * args.negatives}"
+        )
+        if not args.skip_pairwise:
+            start = time.perf_counter()
+            pairwise_kept = dedup_pairwise(chunks, args.threshold)
+            pairwise_seconds = time.perf_counter() - start
+            line += (
+                f" pairwise={pairwise_seconds:.2f}s "
+                f"pairwise_removed={num_chunks - len(pairwise_kept)} "
+                f"agreement={len(lsh_kept & pairwise_kept) / len(lsh_kept | pairwise_kept):.3f}"
+            )
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Compares the pytorch, onnx and int8 quantized onnx variants of the fine-tuned model on CPU: encode latency, peak
+RSS, and drift of the embeddings and retrieval metrics against the pytorch model on the generated questions.
+Every variant runs in its own process so peak RSS is not shared. Export the variants first with
+BiEncoderTrainer.export_trained_model (EXPORT_ONNX=true in the pipeline).
+
+usage: python -m benchmarks.bench_export --variants torch onnx onnx-int8 --batch-sizes 1 32
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+
+
+def run_variant(
+    variant: str,
+    model_path: str,
+    input_path: str,
+    holdout_fraction: float,
+    batch_sizes: list,
+    sequence_lengths: list,
+    num_runs: int,
+    quantization_config: str,
+    num_drift_texts: int,
+):
+    """
+    used to load and measure one model variant in the current process
+    :return: dict with load time, retrieval metrics, encode latencies, peak RSS and the embeddings used for drift
+    """
+    from model_trainer.evaluation import RetrievalEvaluator
+    from model_trainer.export import load_model
+
+    start = time.perf_counter()
+    model = load_model(
+        model_path,
+        variant=variant,
+        device="cpu",
+        quantization_config=quantization_config,
+    )
+    load_seconds = time.perf_counter() - start
+
+    evaluator = RetrievalEvaluator(
+        input_path=input_path, holdout_fraction=holdout_fraction
+    )
+    evaluator.load()
+    drift_texts = [question for question, _ in evaluator.queries[:num_drift_texts]]
+    return {
+        "variant": variant,
+        "load_seconds": load_seconds,
+        "retrieval": evaluator.evaluate(model),
+        "encode": evaluator.benchmark_encode(
+            model,
+            batch_sizes=tuple(batch_sizes),
+            sequence_lengths=tuple(sequence_lengths),
+            num_runs=num_runs,
+        ),
+        "drift_embeddings": model.encode(drift_texts, normalize_embeddings=True),
+        # ru_maxrss is reported in kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--model-path", default="models/finetuned_bi_encoder")
+    arg_parser.add_argument(
+        "--input",
+        default="question_generator/output/parsed_content_with_questions.json",
+    )
+    arg_parser.add_argument(
+        "--holdout-fraction",
+        type=float,
+        default=None,
+        help="defaults to the fraction the training data was prepared with (EVAL_HOLDOUT_FRACTION), "
+        "any other value evaluates on trained questions",
+    )
+    arg_parser.add_argument(
+        "--variants",
+        nargs="+",
+        default=["torch", "onnx", "onnx-int8"],
+        choices=["torch", "onnx", "onnx-int8"],
+    )
+    arg_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32])
+    arg_parser.add_argument(
+        "--sequence-lengths", type=int, nargs="+", default=[32, 256]
+    )
+    arg_parser.add_argument("--runs", type=int, default=20)
+    arg_parser.add_argument(
+        "--quantization-config",
+        default=os.getenv("ONNX_QUANTIZATION_CONFIG", "avx2"),
+    )
+    arg_parser.add_argument("--drift-texts", type=int, default=256)
+    arg_parser.add_argument("--output", default="benchmarks/output/export_report.json")
+    args = arg_parser.parse_args()
+
+    from model_trainer.evaluation import RetrievalEvaluator, get_holdout_fraction
+
+    if args.holdout_fraction is None:
+        args.holdout_fraction = get_holdout_fraction()
+    evaluator = RetrievalEvaluator(
+        input_path=args.input, holdout_fraction=args.holdout_fraction
+    )
+    evaluator.load()
+    if not evaluator.queries:
+        raise SystemExit(
+            f"No held out questions in {args.input} at holdout fraction {args.holdout_fraction}, set "
+            f"EVAL_HOLDOUT_FRACTION above 0 and prepare the training data again"
+        )
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for variant in args.variants:
+        with context.Pool(1) as pool:
+            results[variant] = pool.apply(
+                run_variant,
+                (
+                    variant,
+                    args.model_path,
+                    args.input,
+                    args.holdout_fraction,
+                    args.batch_sizes,
+                    args.sequence_lengths,
+                    args.runs,
+                    args.quantization_config,
+                    args.drift_texts,
+                ),
+            )
+
+    drift_embeddings = {
+        variant: result.pop("drift_embeddings") for variant, result in results.items()
+    }
+    reference = results.get("torch")
+    for variant, result in results.items():
+        if reference is not None and variant != "torch":
+            # cosine similarity of every text's embedding with its pytorch embedding
+            similarities = np.sum(
+                drift_embeddings[variant] * drift_embeddings["torch"], axis=1
+            )
+            result["embedding_cosine_to_torch"] = {
+                "mean": float(similarities.mean()),
+                "min": float(similarities.min()),
+            }
+            result["retrieval_minus_torch"] = {
+                metric: value - reference["retrieval"][metric]
+                for metric, value in result["retrieval"].items()
+                if "@" in metric
+            }
+
+        latencies = " ".join(
+            f"b{encode['batch_size']}/s{encode['sequence_length']}:"
+            f"p50={encode['p50_ms']:.1f}ms,p99={encode['p99_ms']:.1f}ms"
+            for encode in result["encode"]
+        )
+        drift = (
+            f" cosine_to_torch={result['embedding_cosine_to_torch']['mean']:.4f}"
+            f" recall@10_delta={result['retrieval_minus_torch'].get('recall@10', 0.0):+.4f}"
+            if "embedding_cosine_to_torch" in result
+            else ""
+        )
+        print(
+            f"{variant:<10} load={result['load_seconds']:.1f}s peak_rss={result['peak_rss_mb']:.0f}MB "
+            f"{latencies}{drift}"
+        )
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(
+            {"timestamp": time.time(), "config": vars(args), "variants": results},
+            f,
+            ensure_ascii=False,
+            indent=4,
+        )
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
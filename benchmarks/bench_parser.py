@@ -0,0 +1,62 @@
+"""
+Docling parsing throughput on CPU per speed profile and page range sharding: pages/sec of every (profile, pages
+per shard) configuration, together with the number of sections and paragraphs it consolidates, so a faster
+configuration can be checked for losing text against the first one.
+
+usage: python -m benchmarks.bench_parser --pdf parser/data/AWQ.pdf --profiles fast full --pages-per-shard 0 8
+"""
+
+import argparse
+import time
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--pdf", default="parser/data/AWQ.pdf")
+    arg_parser.add_argument(
+        "--profiles", nargs="+", default=["fast", "full"], choices=["fast", "full"]
+    )
+    arg_parser.add_argument(
+        "--pages-per-shard",
+        type=int,
+        nargs="+",
+        default=[0, 8],
+        help="0 converts the whole pdf in one process",
+    )
+    arg_parser.add_argument("--workers", type=int, default=None)
+    args = arg_parser.parse_args()
+
+    from parser.docling_parser import PDFParser
+
+    baseline = None
+    for profile in args.profiles:
+        for pages_per_shard in args.pages_per_shard:
+            pdf_parser = PDFParser(
+                pdf_path=args.pdf,
+                output_path=None,
+                output_type="json",
+                profile=profile,
+                pages_per_shard=pages_per_shard,
+                num_workers=args.workers,
+                device="cpu",
+            )
+            start = time.perf_counter()
+            doc = pdf_parser.parse()
+            seconds = time.perf_counter() - start
+            pages = pdf_parser.get_num_pages(doc)
+            sections = pdf_parser.consolidate_text(doc)
+            paragraphs = sum(
+                len(section["text_contents"]) for section in sections.values()
+            )
+            if baseline is None:
+                baseline = (len(sections), paragraphs)
+            print(
+                f"profile={profile:<5} pages_per_shard={pages_per_shard:<3} pages={pages} "
+                f"seconds={seconds:.1f} pages_per_sec={pages / seconds:.2f} "
+                f"sections={len(sections)} ({len(sections) - baseline[0]:+d}) "
+                f"paragraphs={paragraphs} ({paragraphs - baseline[1]:+d})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Measures question generation throughput (chunks/sec) against a local mock OpenAI compatible server, together with
+the parse failure and retry rates. With --failure-rate the server answers free text requests with unparsable
+output at that rate, --no-structured-output makes it reject schema constrained requests so generation falls back
+to free text parsing.
+
+usage: python -m benchmarks.bench_question_generation --chunks 64 --latency 0.1 --concurrency 1 4 16
+       python -m benchmarks.bench_question_generation --failure-rate 0.2 --no-structured-output
+"""
+
+import argparse
+import os
+import time
+
+from benchmarks.mock_llm_server import start_mock_server
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--chunks", type=int, default=64)
+    arg_parser.add_argument("--latency", type=float, default=0.1)
+    arg_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    arg_parser.add_argument("--failure-rate", type=float, default=0.0)
+    arg_parser.add_argument("--no-structured-output", action="store_true")
+    arg_parser.add_argument("--retry-backoff", type=float, default=0.1)
+    args = arg_parser.parse_args()
+
+    server, base_url = start_mock_server(
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        structured_output=not args.no_structured_output,
+    )
+    # llm_utils reads the server url at import time, so the mock url has to be set first
+    os.environ["LLM_BASE_URL"] = base_url
+    from pipeline.instrumentation import metrics
+    from question_generator.generate_questions import GenerateQuestions
+
+    parsed_content = {
+        f"SECTION {idx}~1": {
+            "start_page": 1,
+            "text_contents": [f"Benchmark chunk number {idx}."],
+        }
+        for idx in range(args.chunks)
+    }
+    try:
+        for max_concurrency in args.concurrency:
+            metrics.reset()
+            generate_questions = GenerateQuestions(
+                parsed_content=parsed_content,
+                max_concurrency=max_concurrency,
+                retry_backoff_seconds=args.retry_backoff,
+            )
+            start = time.perf_counter()
+            generate_questions.generate_questions()
+            elapsed = time.perf_counter() - start
+            rates = metrics.get_rates()
+            print(
+                f"concurrency={max_concurrency:<4} chunks={args.chunks:<6} "
+                f"elapsed={elapsed:.2f}s chunks/sec={args.chunks / elapsed:.2f} "
+                f"requests={metrics.get_counter('llm.requests'):.0f} "
+                f"parse_failure_rate={rates.get('generate_parse_failure_rate', 0.0):.2%} "
+                f"retry_rate={rates.get('generate_retry_rate', 0.0):.2%} "
+                f"failed_chunks={metrics.get_counter('generate.failed_chunks'):.0f}"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
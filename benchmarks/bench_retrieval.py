@@ -0,0 +1,131 @@
+"""
+Compares the base and the fine-tuned bi-encoder on the held out generated questions (recall@k, MRR, nDCG) and
+measures their CPU encode latency across batch sizes and sequence lengths. The report is written as json and
+appended to a history file so regressions show up between runs.
+
+usage: python -m benchmarks.bench_retrieval --holdout-fraction 0.1 --batch-sizes 1 8 32 --sequence-lengths 32 128 512
+"""
+
+import argparse
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+
+def main():
+    load_dotenv()
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "--input",
+        default="question_generator/output/parsed_content_with_questions.json",
+    )
+    arg_parser.add_argument(
+        "--holdout-fraction",
+        type=float,
+        default=None,
+        help="defaults to the fraction the training data was prepared with (EVAL_HOLDOUT_FRACTION), "
+        "any other value evaluates on trained questions",
+    )
+    arg_parser.add_argument("--base-model", default=os.getenv("BI_ENCODER_MODEL_NAME"))
+    arg_parser.add_argument("--finetuned-model", default="models/finetuned_bi_encoder")
+    arg_parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10])
+    arg_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    arg_parser.add_argument(
+        "--sequence-lengths", type=int, nargs="+", default=[32, 128, 512]
+    )
+    arg_parser.add_argument("--runs", type=int, default=20)
+    arg_parser.add_argument(
+        "--output", default="benchmarks/output/retrieval_report.json"
+    )
+    args = arg_parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    from model_trainer.evaluation import RetrievalEvaluator, get_holdout_fraction
+
+    if args.holdout_fraction is None:
+        args.holdout_fraction = get_holdout_fraction()
+    evaluator = RetrievalEvaluator(
+        input_path=args.input,
+        holdout_fraction=args.holdout_fraction,
+        k_values=tuple(args.k),
+    )
+    evaluator.load()
+    if not evaluator.queries:
+        raise SystemExit(
+            f"No held out questions in {args.input} at holdout fraction {args.holdout_fraction}, set "
+            f"EVAL_HOLDOUT_FRACTION above 0 and prepare the training data again"
+        )
+    models = {"base": args.base_model}
+    if os.path.exists(args.finetuned_model):
+        models["finetuned"] = args.finetuned_model
+    else:
+        print(f"{args.finetuned_model} not found, evaluating the base model only")
+
+    report = {
+        "timestamp": time.time(),
+        "config": {
+            "input": args.input,
+            "holdout_fraction": args.holdout_fraction,
+            "k": args.k,
+            "batch_sizes": args.batch_sizes,
+            "sequence_lengths": args.sequence_lengths,
+            "runs": args.runs,
+        },
+        "models": {},
+    }
+    for name, model_path in models.items():
+        model = SentenceTransformer(
+            model_path, device="cpu", cache_folder=os.getenv("CACHE_DIR")
+        )
+        retrieval = evaluator.evaluate(model)
+        encode = evaluator.benchmark_encode(
+            model,
+            batch_sizes=tuple(args.batch_sizes),
+            sequence_lengths=tuple(args.sequence_lengths),
+            num_runs=args.runs,
+        )
+        report["models"][name] = {
+            "model": model_path,
+            "retrieval": retrieval,
+            "encode": encode,
+        }
+        print(
+            f"{name:<10} "
+            + " ".join(
+                f"{metric}={value:.4f}"
+                for metric, value in retrieval.items()
+                if "@" in metric
+            )
+        )
+        for result in encode:
+            print(
+                f"{name:<10} batch={result['batch_size']:<4} seq={result['sequence_length']:<5} "
+                f"p50={result['p50_ms']:.2f}ms p99={result['p99_ms']:.2f}ms "
+                f"throughput={result['texts_per_sec']:.1f} texts/s"
+            )
+        del model
+
+    if "finetuned" in report["models"]:
+        base_retrieval = report["models"]["base"]["retrieval"]
+        report["finetuned_minus_base"] = {
+            metric: value - base_retrieval[metric]
+            for metric, value in report["models"]["finetuned"]["retrieval"].items()
+            if "@" in metric
+        }
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    history_path = os.path.join(
+        os.path.dirname(args.output) or ".", "retrieval_history.jsonl"
+    )
+    with open(history_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(report, ensure_ascii=False) + "\n")
+    print(f"Report written to {args.output}, appended to {history_path}")
+
+
+if __name__ == "__main__":
+    main()
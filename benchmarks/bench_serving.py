@@ -0,0 +1,136 @@
+"""
+Load generator for the search service: concurrent clients send /search requests for a fixed duration and the
+achieved QPS and latency percentiles are reported, together with the batching and cache statistics of the server.
+
+usage: python -m benchmarks.bench_serving --url http://127.0.0.1:8080 --concurrency 1 8 32 --duration 10
+"""
+
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+
+def load_queries(input_path: str | None, num_synthetic: int = 1000):
+    """
+    used to get the queries sent to the server, the generated questions when available
+    :param input_path: parsed content with questions, json or jsonl(.zst)
+    :param num_synthetic: number of synthetic queries used without an input
+    :return:
+    """
+    if input_path:
+        from model_trainer.evaluation import RetrievalEvaluator
+
+        evaluator = RetrievalEvaluator(input_path=input_path, holdout_fraction=1.0)
+        evaluator.load()
+        if evaluator.queries:
+            return [question for question, _ in evaluator.queries]
+    return [
+        f"What does section {idx} say about quantization?"
+        for idx in range(num_synthetic)
+    ]
+
+
+def post_json(url: str, payload: dict):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.loads(response.read())
+
+
+def get_stats(url: str):
+    with urllib.request.urlopen(f"{url}/stats", timeout=60) as response:
+        return json.loads(response.read())
+
+
+def run_load(url: str, queries: list, concurrency: int, duration: float, top_k: int):
+    """
+    used to send requests from concurrency client threads until duration seconds have passed
+    :return: dict with QPS, latency percentiles and the error count
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(client_idx: int):
+        idx = client_idx
+        while time.perf_counter() < deadline:
+            query = queries[idx % len(queries)]
+            idx += concurrency
+            start = time.perf_counter()
+            try:
+                post_json(f"{url}/search", {"query": query, "top_k": top_k})
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=client, args=(client_idx,))
+        for client_idx in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "qps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "max_ms": float(latencies_ms.max()),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--url", default="http://127.0.0.1:8080")
+    arg_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    arg_parser.add_argument("--duration", type=float, default=10)
+    arg_parser.add_argument("--top-k", type=int, default=5)
+    arg_parser.add_argument(
+        "--input",
+        default=None,
+        help="parsed content with questions to draw queries from, synthetic queries otherwise",
+    )
+    args = arg_parser.parse_args()
+
+    queries = load_queries(args.input)
+    for concurrency in args.concurrency:
+        stats_before = get_stats(args.url)
+        result = run_load(args.url, queries, concurrency, args.duration, args.top_k)
+        stats = get_stats(args.url)
+        batches = stats["batches"] - stats_before["batches"]
+        mean_batch_size = (
+            (stats["queries"] - stats_before["queries"]) / batches if batches else 0.0
+        )
+        print(
+            f"concurrency={result['concurrency']:<4} qps={result['qps']:.1f} "
+            f"p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms "
+            f"p99={result['p99_ms']:.2f}ms max={result['max_ms']:.2f}ms "
+            f"errors={result['errors']} "
+            f"mean_batch_size={mean_batch_size:.2f} "
+            f"cache_hits={stats['cache_hits'] - stats_before['cache_hits']}"
+        )
+        if result["first_error"]:
+            print(f"first error: {result['first_error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Startup cost of the pipeline entry points, measured with python -X importtime in fresh interpreters: total import
+time, the heaviest top level imports and whether a target pulled in a dependency it should leave to the stages
+(torch, docling, sentence-transformers, ...). Exits with status 1 when a target imports a forbidden module or
+goes over its budget, so it can guard against import time regressions.
+
+usage: python -m benchmarks.bench_startup --repeat 5 --budget-ms 300
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# statement executed per target, cli is what python main.py <stage> pays before the stage starts
+TARGETS = {
+    "cli": "import main",
+    "stages": "import pipeline.stages",
+    "generate": "import question_generator.generate_questions",
+    "batch": "import question_generator.batch",
+    "parse": "import parser.docling_parser",
+    "train": "import model_trainer.trainer",
+}
+# heavy dependencies that must only be imported by the stage using them
+HEAVY_MODULES = (
+    "torch",
+    "transformers",
+    "sentence_transformers",
+    "datasets",
+    "docling",
+    "chromadb",
+    "openai",
+    "huggingface_hub",
+)
+# targets that have to stay free of the heavy dependencies
+LIGHT_TARGETS = ("cli", "stages", "generate", "batch")
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_import_times(stderr: str):
+    """
+    used to read the output of -X importtime
+    :param stderr:
+    :return: (imported module names, {top level module: cumulative microseconds})
+    """
+    modules = set()
+    top_level = {}
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        cumulative_us, indent, module = (
+            int(match.group(2)),
+            len(match.group(3)),
+            match.group(4),
+        )
+        modules.add(module)
+        # nested imports are indented by two spaces per level below the import statement that caused them
+        if indent <= 1:
+            top_level[module] = top_level.get(module, 0) + cumulative_us
+    return modules, top_level
+
+
+def measure_target(statement: str):
+    """
+    used to run one import statement in a fresh interpreter from the project root
+    :param statement:
+    :return: dict of wall time, import time, heaviest imports and imported modules, or the error
+    """
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    modules, top_level = parse_import_times(process.stderr)
+    result = {
+        "wall_ms": wall_ms,
+        "import_ms": sum(top_level.values()) / 1000,
+        "heaviest": sorted(top_level.items(), key=lambda item: -item[1])[:5],
+        "modules": modules,
+    }
+    if process.returncode != 0:
+        result["error"] = process.stderr.strip().splitlines()[-1]
+    return result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "--targets", nargs="+", default=list(TARGETS), choices=list(TARGETS)
+    )
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=None,
+        help="fail when the median import time of a light target exceeds it",
+    )
+    args = arg_parser.parse_args()
+
+    failures = []
+    for target in args.targets:
+        runs = [measure_target(TARGETS[target]) for _ in range(args.repeat)]
+        if "error" in runs[-1]:
+            print(f"{target:<10} failed: {runs[-1]['error']}")
+            if target in LIGHT_TARGETS:
+                failures.append(f"{target} failed to import")
+            continue
+        import_ms = statistics.median(run["import_ms"] for run in runs)
+        wall_ms = statistics.median(run["wall_ms"] for run in runs)
+        heavy = sorted(
+            module for module in HEAVY_MODULES if module in runs[-1]["modules"]
+        )
+        heaviest = ", ".join(
+            f"{module}={cumulative_us / 1000:.0f}ms"
+            for module, cumulative_us in runs[-1]["heaviest"]
+        )
+        print(
+            f"{target:<10} imports={import_ms:.0f}ms wall={wall_ms:.0f}ms "
+            f"heavy=[{', '.join(heavy)}] heaviest: {heaviest}"
+        )
+        if target in LIGHT_TARGETS:
+            if heavy:
+                failures.append(f"{target} imports {', '.join(heavy)}")
+            if args.budget_ms is not None and import_ms > args.budget_ms:
+                failures.append(
+                    f"{target} import time {import_ms:.0f}ms over the {args.budget_ms:.0f}ms budget"
+                )
+
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
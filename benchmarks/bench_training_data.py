@@ -0,0 +1,117 @@
+"""
+Compares the json training data with the arrow triplet store on synthetic triplets: disk size, write time, time
+until the first training batch is available and peak RSS of loading the data and materializing every batch.
+Every (format, corpus size) pair is loaded in its own process so peak RSS is not shared.
+
+usage: python -m benchmarks.bench_training_data --chunks 500 2000 --questions-per-chunk 5 --negatives 3
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+
+
+def iter_triplets(num_chunks: int, questions_per_chunk: int, num_negatives: int):
+    rng = random.Random(0)
+    # roughly the size of a chunk cut to a 2000 token context window
+    chunks = [
+        f"chunk {idx} " + " ".join(f"word{rng.randrange(5000)}" for _ in range(1500))
+        for idx in range(num_chunks)
+    ]
+    for chunk_idx, chunk in enumerate(chunks):
+        for question_idx in range(questions_per_chunk):
+            for _ in range(num_negatives):
+                yield {
+                    "anchor": f"question {question_idx} about chunk {chunk_idx}?",
+                    "positive": chunk,
+                    "negative": chunks[rng.randrange(num_chunks)],
+                }
+
+
+def load_and_iterate(training_data_format: str, path: str, batch_size: int):
+    """
+    used to load the training data the way train does and materialize every batch in the current process
+    :return: dict of timings and peak RSS
+    """
+    start = time.perf_counter()
+    if training_data_format == "arrow":
+        from model_trainer.triplet_store import TripletStore
+
+        dataset = TripletStore(path).load()
+    else:
+        from datasets import Dataset
+
+        with open(path, "r") as f:
+            dataset = Dataset.from_list(json.load(f))
+    dataset[:batch_size]
+    first_batch_seconds = time.perf_counter() - start
+    for batch_start in range(0, dataset.num_rows, batch_size):
+        dataset[batch_start : batch_start + batch_size]
+    return {
+        "first_batch_seconds": first_batch_seconds,
+        "epoch_seconds": time.perf_counter() - start,
+        # ru_maxrss is reported in kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--chunks", type=int, nargs="+", default=[500, 2000])
+    arg_parser.add_argument("--questions-per-chunk", type=int, default=5)
+    arg_parser.add_argument("--negatives", type=int, default=3)
+    arg_parser.add_argument("--batch-size", type=int, default=32)
+    arg_parser.add_argument(
+        "--formats", nargs="+", default=["json", "arrow"], choices=["json", "arrow"]
+    )
+    args = arg_parser.parse_args()
+
+    from model_trainer.triplet_store import TripletStore
+
+    context = multiprocessing.get_context("spawn")
+    for num_chunks in args.chunks:
+        for training_data_format in args.formats:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, f"training_data.{training_data_format}")
+                start = time.perf_counter()
+                if training_data_format == "arrow":
+                    triplet_store = TripletStore(path)
+                    num_triplets, _ = triplet_store.write(
+                        iter_triplets(
+                            num_chunks, args.questions_per_chunk, args.negatives
+                        )
+                    )
+                    size_bytes = triplet_store.get_size_bytes()
+                else:
+                    training_data = list(
+                        iter_triplets(
+                            num_chunks, args.questions_per_chunk, args.negatives
+                        )
+                    )
+                    num_triplets = len(training_data)
+                    with open(path, "w") as f:
+                        json.dump(training_data, f)
+                    del training_data
+                    size_bytes = os.path.getsize(path)
+                write_seconds = time.perf_counter() - start
+
+                with context.Pool(1) as pool:
+                    result = pool.apply(
+                        load_and_iterate,
+                        (training_data_format, path, args.batch_size),
+                    )
+            print(
+                f"format={training_data_format:<5} chunks={num_chunks:<7} triplets={num_triplets:<8} "
+                f"disk={size_bytes / 2**20:.1f}MB write={write_seconds:.2f}s "
+                f"first_batch={result['first_batch_seconds']:.2f}s epoch={result['epoch_seconds']:.2f}s "
+                f"peak_rss={result['peak_rss_mb']:.0f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
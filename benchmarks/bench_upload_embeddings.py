@@ -0,0 +1,83 @@
+"""
+Compares chunk upload throughput (chunks/sec) of the per-item and the batched ingestion paths of
+BiEncoderTrainer against a temporary Chroma database.
+
+usage: python -m benchmarks.bench_upload_embeddings --chunks 512 --batch-size 32
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+
+def build_parsed_content(num_chunks: int):
+    """
+    used to build a synthetic parsed content with questions document
+    :param num_chunks:
+    :return:
+    """
+    return {
+        f"SECTION {idx}~1": {
+            "start_page": 1,
+            "text_with_questions": [
+                {
+                    "text_content": f"Synthetic benchmark chunk {idx}. "
+                    + "Activation aware weight quantization protects salient weights. "
+                    * 8,
+                    "questions": [],
+                }
+            ],
+        }
+        for idx in range(num_chunks)
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--chunks", type=int, default=512)
+    arg_parser.add_argument("--batch-size", type=int, default=32)
+    arg_parser.add_argument("--upsert-batch-size", type=int, default=1000)
+    args = arg_parser.parse_args()
+
+    load_dotenv()
+    from model_trainer.trainer import BiEncoderTrainer
+    from model_trainer.vector_index import ChromaVectorIndex
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "parsed_content_with_questions.json")
+        with open(input_path, "w", encoding="utf-8") as f:
+            json.dump(build_parsed_content(args.chunks), f)
+
+        trainer = BiEncoderTrainer(
+            db_path=os.path.join(tmp_dir, "db"), collection_name="per_item"
+        )
+        start = time.perf_counter()
+        trainer.upload_embeddings_per_item(input_path=input_path)
+        elapsed = time.perf_counter() - start
+        print(
+            f"per-item  chunks={args.chunks:<6} elapsed={elapsed:.2f}s "
+            f"chunks/sec={args.chunks / elapsed:.2f}"
+        )
+
+        trainer.index = ChromaVectorIndex(
+            path=os.path.join(tmp_dir, "db"), collection_name="batched"
+        )
+        start = time.perf_counter()
+        trainer.upload_embeddings(
+            batch_size=args.batch_size,
+            upsert_batch_size=args.upsert_batch_size,
+            input_path=input_path,
+        )
+        elapsed = time.perf_counter() - start
+        print(
+            f"batched   chunks={args.chunks:<6} elapsed={elapsed:.2f}s "
+            f"chunks/sec={args.chunks / elapsed:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Compares the chroma and numpy vector index backends on synthetic embeddings: build time, batched query latency
+and peak RSS. Every (backend, corpus size) pair runs in its own process so peak RSS is not shared.
+
+usage: python -m benchmarks.bench_vector_index --sizes 10000 50000 --dim 768 --backends chroma numpy
+"""
+
+import argparse
+import multiprocessing
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+
+def run_backend(backend: str, size: int, dim: int, num_queries: int, n_results: int):
+    """
+    used to build, save, reload and query one index in the current process
+    :return: dict of timings and peak RSS
+    """
+    from model_trainer.vector_index import get_vector_index
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(size, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    queries = embeddings[rng.choice(size, num_queries, replace=False)]
+    ids = [str(idx) for idx in range(size)]
+    documents = [f"document {idx}" for idx in range(size)]
+    metadatas = [{"title": f"SECTION {idx % 100}~1"} for idx in range(size)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index = get_vector_index(backend, path=tmp_dir)
+        start = time.perf_counter()
+        for batch_start in range(0, size, 5000):
+            batch_end = batch_start + 5000
+            index.upsert(
+                ids[batch_start:batch_end],
+                embeddings[batch_start:batch_end],
+                documents[batch_start:batch_end],
+                metadatas[batch_start:batch_end],
+            )
+        index.save()
+        build_seconds = time.perf_counter() - start
+
+        del embeddings, index
+        index = get_vector_index(backend, path=tmp_dir)
+        index.query_batch(queries[:1], n_results=n_results)
+        start = time.perf_counter()
+        for query in queries:
+            index.query_batch(query[None, :], n_results=n_results)
+        single_query_ms = (time.perf_counter() - start) * 1000 / num_queries
+        start = time.perf_counter()
+        index.query_batch(queries, n_results=n_results)
+        batch_query_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        "backend": backend,
+        "size": size,
+        "build_seconds": build_seconds,
+        "single_query_ms": single_query_ms,
+        "batch_query_ms": batch_query_ms,
+        # ru_maxrss is reported in kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    arg_parser.add_argument("--dim", type=int, default=768)
+    arg_parser.add_argument("--queries", type=int, default=256)
+    arg_parser.add_argument("--n-results", type=int, default=5)
+    arg_parser.add_argument(
+        "--backends", nargs="+", default=["chroma", "numpy"], choices=["chroma", "numpy"]
+    )
+    args = arg_parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    for size in args.sizes:
+        for backend in args.backends:
+            with context.Pool(1) as pool:
+                result = pool.apply(
+                    run_backend,
+                    (backend, size, args.dim, args.queries, args.n_results),
+                )
+            print(
+                f"backend={result['backend']:<7} size={result['size']:<8} "
+                f"build={result['build_seconds']:.2f}s "
+                f"query={result['single_query_ms']:.2f}ms "
+                f"batch_query({args.queries})={result['batch_query_ms']:.2f}ms "
+                f"peak_rss={result['peak_rss_mb']:.0f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
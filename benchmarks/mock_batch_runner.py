@@ -0,0 +1,105 @@
+"""
+Stand-in for vLLM's offline batch runner: reads an OpenAI batch input file and writes a batch output file with
+the mock questions as every answer, so the batch mode of question generation can be exercised without a GPU.
+
+usage: python -m benchmarks.mock_batch_runner -i question_generator/batch/requests.jsonl \
+           -o question_generator/batch/results.jsonl --failure-rate 0.1
+"""
+
+import argparse
+import json
+import random
+import time
+
+from benchmarks.mock_llm_server import MOCK_QUESTIONS
+from pipeline.jsonl_io import JsonlWriter, read_jsonl
+
+
+def run_mock_batch(
+    input_path: str,
+    output_path: str,
+    failure_rate: float = 0.0,
+    error_rate: float = 0.0,
+    seed: int = 0,
+):
+    """
+    used to answer every request of a batch input file
+    :param input_path: OpenAI batch input file
+    :param output_path: OpenAI batch output file
+    :param failure_rate: probability of an unparsable answer to a request without a response_format
+    :param error_rate: probability of a failed request, written with an error instead of a response
+    :param seed: seed of the failures
+    :return: number of results written
+    """
+    rng = random.Random(seed)
+    with JsonlWriter(output_path) as writer:
+        for idx, request in enumerate(read_jsonl(input_path)):
+            body = request["body"]
+            if rng.random() < error_rate:
+                writer.write(
+                    {
+                        "id": f"batch-mock-{idx}",
+                        "custom_id": request["custom_id"],
+                        "response": None,
+                        "error": {"message": "mock request failure"},
+                    }
+                )
+                continue
+            content = json.dumps(MOCK_QUESTIONS)
+            constrained = "response_format" in body or "guided_json" in body
+            if not constrained and rng.random() < failure_rate:
+                content = "Here are some questions: " + content[:-5]
+            writer.write(
+                {
+                    "id": f"batch-mock-{idx}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "request_id": f"batch-mock-{idx}",
+                        "body": {
+                            "id": f"chatcmpl-mock-{idx}",
+                            "object": "chat.completion",
+                            "created": int(time.time()),
+                            "model": body.get("model", "mock"),
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "message": {
+                                        "role": "assistant",
+                                        "content": content,
+                                    },
+                                    "finish_reason": "stop",
+                                }
+                            ],
+                            "usage": {
+                                "prompt_tokens": 0,
+                                "completion_tokens": 0,
+                                "total_tokens": 0,
+                            },
+                        },
+                    },
+                    "error": None,
+                }
+            )
+    return writer.count
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "-i", "--input", default="question_generator/batch/requests.jsonl"
+    )
+    arg_parser.add_argument(
+        "-o", "--output", default="question_generator/batch/results.jsonl"
+    )
+    arg_parser.add_argument("--failure-rate", type=float, default=0.0)
+    arg_parser.add_argument("--error-rate", type=float, default=0.0)
+    args = arg_parser.parse_args()
+    num_results = run_mock_batch(
+        args.input, args.output, args.failure_rate, args.error_rate
+    )
+    print(f"Wrote {num_results} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
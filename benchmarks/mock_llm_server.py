@@ -0,0 +1,106 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOCK_QUESTIONS = {"questions": [f"Mock question {idx}?" for idx in range(1, 6)]}
+
+
+class MockChatCompletionHandler(BaseHTTPRequestHandler):
+    """
+    minimal OpenAI compatible /v1/chat/completions endpoint, every request sleeps for the configured latency
+    before answering so that throughput only improves when requests are issued concurrently. Free text requests
+    get an unparsable answer with probability failure_rate, schema constrained requests always get valid JSON
+    unless the server is configured without structured output support, in which case they are rejected.
+    """
+
+    latency = 0.1
+    failure_rate = 0.0
+    structured_output = True
+
+    def send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        content_length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(content_length) or b"{}")
+        constrained = "response_format" in request or "guided_json" in request
+        if constrained and not self.structured_output:
+            self.send_json(
+                400,
+                {
+                    "error": {
+                        "message": "response_format is not supported",
+                        "type": "BadRequestError",
+                    }
+                },
+            )
+            return
+        time.sleep(self.latency)
+        content = json.dumps(MOCK_QUESTIONS)
+        if not constrained and random.random() < self.failure_rate:
+            content = "Here are some questions: " + content[:-5]
+        self.send_json(
+            200,
+            {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": content,
+                        },
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "total_tokens": 0,
+                },
+            },
+        )
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(
+    latency: float = 0.1,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    failure_rate: float = 0.0,
+    structured_output: bool = True,
+):
+    """
+    start the mock server in a daemon thread
+    :param latency: seconds every request takes to complete
+    :param host:
+    :param port: 0 picks a free port
+    :param failure_rate: probability of an unparsable answer to a free text request
+    :param structured_output: accept response_format / guided_json requests, rejected with 400 otherwise
+    :return: running server, base url of the OpenAI compatible api
+    """
+    handler = type(
+        "ConfiguredMockChatCompletionHandler",
+        (MockChatCompletionHandler,),
+        {
+            "latency": latency,
+            "failure_rate": failure_rate,
+            "structured_output": structured_output,
+        },
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
@@ -1,43 +1,116 @@
-import json
+"""
+usage: python main.py [run|parse|dedup|generate|embed|mine|train|export] [--force]
+
+run (the default) executes the whole pipeline, the other commands run a single stage. Heavy dependencies are
+imported by the stage that needs them, so e.g. generate never loads torch or docling.
+"""
+
+import argparse
 import os
-from parser.docling_parser import PDFParser
 
-from model_trainer.trainer import BiEncoderTrainer
-from question_generator.generate_questions import GenerateQuestions
+from dotenv import load_dotenv
 
-if __name__ == "__main__":
-    pdf_parser = PDFParser(
-        pdf_path="parser/data/AWQ.pdf", output_path="parser/output/", output_type="json"
+from pipeline.instrumentation import metrics
+
+# loaded before the stage modules are imported, some of them read their config at import time
+load_dotenv()
+
+STAGES = ("parse", "dedup", "generate", "embed", "mine", "train", "export")
+
+
+def confirm_vllm_stopped():
+    vllm_switched_off = input(
+        "Terminate vllm manually, after killing it confirm by typing 'yes' : "
     )
-    pdf_parser.save()
+    return vllm_switched_off.lower() == "yes"
+
 
-    with open("parser/output/tokenizer_adjusted_parsed_output.json", "r") as f:
-        parsed_content = json.load(f)
-    generate_questions = GenerateQuestions(parsed_content=parsed_content)
-    parsed_content_with_questions = (
-        generate_questions.orchestrate_questions_generation()
+def get_pipeline_stages(force: bool = False):
+    from pipeline.stages import PipelineStages
+
+    # stages whose inputs and config are unchanged since the last run are skipped,
+    # FORCE_RERUN=true runs everything again
+    return PipelineStages(
+        force=force or os.getenv("FORCE_RERUN", "false").lower() == "true"
     )
-    with open(
-        "question_generator/output/parsed_content_with_questions.json",
-        "w",
-        encoding="utf-8",
-    ) as f:
-        json.dump(
-            parsed_content_with_questions,
-            f,
-            ensure_ascii=False,
-            indent=4,
+
+
+def run_stage(stage: str, force: bool = False):
+    """
+    used to run a single stage, skipped like in a full run when its inputs and config are unchanged
+    :param stage: one of STAGES
+    :param force: run the stage regardless of the manifest
+    :return: True if the stage ran
+    """
+    return getattr(get_pipeline_stages(force), stage)()
+
+
+def run_pipeline(force: bool = False):
+    pipeline_stages = get_pipeline_stages(force)
+    batch_mode = pipeline_stages.question_generation_mode == "batch"
+    if os.getenv("PIPELINE_MODE", "sequential") == "streaming" and not batch_mode:
+        from pipeline.streaming import StreamingPipeline
+
+        # chunks are embedded and their questions encoded while generation is still running
+        trained = StreamingPipeline(
+            pipeline_stages,
+            queue_size=int(os.getenv("STREAMING_QUEUE_SIZE", "256")),
+        ).run(confirm_training=confirm_vllm_stopped)
+        vllm_switched_off = trained is not None
+    else:
+        pipeline_stages.parse()
+        pipeline_stages.dedup()
+        questions_generated = pipeline_stages.generate()
+        if pipeline_stages.awaiting_batch_results:
+            return
+
+        # vLLM is only needed when questions were generated in this run, batch files need no server
+        vllm_switched_off = (
+            not questions_generated or batch_mode or confirm_vllm_stopped()
         )
+        trained = False
+        if vllm_switched_off:
+            pipeline_stages.embed()
+            pipeline_stages.mine()
+            trained = pipeline_stages.train()
+    if vllm_switched_off:
+        if os.getenv("EXPORT_ONNX", "false").lower() == "true":
+            pipeline_stages.export()
+        if trained and os.getenv("HF_REPO_NAME"):
+            pipeline_stages.get_trainer().upload_to_huggingface(
+                os.getenv("HF_REPO_NAME")
+            )
 
-    vllm_switched_off = input(
-        "Terminate vllm manually, after killing it confirm by typing 'yes' : "
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Fine-tune a bi-encoder on questions generated from parsed documents"
+    )
+    arg_parser.add_argument(
+        "command",
+        nargs="?",
+        default="run",
+        choices=("run",) + STAGES,
+        help="run executes every stage, the others a single stage",
+    )
+    arg_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="run regardless of the run manifest, like FORCE_RERUN=true",
     )
-    if vllm_switched_off.lower() == "yes":
-        bi_encoder_trainer = BiEncoderTrainer()
-        bi_encoder_trainer.upload_embeddings()
-        bi_encoder_trainer.prepare_training_data()
-        bi_encoder_trainer.train()
-        if os.getenv("HF_REPO_NAME"):
-            bi_encoder_trainer.upload_to_huggingface(os.getenv("HF_REPO_NAME"))
+    args = arg_parser.parse_args()
+    try:
+        if args.command == "run":
+            run_pipeline(args.force)
+        else:
+            run_stage(args.command, args.force)
+    finally:
+        # written also when a stage fails, so the time spent up to the failure is visible
+        metrics.write_report("pipeline/output/run_report.json")
+        print("Run report written to pipeline/output/run_report.json")
+
+
+if __name__ == "__main__":
+    main()
 
 # vllm serve meta-llama/Llama-3.2-3B-Instruct --max-model-len 3000 --max-num-batched-tokens 3000 --dtype auto --api-key praveen@123
@@ -0,0 +1,297 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    disk backed cache of text embeddings shared by every encode call of the trainer.
+    Vectors are stored as rows of one memory-mapped float16 file per namespace (model id, revision, normalization)
+    and an SQLite index maps the hash of each text to its row. The least recently used entries are evicted once
+    the cached vectors grow beyond max_size_bytes, their rows are reused by later inserts. The size of each
+    namespace is summed once when the cache is opened and kept up to date on every write, so a write does not scan
+    the index.
+    """
+
+    # rows looked up per sqlite statement, stays below the host parameter limit of older sqlite builds
+    query_batch_size = 900
+
+    def __init__(
+        self,
+        path: str = "model_trainer/cache/embeddings",
+        max_size_bytes: int = 1024 * 1024 * 1024,
+    ):
+        """
+        :param path: directory holding the index and the vector files
+        :param max_size_bytes: maximum size of the cached vectors
+        """
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        os.makedirs(path, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            os.path.join(path, "index.sqlite"), check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS namespaces (
+                namespace TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                num_rows INTEGER NOT NULL,
+                capacity INTEGER NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                last_accessed REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS free_rows (
+                namespace TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                PRIMARY KEY (namespace, row)
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_accessed ON embeddings (last_accessed)"
+        )
+        self.connection.commit()
+        self.vectors = {}
+        # bytes of cached vectors per namespace
+        self.namespace_sizes = dict(
+            self.connection.execute(
+                """
+                SELECT namespaces.namespace, COUNT(embeddings.key) * namespaces.dim * ?
+                FROM namespaces LEFT JOIN embeddings ON embeddings.namespace = namespaces.namespace
+                GROUP BY namespaces.namespace
+                """,
+                (np.dtype(np.float16).itemsize,),
+            ).fetchall()
+        )
+
+    @staticmethod
+    def build_namespace(model_id: str, revision: str | None, normalize: bool):
+        """
+        used to build the namespace embeddings of one model configuration are stored under
+        :param model_id: model name or path
+        :param revision: model revision, embeddings of other revisions are never served
+        :param normalize: whether the embeddings are normalized to unit length
+        :return: sha256 hex digest of the canonical json of the model configuration
+        """
+        canonical_config = json.dumps(
+            {"model_id": model_id, "revision": revision, "normalize": normalize},
+            sort_keys=True,
+        )
+        return hashlib.sha256(canonical_config.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def build_key(text: str):
+        """
+        used to build the cache key of a text
+        :param text:
+        :return: sha256 hex digest of the text
+        """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_vectors(self, namespace: str, dim: int, capacity: int):
+        """
+        used to get the memory-mapped vector file of a namespace, expects the lock held
+        :param namespace:
+        :param dim:
+        :param capacity: number of rows the file holds
+        :return: (capacity, dim) float16 memmap
+        """
+        vectors = self.vectors.get(namespace)
+        if vectors is None or len(vectors) != capacity:
+            vectors_path = os.path.join(self.path, f"{namespace}.f16")
+            if (
+                not os.path.exists(vectors_path)
+                or os.path.getsize(vectors_path)
+                < capacity * dim * np.dtype(np.float16).itemsize
+            ):
+                with open(vectors_path, "ab") as f:
+                    f.truncate(capacity * dim * np.dtype(np.float16).itemsize)
+            vectors = np.memmap(
+                vectors_path, dtype=np.float16, mode="r+", shape=(capacity, dim)
+            )
+            self.vectors[namespace] = vectors
+        return vectors
+
+    def get_many(self, namespace: str, keys: list):
+        """
+        used to fetch the cached embeddings of several texts and mark them as recently used
+        :param namespace:
+        :param keys: text keys from build_key
+        :return: list with a float16 vector per key, None on a cache miss
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT dim, capacity FROM namespaces WHERE namespace = ?",
+                (namespace,),
+            ).fetchone()
+            if row is None:
+                return [None] * len(keys)
+            dim, capacity = row
+            rows = {}
+            unique_keys = list(dict.fromkeys(keys))
+            for start in range(0, len(unique_keys), self.query_batch_size):
+                key_batch = unique_keys[start : start + self.query_batch_size]
+                rows.update(
+                    self.connection.execute(
+                        f"SELECT key, row FROM embeddings WHERE namespace = ? "
+                        f"AND key IN ({','.join('?' * len(key_batch))})",
+                        (namespace, *key_batch),
+                    ).fetchall()
+                )
+            if not rows:
+                return [None] * len(keys)
+            self.connection.executemany(
+                "UPDATE embeddings SET last_accessed = ? WHERE namespace = ? AND key = ?",
+                [(time.time(), namespace, key) for key in rows],
+            )
+            self.connection.commit()
+            vectors = self.get_vectors(namespace, dim, capacity)
+            return [
+                np.array(vectors[rows[key]]) if key in rows else None for key in keys
+            ]
+
+    def set_many(self, namespace: str, keys: list, embeddings: np.ndarray):
+        """
+        used to store the embeddings of several texts and evict the least recently used entries if the cache is
+        over its size limit
+        :param namespace:
+        :param keys: text keys from build_key, unique
+        :param embeddings: (len(keys), dim) matrix
+        :return:
+        """
+        if not keys:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float16)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT dim, num_rows, capacity FROM namespaces WHERE namespace = ?",
+                (namespace,),
+            ).fetchone()
+            if row is None:
+                dim, num_rows, capacity = embeddings.shape[1], 0, 0
+                self.connection.execute(
+                    "INSERT INTO namespaces VALUES (?, ?, 0, 0)", (namespace, dim)
+                )
+            else:
+                dim, num_rows, capacity = row
+            if embeddings.shape[1] != dim:
+                raise ValueError(
+                    f"Embedding dimension {embeddings.shape[1]} doesn't match the cached dimension {dim}"
+                )
+
+            # entries that are already cached keep their row, the others reuse freed rows before growing the file
+            existing_rows = {}
+            for start in range(0, len(keys), self.query_batch_size):
+                key_batch = keys[start : start + self.query_batch_size]
+                existing_rows.update(
+                    self.connection.execute(
+                        f"SELECT key, row FROM embeddings WHERE namespace = ? "
+                        f"AND key IN ({','.join('?' * len(key_batch))})",
+                        (namespace, *key_batch),
+                    ).fetchall()
+                )
+            num_new_rows = len(keys) - len(existing_rows)
+            free_rows = [
+                free_row
+                for (free_row,) in self.connection.execute(
+                    "SELECT row FROM free_rows WHERE namespace = ? ORDER BY row LIMIT ?",
+                    (namespace, num_new_rows),
+                ).fetchall()
+            ]
+            self.connection.executemany(
+                "DELETE FROM free_rows WHERE namespace = ? AND row = ?",
+                [(namespace, free_row) for free_row in free_rows],
+            )
+            new_rows = free_rows + list(
+                range(num_rows, num_rows + num_new_rows - len(free_rows))
+            )
+            num_rows += num_new_rows - len(free_rows)
+            if num_rows > capacity:
+                capacity = max(num_rows, 2 * capacity, 1024)
+
+            new_rows = iter(new_rows)
+            rows = [
+                existing_rows[key] if key in existing_rows else next(new_rows)
+                for key in keys
+            ]
+            vectors = self.get_vectors(namespace, dim, capacity)
+            vectors[rows] = embeddings
+            vectors.flush()
+            now = time.time()
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                [(namespace, key, row, now) for key, row in zip(keys, rows)],
+            )
+            self.connection.execute(
+                "UPDATE namespaces SET num_rows = ?, capacity = ? WHERE namespace = ?",
+                (num_rows, capacity, namespace),
+            )
+            self.namespace_sizes[namespace] = (
+                self.namespace_sizes.get(namespace, 0)
+                + num_new_rows * dim * np.dtype(np.float16).itemsize
+            )
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        """
+        used to delete the least recently used entries until the cached vectors fit max_size_bytes, expects the
+        lock held. Rows of evicted entries are reused, the vector files are not shrunk.
+        :return:
+        """
+        itemsize = np.dtype(np.float16).itemsize
+        total_size = sum(self.namespace_sizes.values())
+        if total_size <= self.max_size_bytes:
+            return
+        # walks the last_accessed index from the oldest entry and stops as soon as the cache fits
+        rows = self.connection.execute(
+            """
+            SELECT embeddings.namespace, embeddings.key, embeddings.row, namespaces.dim FROM embeddings
+            JOIN namespaces ON embeddings.namespace = namespaces.namespace
+            ORDER BY embeddings.last_accessed ASC
+            """
+        )
+        evicted_entries = []
+        for namespace, key, row, dim in rows:
+            if total_size <= self.max_size_bytes:
+                break
+            evicted_entries.append((namespace, key, row))
+            total_size -= dim * itemsize
+            self.namespace_sizes[namespace] -= dim * itemsize
+        rows.close()
+        self.connection.executemany(
+            "DELETE FROM embeddings WHERE namespace = ? AND key = ?",
+            [(namespace, key) for namespace, key, _ in evicted_entries],
+        )
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO free_rows VALUES (?, ?)",
+            [(namespace, row) for namespace, _, row in evicted_entries],
+        )
+
+    def close(self):
+        with self.lock:
+            for vectors in self.vectors.values():
+                vectors.flush()
+            self.vectors = {}
+            self.connection.close()
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from pipeline.jsonl_io import is_jsonl_path, iter_section_records, read_jsonl
+
+# share of the generated questions held out of the training data, used by training and evaluation alike
+DEFAULT_HOLDOUT_FRACTION = 0.1
+
+
+def get_holdout_fraction():
+    """
+    used to read the holdout fraction every stage and benchmark shares, so a benchmark never evaluates on
+    questions the model was trained on
+    :return: EVAL_HOLDOUT_FRACTION, DEFAULT_HOLDOUT_FRACTION when unset
+    """
+    return float(os.getenv("EVAL_HOLDOUT_FRACTION") or DEFAULT_HOLDOUT_FRACTION)
+
+
+def is_holdout_question(question: str, holdout_fraction: float):
+    """
+    used to deterministically assign a generated question to the evaluation holdout, the same question always
+    lands on the same side of the split so training and evaluation agree without sharing state
+    :param question:
+    :param holdout_fraction: share of the questions held out of training
+    :return:
+    """
+    if holdout_fraction <= 0:
+        return False
+    bucket = int(hashlib.sha256(question.encode("utf-8")).hexdigest()[:8], 16)
+    return bucket / 0x100000000 < holdout_fraction
+
+
+class RetrievalEvaluator:
+    """
+    measures how well a bi-encoder retrieves the chunk a held out question was generated from, among all chunks
+    of the parsed content, and how fast it encodes on the current device
+    """
+
+    def __init__(
+        self,
+        input_path: str = "question_generator/output/parsed_content_with_questions.json",
+        holdout_fraction: float = DEFAULT_HOLDOUT_FRACTION,
+        k_values: tuple = (1, 5, 10),
+        batch_size: int = 32,
+        query_block_size: int = 1024,
+    ):
+        """
+        :param input_path: parsed content with questions, json or jsonl(.zst)
+        :param holdout_fraction: share of the questions used as queries, has to match the fraction training data
+        was prepared with so the queries were never trained on
+        :param k_values: cutoffs recall is reported at, MRR and nDCG use the largest one
+        :param batch_size: number of texts encoded per forward pass
+        :param query_block_size: number of queries scored against the corpus at once
+        """
+        self.input_path = input_path
+        self.holdout_fraction = holdout_fraction
+        self.k_values = sorted(k_values)
+        self.batch_size = batch_size
+        self.query_block_size = query_block_size
+        self.documents = None
+        self.queries = None
+
+    def load(self):
+        """
+        used to build the corpus of distinct chunk texts and the held out (question, chunk position) queries
+        :return:
+        """
+        if is_jsonl_path(self.input_path):
+            records = read_jsonl(self.input_path)
+        else:
+            with open(self.input_path, "r") as f:
+                records = iter_section_records(json.load(f))
+        document_positions = {}
+        queries = []
+        for record in records:
+            text_content = record.get("text_content")
+            if not text_content:
+                continue
+            position = document_positions.setdefault(
+                text_content, len(document_positions)
+            )
+            for question in record.get("questions", []):
+                if is_holdout_question(question, self.holdout_fraction):
+                    queries.append((question, position))
+        self.documents = list(document_positions.keys())
+        self.queries = queries
+
+    def evaluate(self, model):
+        """
+        used to compute recall@k, MRR and nDCG of a model over the held out questions with cosine similarity,
+        every question has exactly one relevant chunk
+        :param model: SentenceTransformer
+        :return: dict of metrics
+        """
+        if self.queries is None:
+            self.load()
+        max_k = self.k_values[-1]
+        if not self.queries:
+            raise ValueError(
+                "No held out questions, increase the holdout fraction or generate more questions"
+            )
+
+        start = time.perf_counter()
+        document_embeddings = model.encode(
+            self.documents, batch_size=self.batch_size, normalize_embeddings=True
+        )
+        query_embeddings = model.encode(
+            [question for question, _ in self.queries],
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+        )
+        encode_seconds = time.perf_counter() - start
+        positives = np.array([position for _, position in self.queries])
+
+        ranks = []
+        for block_start in range(0, len(query_embeddings), self.query_block_size):
+            block_end = block_start + self.query_block_size
+            scores = query_embeddings[block_start:block_end] @ document_embeddings.T
+            positive_scores = scores[
+                np.arange(len(scores)), positives[block_start:block_end]
+            ]
+            # 1-based rank of the relevant chunk, ties are resolved in favour of the relevant chunk
+            ranks.append((scores > positive_scores[:, None]).sum(axis=1) + 1)
+        ranks = np.concatenate(ranks)
+
+        in_top_k = ranks <= max_k
+        metrics = {
+            "num_queries": len(self.queries),
+            "num_documents": len(self.documents),
+        }
+        for k in self.k_values:
+            metrics[f"recall@{k}"] = float(np.mean(ranks <= k))
+        metrics[f"mrr@{max_k}"] = float(np.mean(np.where(in_top_k, 1 / ranks, 0)))
+        metrics[f"ndcg@{max_k}"] = float(
+            np.mean(np.where(in_top_k, 1 / np.log2(ranks + 1), 0))
+        )
+        metrics["encode_seconds"] = encode_seconds
+        return metrics
+
+    @staticmethod
+    def benchmark_encode(
+        model,
+        batch_sizes: tuple = (1, 8, 32),
+        sequence_lengths: tuple = (32, 128, 512),
+        num_runs: int = 20,
+    ):
+        """
+        used to measure the encode latency and throughput of a model on synthetic texts of a fixed token length
+        :param model: SentenceTransformer
+        :param batch_sizes: number of texts per encode call
+        :param sequence_lengths: number of tokens per text, capped at the model's max_seq_length
+        :param num_runs: timed encode calls per configuration, after one warm-up call
+        :return: list of dicts with p50/p99 latency per call and texts/sec
+        """
+        results = []
+        filler_ids = model.tokenizer(
+            "the quick brown fox jumps over the lazy dog " * 1024,
+            add_special_tokens=False,
+        )["input_ids"]
+        for sequence_length in sequence_lengths:
+            num_tokens = min(sequence_length, model.max_seq_length)
+            text = model.tokenizer.decode(filler_ids[:num_tokens])
+            for batch_size in batch_sizes:
+                texts = [text] * batch_size
+                model.encode(texts, batch_size=batch_size)
+                latencies = []
+                for _ in range(num_runs):
+                    start = time.perf_counter()
+                    model.encode(texts, batch_size=batch_size)
+                    latencies.append(time.perf_counter() - start)
+                latencies = np.array(latencies) * 1000
+                results.append(
+                    {
+                        "batch_size": batch_size,
+                        "sequence_length": num_tokens,
+                        "p50_ms": float(np.percentile(latencies, 50)),
+                        "p99_ms": float(np.percentile(latencies, 99)),
+                        "texts_per_sec": float(
+                            batch_size * num_runs / (latencies.sum() / 1000)
+                        ),
+                    }
+                )
+        return results
@@ -0,0 +1,96 @@
+import os
+from typing import Literal
+
+ModelVariant = Literal["torch", "onnx", "onnx-int8"]
+
+
+def get_onnx_file_name(variant: ModelVariant, quantization_config: str = "avx2"):
+    """
+    used to get the file an onnx variant is stored under inside the model directory, following the
+    sentence-transformers layout so the files load with backend="onnx"
+    :param variant:
+    :param quantization_config: instruction set the int8 variant was quantized for
+    :return:
+    """
+    if variant == "onnx":
+        return "onnx/model.onnx"
+    elif variant == "onnx-int8":
+        return f"onnx/model_qint8_{quantization_config}.onnx"
+    else:
+        raise ValueError("Invalid onnx variant")
+
+
+def load_model(
+    model_path: str = "models/finetuned_bi_encoder",
+    variant: ModelVariant = "torch",
+    device: str | None = None,
+    quantization_config: str = "avx2",
+):
+    """
+    used to load a saved bi-encoder as pytorch, onnx or dynamically int8 quantized onnx model, all of them
+    expose the same SentenceTransformer encode api
+    :param model_path:
+    :param variant:
+    :param device: the onnx variants run on cpu
+    :param quantization_config: instruction set the int8 variant was quantized for
+    :return:
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if variant == "torch":
+        return SentenceTransformer(model_path, device=device)
+    file_name = get_onnx_file_name(variant, quantization_config)
+    if not os.path.exists(os.path.join(model_path, file_name)):
+        raise FileNotFoundError(
+            f"{os.path.join(model_path, file_name)} not found, export the model first"
+        )
+    return SentenceTransformer(
+        model_path,
+        device="cpu",
+        backend="onnx",
+        model_kwargs={"file_name": file_name},
+    )
+
+
+def export_onnx(
+    model_path: str = "models/finetuned_bi_encoder",
+    quantization_config: Literal["arm64", "avx2", "avx512", "avx512_vnni"] = "avx2",
+):
+    """
+    used to write the onnx and the dynamically int8 quantized onnx variants of a saved model next to its
+    pytorch weights. Needs optimum with onnxruntime, pip install "optimum[onnxruntime]".
+    :param model_path: saved SentenceTransformer directory
+    :param quantization_config: instruction set of the cpu nodes the int8 variant will run on
+    :return: {variant: path of the written file}
+    """
+    try:
+        from sentence_transformers import (
+            SentenceTransformer,
+            export_dynamic_quantized_onnx_model,
+        )
+    except ImportError as e:
+        raise ImportError(
+            "ONNX export needs a sentence-transformers version with onnx support"
+        ) from e
+    try:
+        import onnxruntime  # noqa: F401
+        import optimum  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            'ONNX export needs optimum with onnxruntime, install it with pip install "optimum[onnxruntime]"'
+        ) from e
+
+    # loading a directory without an onnx file with backend="onnx" converts the pytorch weights
+    onnx_model = SentenceTransformer(model_path, device="cpu", backend="onnx")
+    onnx_model.save_pretrained(model_path)
+    export_dynamic_quantized_onnx_model(
+        onnx_model,
+        quantization_config=quantization_config,
+        model_name_or_path=model_path,
+    )
+    return {
+        variant: os.path.join(
+            model_path, get_onnx_file_name(variant, quantization_config)
+        )
+        for variant in ("onnx", "onnx-int8")
+    }
@@ -0,0 +1,172 @@
+from typing import Literal
+
+import numpy as np
+
+from model_trainer.vector_index import NumpyVectorIndex, VectorIndex
+from pipeline.instrumentation import metrics
+
+
+class HardNegativeMiner:
+    """
+    mines hard negatives for all questions at once, candidates for every question are retrieved in a single
+    vectorized step (numpy) or in batched queries against the vector index (index) instead of one query per question
+    """
+
+    def __init__(
+        self,
+        n_results: int = 5,
+        num_negatives: int = 3,
+        skip_top: int = 0,
+        exclude_same_title: bool = False,
+        backend: Literal["numpy", "index"] = "numpy",
+        query_batch_size: int = 1024,
+    ):
+        """
+        :param n_results: number of nearest chunks considered as negative candidates per question
+        :param num_negatives: maximum number of negatives kept per question
+        :param skip_top: number of most similar candidates skipped as likely false negatives
+        :param exclude_same_title: drop candidates from the same section title as the positive, questions left with
+        fewer than num_negatives negatives retrieve more candidates
+        :param backend: numpy computes exact distances over an in-memory chunk embedding matrix, index runs batched
+        queries against the given vector index
+        :param query_batch_size: number of questions scored per index query
+        """
+        if backend not in ("numpy", "index"):
+            raise ValueError("Invalid mining backend")
+        self.n_results = n_results
+        self.num_negatives = num_negatives
+        self.skip_top = skip_top
+        self.exclude_same_title = exclude_same_title
+        self.backend = backend
+        self.query_batch_size = query_batch_size
+
+    def get_search_index(self, index: VectorIndex):
+        """
+        used to get the index candidates are retrieved from, callers mining in several windows should call it
+        once and pass the result to mine
+        :param index: vector index holding the chunk embeddings
+        :return:
+        """
+        if self.backend == "numpy" and not isinstance(index, NumpyVectorIndex):
+            # score against an exact in-memory copy instead of paying the per-call overhead of the store
+            return NumpyVectorIndex.from_index(index)
+        return index
+
+    def get_candidates(
+        self,
+        query_embeddings: np.ndarray,
+        index: VectorIndex,
+        num_candidates: int | None = None,
+    ):
+        """
+        used to retrieve the nearest chunks of every question with one batched index query per query_batch_size questions
+        :param query_embeddings: (num_questions, dim) matrix
+        :param index: vector index holding the chunk embeddings
+        :param num_candidates: chunks retrieved per question, defaults to n_results + skip_top
+        :return: list of (document, metadata) candidate lists, one per question
+        """
+        if num_candidates is None:
+            num_candidates = self.n_results + self.skip_top
+        candidates = []
+        for start in range(0, len(query_embeddings), self.query_batch_size):
+            query_batch = query_embeddings[start : start + self.query_batch_size]
+            with metrics.timer("index.query_batch"):
+                query_results = index.query_batch(query_batch, n_results=num_candidates)
+            metrics.increment("index.queries", len(query_batch))
+            for documents, metadatas in zip(
+                query_results["documents"], query_results["metadatas"]
+            ):
+                candidates.append(list(zip(documents, metadatas)))
+        return candidates
+
+    def select_negatives(self, candidates: list, positive: str, title: str):
+        """
+        used to pick the negatives of a question from its candidates ordered from nearest to farthest
+        :param candidates: (document, metadata) pairs
+        :param positive: text content the question was generated from
+        :param title: section title of the positive
+        :return: negatives ordered from the least to the most similar, as the per-question query produced them
+        """
+        documents = [
+            document
+            for document, metadata in candidates
+            if document != positive
+            and not (self.exclude_same_title and (metadata or {}).get("title") == title)
+        ]
+        documents = documents[self.skip_top :][: self.num_negatives]
+        return documents[::-1]
+
+    def mine_per_anchor(
+        self, anchors: list, query_embeddings: np.ndarray, index: VectorIndex
+    ):
+        """
+        used to build the anchor/positive/negative triplets of every question separately
+        :param anchors: (title, positive, question) tuples, one per row of query_embeddings
+        :param query_embeddings: (num_questions, dim) matrix of question embeddings
+        :param index: vector index holding the chunk embeddings
+        :return: list of triplet dict lists, one per anchor
+        """
+        if not anchors:
+            return []
+        search_index = self.get_search_index(index)
+        num_candidates = self.n_results + self.skip_top
+        negatives = [
+            self.select_negatives(question_candidates, positive, title)
+            for (title, positive, _), question_candidates in zip(
+                anchors, self.get_candidates(query_embeddings, search_index)
+            )
+        ]
+        if self.exclude_same_title:
+            # same section candidates are dropped after retrieval, so the questions left short of negatives are
+            # queried again with twice the candidates until enough survive or the index is exhausted
+            num_chunks = search_index.count()
+            short_rows = [
+                row
+                for row, question_negatives in enumerate(negatives)
+                if len(question_negatives) < self.num_negatives
+            ]
+            while short_rows and num_candidates < num_chunks:
+                num_candidates = min(num_candidates * 2, num_chunks)
+                for row, question_candidates in zip(
+                    short_rows,
+                    self.get_candidates(
+                        query_embeddings[short_rows], search_index, num_candidates
+                    ),
+                ):
+                    title, positive, _ = anchors[row]
+                    negatives[row] = self.select_negatives(
+                        question_candidates, positive, title
+                    )
+                short_rows = [
+                    row
+                    for row in short_rows
+                    if len(negatives[row]) < self.num_negatives
+                ]
+        metrics.increment(
+            "mine.short_of_negatives",
+            sum(
+                len(question_negatives) < self.num_negatives
+                for question_negatives in negatives
+            ),
+        )
+        return [
+            [
+                {"anchor": question, "positive": positive, "negative": negative}
+                for negative in question_negatives
+            ]
+            for (_, positive, question), question_negatives in zip(anchors, negatives)
+        ]
+
+    def mine(self, anchors: list, query_embeddings: np.ndarray, index: VectorIndex):
+        """
+        used to build anchor/positive/negative triplets for all questions
+        :param anchors: (title, positive, question) tuples, one per row of query_embeddings
+        :param query_embeddings: (num_questions, dim) matrix of question embeddings
+        :param index: vector index holding the chunk embeddings
+        :return: list of triplet dicts
+        """
+        return [
+            triplet
+            for triplets in self.mine_per_anchor(anchors, query_embeddings, index)
+            for triplet in triplets
+        ]
@@ -1,40 +1,240 @@
+import hashlib
+import itertools
 import json
 import os
+import tempfile
+import threading
 import uuid
+from typing import Literal
 
-import chromadb
+import numpy as np
 import torch
 from datasets import Dataset
-from huggingface_hub import login
 from sentence_transformers import (SentenceTransformer,
                                    SentenceTransformerTrainer,
                                    SentenceTransformerTrainingArguments)
-from sentence_transformers.losses import MultipleNegativesRankingLoss
+from sentence_transformers.losses import (CachedMultipleNegativesRankingLoss,
+                                          MatryoshkaLoss,
+                                          MultipleNegativesRankingLoss)
+from sentence_transformers.training_args import BatchSamplers
 from tqdm import tqdm
 
-if os.getenv("HF_TOKEN") is None:
-    raise ValueError("HF_TOKEN not found in the environment variables")
-login(token=os.getenv("HF_TOKEN"))
+from model_trainer.embedding_cache import EmbeddingCache
+from model_trainer.evaluation import is_holdout_question
+from model_trainer.export import ModelVariant, export_onnx, load_model
+from model_trainer.negative_mining import HardNegativeMiner
+from model_trainer.triplet_store import TripletStore, is_triplet_store_path
+from model_trainer.vector_index import get_vector_index
+from pipeline.dedup import (MinHasher, get_cosine_duplicate_mask,
+                            get_unique_questions)
+from pipeline.hub import login_for_download, login_to_hub
+from pipeline.instrumentation import metrics
+from pipeline.jsonl_io import (is_jsonl_path, read_jsonl, read_records,
+                               write_jsonl)
 
 
 class BiEncoderTrainer:
-    def __init__(self):
-        chroma_client = chromadb.PersistentClient(path="db")
+    def __init__(
+        self,
+        db_path: str = "db",
+        collection_name: str = "doc_embeddings",
+        index_backend: Literal["chroma", "numpy", "compact"] = "chroma",
+        embedding_cache: EmbeddingCache | None = None,
+        index_options: dict | None = None,
+    ):
+        """
+        :param db_path: directory of the vector index
+        :param collection_name: chroma collection name, only used by the chroma backend
+        :param index_backend: chroma persistent collection, exact memory-mapped numpy index, or compact truncated /
+        quantized vectors with full precision rescoring
+        :param embedding_cache: optional on-disk embedding cache, texts embedded before by the same model revision
+        are served from it instead of being encoded again
+        :param index_options: backend specific index arguments, e.g. truncate_dim and quantization of the compact
+        backend
+        """
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.collection = chroma_client.get_or_create_collection(name="doc_embeddings")
+        if index_backend == "chroma":
+            self.index = get_vector_index(
+                index_backend, path=db_path, collection_name=collection_name
+            )
+        else:
+            self.index = get_vector_index(
+                index_backend, path=db_path, **(index_options or {})
+            )
+        login_for_download(os.getenv("BI_ENCODER_MODEL_NAME"))
         self.model = SentenceTransformer(
-            os.getenv("BI_ENCODER_MODEL_NAME"), cache_folder=os.getenv("CACHE_DIR")
+            os.getenv("BI_ENCODER_MODEL_NAME"),
+            cache_folder=os.getenv("CACHE_DIR"),
+            revision=os.getenv("BI_ENCODER_MODEL_REVISION"),
         ).to(device=self.device)
         self.trained_model = None
+        self.embedding_cache = embedding_cache
+        self.embedding_namespace = EmbeddingCache.build_namespace(
+            os.getenv("BI_ENCODER_MODEL_NAME"),
+            os.getenv("BI_ENCODER_MODEL_REVISION")
+            or getattr(self.model.model_card_data, "base_model_revision", None),
+            normalize=False,
+        )
+        # number of texts that went through the model, as opposed to being served from the embedding cache
+        self.num_encoded_texts = 0
+        # embed_texts is called from several streaming workers at once
+        self.num_encoded_texts_lock = threading.Lock()
 
     def embed_text(self, sentence: str):
-        return self.model.encode(sentence)
+        return self.embed_texts([sentence])[0]
+
+    def embed_texts(self, sentences: list, batch_size: int = 32):
+        """
+        used to embed a list of sentences through the model's batched encode, only the sentences missing from the
+        embedding cache are encoded and every distinct sentence is encoded once
+        :param sentences:
+        :param batch_size: number of sentences encoded per forward pass
+        :return: embedding matrix with one row per sentence
+        """
+        if self.embedding_cache is None:
+            with self.num_encoded_texts_lock:
+                self.num_encoded_texts += len(sentences)
+            metrics.increment("encode.texts", len(sentences))
+            with metrics.timer("encode"):
+                return self.model.encode(sentences, batch_size=batch_size)
+
+        keys = [EmbeddingCache.build_key(sentence) for sentence in sentences]
+        embeddings = self.embedding_cache.get_many(self.embedding_namespace, keys)
+        missing_sentences = {
+            key: sentence
+            for key, sentence, embedding in zip(keys, sentences, embeddings)
+            if embedding is None
+        }
+        if missing_sentences:
+            # round fresh embeddings to the stored float16 precision so results don't depend on cache hits
+            with metrics.timer("encode"):
+                encoded = self.model.encode(
+                    list(missing_sentences.values()), batch_size=batch_size
+                ).astype(np.float16)
+            with self.num_encoded_texts_lock:
+                self.num_encoded_texts += len(missing_sentences)
+            metrics.increment("encode.texts", len(missing_sentences))
+            self.embedding_cache.set_many(
+                self.embedding_namespace, list(missing_sentences.keys()), encoded
+            )
+            encoded_by_key = dict(zip(missing_sentences.keys(), encoded))
+            embeddings = [
+                encoded_by_key[key] if embedding is None else embedding
+                for key, embedding in zip(keys, embeddings)
+            ]
+        metrics.increment("encode.cache_hits", len(sentences) - len(missing_sentences))
+        if not embeddings:
+            return self.model.encode(sentences, batch_size=batch_size)
+        return np.stack(embeddings).astype(np.float32)
+
+    @staticmethod
+    def get_chunk_id(title: str, text_content: str):
+        """
+        used to build a deterministic id for a chunk so that re-uploading it overwrites the existing entry
+        :param title: section title the chunk belongs to
+        :param text_content:
+        :return: sha256 hex digest of the title and the text content
+        """
+        return hashlib.sha256(f"{title}\x00{text_content}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get_chunk_metadata(record: dict):
+        """
+        used to build the metadata a chunk is stored with in the vector index, chroma rejects None values so a
+        missing start page is left out
+        :param record: chunk record
+        :return:
+        """
+        metadata = {"title": record["title"]}
+        if record.get("start_page") is not None:
+            metadata["start_page"] = record["start_page"]
+        return metadata
 
-    def upload_embeddings(self):
+    @staticmethod
+    def iter_chunk_records(input_path: str):
+        """
+        used to stream chunk records from the parsed content with questions, json or jsonl(.zst)
+        :param input_path:
+        :return: generator of {"title", "start_page", "text_content"[, "questions"]} records
+        """
+        yield from read_records(input_path)
+
+    def upload_embeddings(
+        self,
+        batch_size: int = 32,
+        upsert_batch_size: int = 1000,
+        input_path: str = "question_generator/output/parsed_content_with_questions.json",
+        skip_existing: bool = False,
+    ):
+        """
+        used to embed all chunks in batches and upsert them into the vector index in bulk, chunk ids are
+        content hashes so reruns are idempotent. Chunks are streamed so only one upsert batch is held in memory.
+        :param batch_size: number of chunks encoded per forward pass
+        :param upsert_batch_size: number of chunks embedded and written per index upsert call
+        :param input_path: parsed content with questions, json or jsonl(.zst)
+        :param skip_existing: don't re-embed chunks whose id is already in the index, valid as long as the model
+        didn't change
+        :return:
+        """
+        records = (
+            record
+            for record in self.iter_chunk_records(input_path)
+            if record.get("text_content")
+        )
+        progress = tqdm(desc="Uploading document embeddings", unit="chunk")
+        while window := list(itertools.islice(records, upsert_batch_size)):
+            chunks = {
+                self.get_chunk_id(record["title"], record["text_content"]): record
+                for record in window
+            }
+            if skip_existing:
+                for chunk_id in self.index.get_existing_ids(list(chunks.keys())):
+                    del chunks[chunk_id]
+            if not chunks:
+                progress.update(len(window))
+                continue
+            documents = [record["text_content"] for record in chunks.values()]
+            embeddings = self.embed_texts(documents, batch_size=batch_size)
+            with metrics.timer("index.upsert"):
+                self.index.upsert(
+                    ids=list(chunks.keys()),
+                    documents=documents,
+                    embeddings=embeddings,
+                    metadatas=[
+                        self.get_chunk_metadata(record) for record in chunks.values()
+                    ],
+                )
+            progress.update(len(window))
+        progress.close()
+        self.index.save()
+
+    def get_chunk_ids(
+        self,
+        input_path: str = "question_generator/output/parsed_content_with_questions.json",
+    ):
+        """
+        used to list the ids the chunks of the input are stored under in the vector index
+        :param input_path: parsed content with questions, json or jsonl(.zst)
+        :return: set of chunk ids
+        """
+        return {
+            self.get_chunk_id(record["title"], record["text_content"])
+            for record in self.iter_chunk_records(input_path)
+            if record.get("text_content")
+        }
+
+    def upload_embeddings_per_item(
+        self,
+        input_path: str = "question_generator/output/parsed_content_with_questions.json",
+    ):
+        """
+        used to embed and add chunks one at a time with random ids, kept as the baseline for the
+        upload throughput benchmark
+        :param input_path: parsed content with questions json
+        :return:
+        """
         parsed_content_with_questions = None
-        with open(
-            "question_generator/output/parsed_content_with_questions.json", "r"
-        ) as f:
+        with open(input_path, "r") as f:
             parsed_content_with_questions = json.load(f)
 
         if parsed_content_with_questions:
@@ -46,70 +246,320 @@ class BiEncoderTrainer:
                 for text_with_question in text_with_questions:
                     text_content = text_with_question.get("text_content")
                     if text_content:
-                        self.collection.add(
+                        self.index.add(
                             documents=[text_content],
-                            embeddings=self.embed_text(text_content),
+                            embeddings=[self.embed_text(text_content)],
                             metadatas=[{"title": title}],
                             ids=[str(uuid.uuid4())],
                         )
+            self.index.save()
 
-    def prepare_training_data(self):
-        parsed_content_with_questions = None
-        training_data = []
-        with open(
-            "question_generator/output/parsed_content_with_questions.json", "r"
-        ) as f:
-            parsed_content_with_questions = json.load(f)
+    def prepare_training_data(
+        self,
+        n_results: int = 5,
+        num_negatives: int = 3,
+        skip_top: int = 0,
+        exclude_same_title: bool = False,
+        backend: Literal["numpy", "index"] = "numpy",
+        batch_size: int = 32,
+        question_window_size: int = 8192,
+        input_path: str = "question_generator/output/parsed_content_with_questions.json",
+        output_path: str = "model_trainer/training_data/training_data.json",
+        mining_cache_path: str | None = None,
+        holdout_fraction: float = 0.0,
+        question_jaccard_threshold: float | None = None,
+        question_cosine_threshold: float | None = None,
+    ):
+        """
+        used to mine hard negatives for every generated question and write the anchor/positive/negative triplets,
+        questions are encoded in batches and their nearest chunks retrieved in one vectorized step per window
+        :param n_results: number of nearest chunks considered as negative candidates per question
+        :param num_negatives: maximum number of negatives kept per question
+        :param skip_top: number of most similar candidates skipped as likely false negatives
+        :param exclude_same_title: drop negatives from the same section title as the positive
+        :param backend: numpy scores all chunk embeddings in memory, index runs batched queries against the vector index
+        :param batch_size: number of questions encoded per forward pass
+        :param question_window_size: number of questions mined at once, rounded up to whole chunks
+        :param input_path: parsed content with questions, json or jsonl(.zst)
+        :param output_path: training data, a *.arrow directory streams the triplets into a TripletStore with
+        every chunk text stored once, a jsonl(.zst) path streams them as jsonl
+        :param mining_cache_path: optional jsonl file of the triplets mined per chunk, chunks whose questions,
+        model and mining config are unchanged reuse their triplets instead of being mined again. Chunks with a
+        negative that is no longer in the input (e.g. from an edited or removed document) are mined again, negatives
+        of reused chunks are not refreshed against chunks added since they were mined.
+        :param holdout_fraction: share of the questions left out of the training data for retrieval evaluation
+        :param question_jaccard_threshold: drop questions whose estimated Jaccard similarity to an earlier question
+        of the same chunk reaches it, before they are encoded. None keeps every question
+        :param question_cosine_threshold: drop questions whose embedding's cosine similarity to an earlier question
+        of the same chunk reaches it, before negatives are mined for them. None keeps every question
+        :return:
+        """
+        miner = HardNegativeMiner(
+            n_results=n_results,
+            num_negatives=num_negatives,
+            skip_top=skip_top,
+            exclude_same_title=exclude_same_title,
+            backend=backend,
+        )
+        mining_config = [
+            os.getenv("BI_ENCODER_MODEL_NAME"),
+            n_results,
+            num_negatives,
+            skip_top,
+            exclude_same_title,
+            question_jaccard_threshold,
+            question_cosine_threshold,
+        ]
+        mining_cache = {}
+        if mining_cache_path and os.path.exists(mining_cache_path):
+            # the input holds the chunks embed keeps in the index, negatives outside of it were deleted from it
+            chunk_hashes = {
+                hashlib.sha1(record["text_content"].encode("utf-8")).digest()
+                for record in self.iter_chunk_records(input_path)
+                if record.get("text_content")
+            }
+            num_stale = 0
+            for record in read_jsonl(mining_cache_path):
+                if all(
+                    hashlib.sha1(triplet["negative"].encode("utf-8")).digest()
+                    in chunk_hashes
+                    for triplet in record["triplets"]
+                ):
+                    mining_cache[record["key"]] = record["triplets"]
+                else:
+                    num_stale += 1
+            metrics.increment("mine.stale_cache_entries", num_stale)
+            if num_stale:
+                print(
+                    f"Mining again {num_stale} cached chunks whose negatives are no longer in the input"
+                )
+        updated_mining_cache = {}
+        min_hasher = MinHasher(shingle_size=5, shingle_unit="char")
+        text_removed_before = metrics.get_counter("dedup.questions_removed_text")
+        embedding_removed_before = metrics.get_counter(
+            "dedup.questions_removed_embedding"
+        )
+        short_before = metrics.get_counter("mine.short_of_negatives")
 
-        for title, content in tqdm(
-            parsed_content_with_questions.items(), desc="Preparing training data"
-        ):
-            text_with_questions = content.get("text_with_questions", [])
-            for text_with_question in text_with_questions:
-                questions = text_with_question.get("questions", [])
-                text_content = text_with_question.get("text_content")
-                for question in questions:
-                    query_results = self.collection.query(
-                        query_embeddings=self.embed_text(question), n_results=5
+        def iter_anchors():
+            for record in self.iter_chunk_records(input_path):
+                questions = record.get("questions", [])
+                num_questions = len(questions)
+                # before the holdout split, so no near-duplicate of a held out question is trained on
+                if question_jaccard_threshold is not None:
+                    questions = get_unique_questions(
+                        questions, question_jaccard_threshold, min_hasher
                     )
-                    fetched_documents = query_results["documents"][0]
-                    fetched_documents = [
-                        doc for doc in fetched_documents if doc != text_content
-                    ]
-                    fetched_documents = fetched_documents[::-1][-3:]
-                    for document in fetched_documents:
-                        if document != text_content:
-                            training_data.append(
-                                {
-                                    "anchor": question,
-                                    "positive": text_content,
-                                    "negative": document,
-                                }
-                            )
-
-        with open("model_trainer/training_data/training_data.json", "w") as f:
-            json.dump(training_data, f)
-
-    def train(self):
-        training_data = None
-        with open("model_trainer/training_data/training_data.json", "r") as f:
-            training_data = json.load(f)
+                num_removed = num_questions - len(questions)
+                questions = [
+                    question
+                    for question in questions
+                    if not is_holdout_question(question, holdout_fraction)
+                ]
+                if not questions:
+                    continue
+                key = hashlib.sha256(
+                    json.dumps(
+                        [record.get("title"), record.get("text_content"), questions]
+                        + mining_config
+                    ).encode("utf-8")
+                ).hexdigest()
+                # chunks reusing their mined triplets save nothing in this run
+                if num_removed and key not in mining_cache:
+                    metrics.increment("dedup.questions_removed_text", num_removed)
+                yield key, [
+                    (record.get("title"), record.get("text_content"), question)
+                    for question in questions
+                ]
 
+        def drop_similar_questions(to_mine: list, question_embeddings: np.ndarray):
+            rows_per_key = {}
+            for row, (key, _) in enumerate(to_mine):
+                rows_per_key.setdefault(key, []).append(row)
+            keep = np.ones(len(to_mine), dtype=bool)
+            for rows in rows_per_key.values():
+                keep[rows] = ~get_cosine_duplicate_mask(
+                    question_embeddings[rows], question_cosine_threshold
+                )
+            metrics.increment(
+                "dedup.questions_removed_embedding", int(np.count_nonzero(~keep))
+            )
+            return [item for item, kept in zip(to_mine, keep) if kept], (
+                question_embeddings[keep]
+            )
+
+        def iter_windows():
+            # windows hold whole chunks so the questions of a chunk are compared with each other
+            window = []
+            for key, anchors in iter_anchors():
+                window.extend((key, anchor) for anchor in anchors)
+                if len(window) >= question_window_size:
+                    yield window
+                    window = []
+            if window:
+                yield window
+
+        def iter_training_data():
+            search_index = None
+            progress = tqdm(desc="Preparing training data", unit="question")
+            for window in iter_windows():
+                to_mine = []
+                for key, anchor in window:
+                    if key in mining_cache:
+                        if key not in updated_mining_cache:
+                            updated_mining_cache[key] = mining_cache[key]
+                            yield from mining_cache[key]
+                    else:
+                        to_mine.append((key, anchor))
+                if to_mine:
+                    if search_index is None:
+                        search_index = miner.get_search_index(self.index)
+                    question_embeddings = self.embed_texts(
+                        [question for _, (_, _, question) in to_mine],
+                        batch_size=batch_size,
+                    )
+                    if question_cosine_threshold is not None:
+                        to_mine, question_embeddings = drop_similar_questions(
+                            to_mine, question_embeddings
+                        )
+                    for key, anchor in to_mine:
+                        updated_mining_cache.setdefault(key, [])
+                    for (key, _), triplets in zip(
+                        to_mine,
+                        miner.mine_per_anchor(
+                            [anchor for _, anchor in to_mine],
+                            question_embeddings,
+                            search_index,
+                        ),
+                    ):
+                        updated_mining_cache[key].extend(triplets)
+                        yield from triplets
+                progress.update(len(window))
+            progress.close()
+
+        if is_triplet_store_path(output_path):
+            triplet_store = TripletStore(output_path)
+            num_triplets, num_chunks = triplet_store.write(iter_training_data())
+            print(
+                f"Wrote {num_triplets} triplets over {num_chunks} distinct chunks "
+                f"({triplet_store.get_size_bytes() / 2**20:.1f}MB) to {output_path}"
+            )
+        elif is_jsonl_path(output_path):
+            write_jsonl(output_path, iter_training_data())
+        else:
+            with open(output_path, "w") as f:
+                json.dump(list(iter_training_data()), f)
+        removed_by_text = int(
+            metrics.get_counter("dedup.questions_removed_text") - text_removed_before
+        )
+        removed_by_embedding = int(
+            metrics.get_counter("dedup.questions_removed_embedding")
+            - embedding_removed_before
+        )
+        num_short = int(metrics.get_counter("mine.short_of_negatives") - short_before)
+        if num_short:
+            print(
+                f"{num_short} questions got fewer than {num_negatives} negatives and give fewer triplets, "
+                f"n_results or the number of indexed chunks is too small"
+            )
+        if removed_by_text or removed_by_embedding:
+            num_removed = removed_by_text + removed_by_embedding
+            metrics.increment("dedup.triplets_saved", num_removed * num_negatives)
+            print(
+                f"Dropped {num_removed} near-duplicate questions ({removed_by_text} by text, {removed_by_embedding} "
+                f"by embedding), saving {removed_by_text} question encodings, {num_removed} negative searches and "
+                f"up to {num_removed * num_negatives} triplets"
+            )
+        if mining_cache_path:
+            write_jsonl(
+                mining_cache_path,
+                (
+                    {"key": key, "triplets": triplets}
+                    for key, triplets in updated_mining_cache.items()
+                ),
+            )
+
+    @staticmethod
+    def load_training_dataset(training_data_path: str):
+        """
+        used to load the training triplets, a triplet store is memory-mapped with its chunk texts looked up per
+        batch, jsonl(.zst) files are converted to an arrow dataset without loading them into a python list
+        :param training_data_path:
+        :return: dataset, None if there is no training data
+        """
+        if is_triplet_store_path(training_data_path):
+            return TripletStore(training_data_path).load()
+        if is_jsonl_path(training_data_path):
+            if training_data_path.endswith(".zst"):
+                # datasets can't read zstd compressed jsonl, stream it into a temporary plain jsonl first. The
+                # dataset is memory-mapped from the datasets cache, so the plain file can go once it is loaded.
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    plain_path = os.path.join(temp_dir, "training_data.jsonl")
+                    write_jsonl(plain_path, read_jsonl(training_data_path))
+                    if os.path.getsize(plain_path) == 0:
+                        return None
+                    return Dataset.from_json(plain_path)
+            if os.path.getsize(training_data_path) == 0:
+                return None
+            return Dataset.from_json(training_data_path)
+        with open(training_data_path, "r") as f:
+            training_data = json.load(f)
         if training_data:
-            train_dataset = Dataset.from_list(training_data)
-            loss = MultipleNegativesRankingLoss(self.model)
+            return Dataset.from_list(training_data)
+        return None
+
+    def train(
+        self,
+        training_data_path: str = "model_trainer/training_data/training_data.json",
+        num_epochs: int = 5,
+        batch_size: int = 1,
+        mini_batch_size: int | None = None,
+        matryoshka_dims: list | None = None,
+    ):
+        """
+        used to fine-tune the bi-encoder on the mined triplets with MultipleNegativesRankingLoss, every other
+        positive and negative of a batch serves as an additional in-batch negative
+        :param training_data_path:
+        :param num_epochs:
+        :param batch_size: number of triplets per optimizer step, batches never contain the same text twice so a
+        positive chunk isn't used as an in-batch negative of its own questions
+        :param mini_batch_size: enables the gradient cached loss, embeddings are computed mini_batch_size texts at a
+        time so the memory of a step is bound by the mini batch instead of batch_size
+        :param matryoshka_dims: wraps the loss in MatryoshkaLoss over these embedding sizes (e.g. 768, 512, 256, 128
+        for embeddinggemma) so embeddings truncated to them keep their retrieval quality
+        :return: training metrics, including train_samples_per_second, None if there is no training data
+        """
+        train_dataset = self.load_training_dataset(training_data_path)
+        if train_dataset is not None:
+            if mini_batch_size:
+                loss = CachedMultipleNegativesRankingLoss(
+                    self.model, mini_batch_size=mini_batch_size
+                )
+            else:
+                loss = MultipleNegativesRankingLoss(self.model)
+            if matryoshka_dims:
+                loss = MatryoshkaLoss(
+                    self.model,
+                    loss,
+                    matryoshka_dims=sorted(matryoshka_dims, reverse=True),
+                )
 
             args = SentenceTransformerTrainingArguments(
                 # Required parameter:
                 output_dir="models/finetuned_bi_encoder",
                 # Optional training parameters:
                 # prompts=self.model.prompts[task_name],  # use model's prompt to train
-                num_train_epochs=5,
-                per_device_train_batch_size=1,
+                num_train_epochs=num_epochs,
+                per_device_train_batch_size=batch_size,
                 learning_rate=2e-5,
                 warmup_ratio=0.1,
+                batch_sampler=(
+                    BatchSamplers.NO_DUPLICATES
+                    if batch_size > 1
+                    else BatchSamplers.BATCH_SAMPLER
+                ),
                 # Optional tracking/debugging parameters:
-                logging_steps=train_dataset.num_rows,
+                logging_steps=max(1, train_dataset.num_rows // batch_size),
                 report_to="none",
             )
 
@@ -119,20 +569,56 @@ class BiEncoderTrainer:
                 train_dataset=train_dataset,
                 loss=loss,
             )
-            trainer.train()
+            with metrics.timer("train"):
+                train_output = trainer.train()
+            metrics.increment("train.samples", train_dataset.num_rows * num_epochs)
+
+            # the model was fine-tuned in place, its embeddings no longer match the cached base model embeddings
+            self.embedding_cache = None
 
             # Save complete model
             trainer.save_model()
             print(f"Model saved to: {args.output_dir}")
+            print(
+                f"Trained on {train_dataset.num_rows} triplets x {num_epochs} epochs at "
+                f"{train_output.metrics['train_samples_per_second']:.2f} samples/sec"
+            )
+            return train_output.metrics
+        return None
+
+    def load_trained_model(
+        self, model_path="models/finetuned_bi_encoder", variant: ModelVariant = "torch"
+    ):
+        """
+        used to load the fine-tuned model
+        :param model_path:
+        :param variant: pytorch weights, or the onnx / int8 quantized onnx files written by export_trained_model
+        :return:
+        """
+        self.trained_model = load_model(model_path, variant=variant, device=self.device)
+        print(f"Successfully loaded trained model from {model_path} ({variant})")
 
-    def load_trained_model(self, model_path="models/finetuned_bi_encoder"):
-        self.trained_model = SentenceTransformer(model_path, device=self.device)
-        print(f"Successfully loaded trained model from {model_path}")
+    @staticmethod
+    def export_trained_model(
+        model_path="models/finetuned_bi_encoder", quantization_config: str = "avx2"
+    ):
+        """
+        used to write onnx and dynamically int8 quantized onnx variants of the fine-tuned model for cpu inference
+        :param model_path:
+        :param quantization_config: instruction set of the cpu nodes, arm64, avx2, avx512 or avx512_vnni
+        :return: {variant: path of the written file}
+        """
+        exported_files = export_onnx(
+            model_path, quantization_config=quantization_config
+        )
+        print(f"Exported {', '.join(exported_files.values())}")
+        return exported_files
 
     def upload_to_huggingface(
         self, repo_name, model_path="models/finetuned_bi_encoder", private=False
     ):
         self.load_trained_model(model_path)
+        login_to_hub()
 
         # Push to hub
         self.trained_model.push_to_hub(
@@ -0,0 +1,143 @@
+import hashlib
+import os
+from typing import Iterable
+
+
+def is_triplet_store_path(path: str):
+    return path.rstrip("/").endswith(".arrow")
+
+
+class ChunkTextLookup:
+    """
+    dataset transform replacing the chunk ids of the positive and negative columns with their texts, the chunk
+    table is memory-mapped on first use. Pickles (and is fingerprinted by datasets) as its path only.
+    """
+
+    def __init__(self, chunks_path: str):
+        self.chunks_path = chunks_path
+        self.texts = None
+
+    def __getstate__(self):
+        return {"chunks_path": self.chunks_path, "texts": None}
+
+    def get_texts(self, chunk_ids: list):
+        import pyarrow as pa
+
+        if self.texts is None:
+            with pa.ipc.open_stream(pa.memory_map(self.chunks_path, "r")) as reader:
+                self.texts = reader.read_all().column("text")
+        return self.texts.take(pa.array(chunk_ids, type=pa.int32())).to_pylist()
+
+    def __call__(self, batch: dict):
+        return {
+            column: (
+                self.get_texts(values) if column in ("positive", "negative") else values
+            )
+            for column, values in batch.items()
+        }
+
+
+class TripletStore:
+    """
+    training triplets as a directory of two Arrow IPC files: chunks.arrow holds every distinct positive and
+    negative text once, triplets.arrow the anchor question with the row ids of its positive and negative chunk
+    in chunks.arrow. A chunk text is stored once instead of once per question and negative, both files are
+    memory-mapped on load and chunk texts are only looked up for the rows of a batch.
+    """
+
+    chunks_file = "chunks.arrow"
+    triplets_file = "triplets.arrow"
+
+    def __init__(self, path: str, write_batch_size: int = 8192):
+        """
+        :param path: directory of the store, named *.arrow
+        :param write_batch_size: rows per written record batch
+        """
+        self.path = path
+        self.write_batch_size = write_batch_size
+        self.chunks_path = os.path.join(path, self.chunks_file)
+        self.triplets_path = os.path.join(path, self.triplets_file)
+
+    def write(self, triplets: Iterable[dict]):
+        """
+        used to stream anchor/positive/negative triplets into the store, chunk texts are deduplicated by hash
+        so only the ids of the chunks seen so far are held in memory
+        :param triplets: {"anchor", "positive", "negative"} dicts
+        :return: (number of triplets, number of distinct chunks)
+        """
+        import pyarrow as pa
+
+        os.makedirs(self.path, exist_ok=True)
+        chunk_schema = pa.schema([("text", pa.string())])
+        triplet_schema = pa.schema(
+            [
+                ("anchor", pa.string()),
+                ("positive", pa.int32()),
+                ("negative", pa.int32()),
+            ]
+        )
+        chunk_ids = {}
+        pending_chunks = []
+        pending_triplets = {"anchor": [], "positive": [], "negative": []}
+        num_triplets = 0
+
+        def get_chunk_id(text: str):
+            key = hashlib.sha1(text.encode("utf-8")).digest()
+            chunk_id = chunk_ids.get(key)
+            if chunk_id is None:
+                chunk_id = chunk_ids[key] = len(chunk_ids)
+                pending_chunks.append(text)
+            return chunk_id
+
+        with (
+            pa.OSFile(self.chunks_path, "wb") as chunks_sink,
+            pa.OSFile(self.triplets_path, "wb") as triplets_sink,
+            pa.ipc.new_stream(chunks_sink, chunk_schema) as chunk_writer,
+            pa.ipc.new_stream(triplets_sink, triplet_schema) as triplet_writer,
+        ):
+
+            def flush():
+                if pending_chunks:
+                    chunk_writer.write_batch(
+                        pa.record_batch([pa.array(pending_chunks)], schema=chunk_schema)
+                    )
+                    pending_chunks.clear()
+                if pending_triplets["anchor"]:
+                    triplet_writer.write_batch(
+                        pa.record_batch(
+                            [
+                                pa.array(pending_triplets[column])
+                                for column in triplet_schema.names
+                            ],
+                            schema=triplet_schema,
+                        )
+                    )
+                    for values in pending_triplets.values():
+                        values.clear()
+
+            for triplet in triplets:
+                pending_triplets["anchor"].append(triplet["anchor"])
+                pending_triplets["positive"].append(get_chunk_id(triplet["positive"]))
+                pending_triplets["negative"].append(get_chunk_id(triplet["negative"]))
+                num_triplets += 1
+                if len(pending_triplets["anchor"]) >= self.write_batch_size:
+                    flush()
+            flush()
+        return num_triplets, len(chunk_ids)
+
+    def load(self):
+        """
+        used to load the triplets as a memory-mapped dataset whose positive and negative columns read as texts
+        :return: dataset, None if there are no triplets
+        """
+        from datasets import Dataset
+
+        triplets = Dataset.from_file(self.triplets_path)
+        if triplets.num_rows == 0:
+            return None
+        return triplets.with_transform(ChunkTextLookup(self.chunks_path))
+
+    def get_size_bytes(self):
+        return sum(
+            os.path.getsize(path) for path in (self.chunks_path, self.triplets_path)
+        )
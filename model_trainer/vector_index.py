@@ -0,0 +1,622 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Literal
+
+import numpy as np
+
+
+def top_k_l2(query_embeddings: np.ndarray, document_embeddings: np.ndarray, k: int):
+    """
+    used to find the k nearest documents of every query by squared l2 distance, the distance chroma uses by default
+    :param query_embeddings: (num_queries, dim) matrix
+    :param document_embeddings: (num_documents, dim) matrix
+    :param k:
+    :return: (num_queries, k) matrices of document indices and distances ordered from nearest to farthest
+    """
+    k = min(k, document_embeddings.shape[0])
+    distances = (
+        np.einsum("ij,ij->i", query_embeddings, query_embeddings)[:, None]
+        - 2 * query_embeddings @ document_embeddings.T
+        + np.einsum("ij,ij->i", document_embeddings, document_embeddings)[None, :]
+    )
+    if k < document_embeddings.shape[0]:
+        candidate_indices = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        candidate_indices = np.tile(
+            np.arange(document_embeddings.shape[0]), (len(query_embeddings), 1)
+        )
+    candidate_distances = np.take_along_axis(distances, candidate_indices, axis=1)
+    order = np.argsort(candidate_distances, axis=1, kind="stable")
+    return (
+        np.take_along_axis(candidate_indices, order, axis=1),
+        np.take_along_axis(candidate_distances, order, axis=1),
+    )
+
+
+class VectorIndex(ABC):
+    """
+    minimal interface shared by the vector stores chunk embeddings are written to and searched in
+    """
+
+    @abstractmethod
+    def add(self, ids: list, embeddings, documents: list, metadatas: list):
+        pass
+
+    @abstractmethod
+    def upsert(self, ids: list, embeddings, documents: list, metadatas: list):
+        pass
+
+    @abstractmethod
+    def delete(self, ids: list):
+        pass
+
+    @abstractmethod
+    def get_existing_ids(self, ids: list):
+        """
+        used to check which of the given ids are already stored
+        :param ids:
+        :return: set of stored ids
+        """
+
+    @abstractmethod
+    def query_batch(self, query_embeddings, n_results: int):
+        """
+        used to retrieve the nearest entries of every query
+        :param query_embeddings: (num_queries, dim) matrix
+        :param n_results: number of entries returned per query
+        :return: chroma style dict of ids/documents/metadatas/distances lists, one inner list per query
+        """
+
+    @abstractmethod
+    def get_all(self):
+        """
+        used to fetch every stored entry
+        :return: dict of ids, (num_entries, dim) embedding matrix, documents and metadatas
+        """
+
+    @abstractmethod
+    def count(self):
+        pass
+
+    @abstractmethod
+    def save(self):
+        pass
+
+    @classmethod
+    @abstractmethod
+    def load(cls, path: str, **kwargs):
+        pass
+
+
+class ChromaVectorIndex(VectorIndex):
+    """
+    vector index backed by a persistent chroma collection
+    """
+
+    def __init__(self, path: str = "db", collection_name: str = "doc_embeddings"):
+        import chromadb
+
+        self.path = path
+        self.collection_name = collection_name
+        self.collection = chromadb.PersistentClient(path=path).get_or_create_collection(
+            name=collection_name
+        )
+
+    def add(self, ids: list, embeddings, documents: list, metadatas: list):
+        self.collection.add(
+            ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas
+        )
+
+    def upsert(self, ids: list, embeddings, documents: list, metadatas: list):
+        self.collection.upsert(
+            ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas
+        )
+
+    def delete(self, ids: list):
+        if ids:
+            self.collection.delete(ids=ids)
+
+    def get_existing_ids(self, ids: list):
+        if not ids:
+            return set()
+        return set(self.collection.get(ids=ids, include=[])["ids"])
+
+    def query_batch(self, query_embeddings, n_results: int):
+        return self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=["documents", "metadatas", "distances"],
+        )
+
+    def get_all(self):
+        stored = self.collection.get(include=["embeddings", "documents", "metadatas"])
+        return {
+            "ids": stored["ids"],
+            "embeddings": np.asarray(stored["embeddings"], dtype=np.float32),
+            "documents": stored["documents"],
+            "metadatas": stored["metadatas"],
+        }
+
+    def count(self):
+        return self.collection.count()
+
+    def save(self):
+        # the persistent client writes through on every call
+        pass
+
+    @classmethod
+    def load(cls, path: str, **kwargs):
+        return cls(path=path, **kwargs)
+
+
+class NumpyVectorIndex(VectorIndex):
+    """
+    exact vector index holding the embeddings in a float32/float16 matrix, saved as an .npy file that is
+    memory-mapped on load next to a json sidecar with the ids, documents and metadatas
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        dtype: Literal["float32", "float16"] = "float32",
+        document_block_size: int = 65536,
+    ):
+        """
+        :param path: directory the index is saved to
+        :param dtype: storage precision of the embedding matrix, distances are always computed in float32
+        :param document_block_size: number of stored embeddings scored at once, bounds the query memory
+        """
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.document_block_size = document_block_size
+        self.embeddings = None
+        self.pending_embeddings = []
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self.id_to_row = {}
+
+    @classmethod
+    def from_index(cls, index: VectorIndex, **kwargs):
+        """
+        used to build an in-memory exact copy of any other index
+        :param index:
+        :return:
+        """
+        numpy_index = cls(**kwargs)
+        stored = index.get_all()
+        if stored["ids"]:
+            numpy_index.add(
+                stored["ids"],
+                stored["embeddings"],
+                stored["documents"],
+                stored["metadatas"],
+            )
+        return numpy_index
+
+    def get_embedding_matrix(self):
+        """
+        used to fold the embeddings appended since the last call into the embedding matrix, appends are
+        buffered so that many small upserts don't copy the whole matrix each time
+        :return: (num_entries, dim) matrix, None if the index is empty
+        """
+        if self.pending_embeddings:
+            blocks = self.pending_embeddings
+            if self.embeddings is not None:
+                blocks = [self.embeddings] + blocks
+            self.embeddings = np.concatenate(blocks)
+            self.pending_embeddings = []
+        return self.embeddings
+
+    def add(self, ids: list, embeddings, documents: list, metadatas: list):
+        duplicate_ids = [id_ for id_ in ids if id_ in self.id_to_row]
+        if duplicate_ids or len(set(ids)) != len(ids):
+            raise ValueError(f"Duplicate ids in the index: {duplicate_ids or ids}")
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=self.dtype))
+        for id_ in ids:
+            self.id_to_row[id_] = len(self.ids)
+            self.ids.append(id_)
+        self.documents.extend(documents)
+        self.metadatas.extend(metadatas)
+        self.pending_embeddings.append(embeddings)
+
+    def upsert(self, ids: list, embeddings, documents: list, metadatas: list):
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=self.dtype))
+        new_rows = []
+        for position, id_ in enumerate(ids):
+            row = self.id_to_row.get(id_)
+            if row is None:
+                new_rows.append(position)
+                continue
+            matrix = self.get_embedding_matrix()
+            if not matrix.flags.writeable:
+                # copy a loaded memory-mapped matrix before writing to it
+                self.embeddings = matrix = np.array(matrix)
+            matrix[row] = embeddings[position]
+            self.documents[row] = documents[position]
+            self.metadatas[row] = metadatas[position]
+        if new_rows:
+            self.add(
+                [ids[position] for position in new_rows],
+                embeddings[new_rows],
+                [documents[position] for position in new_rows],
+                [metadatas[position] for position in new_rows],
+            )
+
+    def delete(self, ids: list):
+        rows = {self.id_to_row[id_] for id_ in ids if id_ in self.id_to_row}
+        if not rows:
+            return
+        matrix = self.get_embedding_matrix()
+        keep = np.array([row not in rows for row in range(len(self.ids))], dtype=bool)
+        self.embeddings = np.asarray(matrix)[keep]
+        self.ids = [id_ for row, id_ in enumerate(self.ids) if keep[row]]
+        self.documents = [doc for row, doc in enumerate(self.documents) if keep[row]]
+        self.metadatas = [
+            metadata for row, metadata in enumerate(self.metadatas) if keep[row]
+        ]
+        self.id_to_row = {id_: row for row, id_ in enumerate(self.ids)}
+
+    def get_existing_ids(self, ids: list):
+        return {id_ for id_ in ids if id_ in self.id_to_row}
+
+    def query_batch(self, query_embeddings, n_results: int):
+        query_embeddings = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        if self.count() == 0:
+            empty = [[] for _ in range(len(query_embeddings))]
+            return {
+                "ids": empty,
+                "documents": empty,
+                "metadatas": empty,
+                "distances": empty,
+            }
+
+        matrix = self.get_embedding_matrix()
+        block_indices = []
+        block_distances = []
+        for start in range(0, self.count(), self.document_block_size):
+            block = np.asarray(
+                matrix[start : start + self.document_block_size],
+                dtype=np.float32,
+            )
+            indices, distances = top_k_l2(query_embeddings, block, n_results)
+            block_indices.append(indices + start)
+            block_distances.append(distances)
+        indices = np.concatenate(block_indices, axis=1)
+        distances = np.concatenate(block_distances, axis=1)
+        order = np.argsort(distances, axis=1, kind="stable")[:, :n_results]
+        indices = np.take_along_axis(indices, order, axis=1)
+        distances = np.take_along_axis(distances, order, axis=1)
+        return {
+            "ids": [[self.ids[idx] for idx in row] for row in indices],
+            "documents": [[self.documents[idx] for idx in row] for row in indices],
+            "metadatas": [[self.metadatas[idx] for idx in row] for row in indices],
+            "distances": distances.tolist(),
+        }
+
+    def get_all(self):
+        matrix = self.get_embedding_matrix()
+        return {
+            "ids": list(self.ids),
+            "embeddings": (
+                np.asarray(matrix, dtype=np.float32)
+                if matrix is not None
+                else np.zeros((0, 0), dtype=np.float32)
+            ),
+            "documents": list(self.documents),
+            "metadatas": list(self.metadatas),
+        }
+
+    def count(self):
+        return len(self.ids)
+
+    def save(self):
+        if self.path is None:
+            raise ValueError("NumpyVectorIndex has no path to save to")
+        os.makedirs(self.path, exist_ok=True)
+        # write next to the target and swap it in, the current file may still be memory-mapped
+        matrix = self.get_embedding_matrix()
+        if matrix is not None:
+            embeddings_path = os.path.join(self.path, "embeddings.npy")
+            with open(embeddings_path + ".tmp", "wb") as f:
+                np.save(f, np.asarray(matrix, dtype=self.dtype))
+            os.replace(embeddings_path + ".tmp", embeddings_path)
+        sidecar_path = os.path.join(self.path, "sidecar.json")
+        with open(sidecar_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "dtype": self.dtype.name,
+                    "ids": self.ids,
+                    "documents": self.documents,
+                    "metadatas": self.metadatas,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(sidecar_path + ".tmp", sidecar_path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs):
+        """
+        used to load a saved index, the embedding matrix is memory-mapped read-only
+        :param path: directory the index was saved to
+        :return: loaded index, an empty one if nothing was saved yet
+        """
+        sidecar_path = os.path.join(path, "sidecar.json")
+        if not os.path.exists(sidecar_path):
+            return cls(path=path, **kwargs)
+        with open(sidecar_path, "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+        kwargs.setdefault("dtype", sidecar["dtype"])
+        index = cls(path=path, **kwargs)
+        index.ids = sidecar["ids"]
+        index.documents = sidecar["documents"]
+        index.metadatas = sidecar["metadatas"]
+        index.id_to_row = {id_: row for row, id_ in enumerate(index.ids)}
+        if index.ids:
+            index.embeddings = np.load(
+                os.path.join(path, "embeddings.npy"), mmap_mode="r"
+            )
+        return index
+
+
+class CompactVectorIndex(NumpyVectorIndex):
+    """
+    numpy index that keeps a compact copy of the embeddings in memory: Matryoshka truncated to the first
+    truncate_dim dimensions and stored as float32, int8 (per dimension ranges) or sign bits. The first search pass
+    scores the compact vectors by cosine similarity, the rescore_multiplier * n_results best candidates are then
+    rescored by exact squared l2 distance against the full precision matrix, which stays memory-mapped on disk
+    and is only read for those rows.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        dtype: Literal["float32", "float16"] = "float32",
+        document_block_size: int = 16384,
+        truncate_dim: int | None = None,
+        quantization: Literal["float32", "int8", "binary"] = "int8",
+        rescore_multiplier: int = 4,
+    ):
+        """
+        :param path: directory the index is saved to
+        :param dtype: storage precision of the full precision matrix used for rescoring
+        :param document_block_size: number of compact vectors scored at once, bounds the query memory
+        :param truncate_dim: number of leading dimensions kept in the compact vectors, all of them by default
+        :param quantization: storage type of the compact vectors
+        :param rescore_multiplier: candidates rescored at full precision per requested result
+        """
+        if quantization not in ("float32", "int8", "binary"):
+            raise ValueError("Invalid compact index quantization")
+        super().__init__(
+            path=path, dtype=dtype, document_block_size=document_block_size
+        )
+        self.truncate_dim = truncate_dim
+        self.quantization = quantization
+        self.rescore_multiplier = rescore_multiplier
+        self.compact_embeddings = None
+        # per dimension (minimum, maximum) of the truncated vectors the int8 codes are scaled to
+        self.calibration = None
+
+    def get_config(self):
+        return {"truncate_dim": self.truncate_dim, "quantization": self.quantization}
+
+    def truncate(self, embeddings: np.ndarray):
+        """
+        used to keep the leading Matryoshka dimensions and renormalize them to unit length
+        :param embeddings:
+        :return: float32 matrix
+        """
+        embeddings = np.asarray(embeddings[:, : self.truncate_dim], dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    def quantize(self, truncated: np.ndarray):
+        if self.quantization == "int8":
+            minimum, maximum = self.calibration
+            scale = np.maximum(maximum - minimum, 1e-12)
+            return np.clip(
+                np.round((truncated - minimum) / scale * 255 - 128), -128, 127
+            ).astype(np.int8)
+        elif self.quantization == "binary":
+            return np.packbits(truncated > 0, axis=1)
+        return truncated
+
+    def get_compact_matrix(self):
+        """
+        used to get the compact vectors, rebuilt block by block from the full precision matrix after changes
+        :return: compact matrix, None if the index is empty
+        """
+        matrix = self.get_embedding_matrix()
+        if matrix is None or len(matrix) == 0:
+            return None
+        if self.compact_embeddings is not None and len(self.compact_embeddings) == len(
+            matrix
+        ):
+            return self.compact_embeddings
+        blocks = range(0, len(matrix), self.document_block_size)
+        if self.quantization == "int8":
+            minimum, maximum = None, None
+            for start in blocks:
+                truncated = self.truncate(
+                    matrix[start : start + self.document_block_size]
+                )
+                block_minimum, block_maximum = truncated.min(axis=0), truncated.max(
+                    axis=0
+                )
+                minimum = (
+                    block_minimum
+                    if minimum is None
+                    else np.minimum(minimum, block_minimum)
+                )
+                maximum = (
+                    block_maximum
+                    if maximum is None
+                    else np.maximum(maximum, block_maximum)
+                )
+            self.calibration = (minimum, maximum)
+        self.compact_embeddings = np.concatenate(
+            [
+                self.quantize(
+                    self.truncate(matrix[start : start + self.document_block_size])
+                )
+                for start in blocks
+            ]
+        )
+        return self.compact_embeddings
+
+    def add(self, ids: list, embeddings, documents: list, metadatas: list):
+        super().add(ids, embeddings, documents, metadatas)
+        self.compact_embeddings = None
+
+    def upsert(self, ids: list, embeddings, documents: list, metadatas: list):
+        super().upsert(ids, embeddings, documents, metadatas)
+        self.compact_embeddings = None
+
+    def delete(self, ids: list):
+        super().delete(ids)
+        self.compact_embeddings = None
+
+    def score_compact(self, query_embeddings: np.ndarray, compact_block: np.ndarray):
+        """
+        used to score queries against a block of compact vectors, higher is more similar
+        :param query_embeddings: full precision query matrix
+        :param compact_block:
+        :return: (num_queries, block_size) scores
+        """
+        truncated = self.truncate(query_embeddings)
+        if self.quantization == "int8":
+            # asymmetric scoring, the query stays in float and is scaled like the codes were, the per query
+            # offset of the affine dequantization doesn't change the ranking
+            minimum, maximum = self.calibration
+            return (truncated * (maximum - minimum) / 255) @ compact_block.astype(
+                np.float32
+            ).T
+        elif self.quantization == "binary":
+            # dot product of +-1 vectors, equivalent to ranking by hamming distance
+            dim = truncated.shape[1]
+            query_signs = np.where(truncated > 0, 1.0, -1.0).astype(np.float32)
+            block_signs = (
+                np.unpackbits(compact_block, axis=1)[:, :dim].astype(np.float32) * 2 - 1
+            )
+            return query_signs @ block_signs.T
+        return truncated @ compact_block.T
+
+    def query_batch(self, query_embeddings, n_results: int):
+        query_embeddings = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        compact_matrix = self.get_compact_matrix()
+        if compact_matrix is None:
+            return super().query_batch(query_embeddings, n_results)
+
+        num_candidates = min(n_results * self.rescore_multiplier, self.count())
+        block_indices = []
+        block_scores = []
+        for start in range(0, self.count(), self.document_block_size):
+            scores = self.score_compact(
+                query_embeddings,
+                compact_matrix[start : start + self.document_block_size],
+            )
+            k = min(num_candidates, scores.shape[1])
+            indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            block_indices.append(indices + start)
+            block_scores.append(np.take_along_axis(scores, indices, axis=1))
+        indices = np.concatenate(block_indices, axis=1)
+        scores = np.concatenate(block_scores, axis=1)
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :num_candidates]
+        candidates = np.take_along_axis(indices, order, axis=1)
+
+        # rescore the candidates at full precision, only their rows of the memory-mapped matrix are read
+        matrix = self.get_embedding_matrix()
+        candidate_rows = np.unique(candidates)
+        candidate_embeddings = np.asarray(matrix[candidate_rows], dtype=np.float32)
+        row_positions = np.searchsorted(candidate_rows, candidates)
+        distances = np.sum(
+            (candidate_embeddings[row_positions] - query_embeddings[:, None, :]) ** 2,
+            axis=2,
+        )
+        order = np.argsort(distances, axis=1, kind="stable")[:, :n_results]
+        indices = np.take_along_axis(candidates, order, axis=1)
+        distances = np.take_along_axis(distances, order, axis=1)
+        return {
+            "ids": [[self.ids[idx] for idx in row] for row in indices],
+            "documents": [[self.documents[idx] for idx in row] for row in indices],
+            "metadatas": [[self.metadatas[idx] for idx in row] for row in indices],
+            "distances": distances.tolist(),
+        }
+
+    def get_memory_footprint(self):
+        """
+        used to report the bytes of the in-memory compact vectors, the full precision matrix stays on disk
+        :return:
+        """
+        compact_matrix = self.get_compact_matrix()
+        return 0 if compact_matrix is None else compact_matrix.nbytes
+
+    def save(self):
+        super().save()
+        compact_matrix = self.get_compact_matrix()
+        if compact_matrix is None:
+            return
+        compact_path = os.path.join(self.path, "compact.npy")
+        with open(compact_path + ".tmp", "wb") as f:
+            np.save(f, compact_matrix)
+        os.replace(compact_path + ".tmp", compact_path)
+        config_path = os.path.join(self.path, "compact.json")
+        with open(config_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    **self.get_config(),
+                    "calibration": (
+                        [values.tolist() for values in self.calibration]
+                        if self.calibration is not None
+                        else None
+                    ),
+                },
+                f,
+            )
+        os.replace(config_path + ".tmp", config_path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs):
+        """
+        used to load a saved index, the full precision matrix is memory-mapped and the compact vectors are read
+        into memory if they were saved with the same truncation and quantization
+        :param path: directory the index was saved to
+        :return:
+        """
+        index = super().load(path, **kwargs)
+        config_path = os.path.join(path, "compact.json")
+        if index.ids and os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+            if {key: config[key] for key in index.get_config()} == index.get_config():
+                index.compact_embeddings = np.load(os.path.join(path, "compact.npy"))
+                if config["calibration"] is not None:
+                    index.calibration = tuple(
+                        np.asarray(values, dtype=np.float32)
+                        for values in config["calibration"]
+                    )
+        return index
+
+
+def get_vector_index(
+    backend: Literal["chroma", "numpy", "compact"] = "chroma",
+    path: str = "db",
+    **kwargs,
+):
+    """
+    used to open the vector index of the given backend
+    :param backend: chroma persistent collection, exact memory-mapped numpy matrix, or truncated / quantized
+    compact vectors with full precision rescoring
+    :param path: database directory
+    :return:
+    """
+    if backend == "chroma":
+        return ChromaVectorIndex.load(path, **kwargs)
+    elif backend == "numpy":
+        return NumpyVectorIndex.load(os.path.join(path, "numpy_index"), **kwargs)
+    elif backend == "compact":
+        return CompactVectorIndex.load(os.path.join(path, "compact_index"), **kwargs)
+    else:
+        raise ValueError("Invalid vector index backend")
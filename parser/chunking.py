@@ -0,0 +1,150 @@
+from bisect import bisect_left, bisect_right
+
+
+class TokenChunker:
+    """
+    cuts sections into chunks that fit the context window of the model. All sections of a call are tokenized in
+    one batched fast-tokenizer call and chunks are cut on token boundaries through the offset mappings, preferring
+    paragraph boundaries and hard splitting paragraphs that are longer than the context window.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        context_window: int,
+        overlap: int = 0,
+        separator: str = "\n",
+    ):
+        """
+        :param tokenizer: huggingface fast tokenizer of the bi-encoder
+        :param context_window: maximum number of tokens per chunk, including the special tokens added at embed time
+        :param overlap: number of tokens repeated from the end of the previous chunk at the start of the next one
+        :param separator: string the paragraphs of a section are joined with
+        """
+        if not tokenizer.is_fast:
+            raise ValueError("TokenChunker needs a fast tokenizer for offset mappings")
+        self.tokenizer = tokenizer
+        self.context_window = context_window
+        self.budget = context_window - tokenizer.num_special_tokens_to_add()
+        if self.budget <= 0:
+            raise ValueError("CONTEXT_WINDOW is too small for the special tokens")
+        if not 0 <= overlap < self.budget:
+            raise ValueError(
+                "overlap must be non negative and smaller than the chunk size"
+            )
+        self.overlap = overlap
+        self.separator = separator
+
+    def join_paragraphs(self, paragraphs: list):
+        """
+        used to join the paragraphs of a section and remember where each of them ends
+        :param paragraphs:
+        :return: section text, character offsets of the paragraph ends
+        """
+        text = ""
+        paragraph_ends = []
+        for paragraph in paragraphs:
+            if not paragraph:
+                continue
+            if text:
+                text += self.separator
+            text += paragraph
+            paragraph_ends.append(len(text))
+        return text, paragraph_ends
+
+    def cut(self, text: str, offsets: list, paragraph_ends: list, budget: int):
+        """
+        used to cut one tokenized section into chunks of at most budget tokens
+        :param text: section text
+        :param offsets: (start, end) character offsets of every token of the text
+        :param paragraph_ends: character offsets the chunks should preferably end at
+        :param budget: maximum number of tokens per chunk, without special tokens
+        :return: list of chunks
+        """
+        num_tokens = len(offsets)
+        if num_tokens == 0:
+            return [text] if text.strip() else []
+        token_starts = [start for start, _ in offsets]
+        # token index right after every paragraph, i.e. the first token starting at or after its end
+        boundaries = sorted({bisect_left(token_starts, end) for end in paragraph_ends})
+
+        chunks = []
+        start = 0
+        # end of the previous chunk, a chunk has to extend past it and not just repeat the overlap
+        covered = 0
+        while start < num_tokens:
+            limit = start + budget
+            if limit >= num_tokens:
+                end = num_tokens
+            else:
+                position = bisect_right(boundaries, limit) - 1
+                if position >= 0 and boundaries[position] > covered:
+                    end = boundaries[position]
+                else:
+                    # no paragraph ends inside the window, hard split the paragraph
+                    end = limit
+            chunks.append(text[offsets[start][0] : offsets[end - 1][1]])
+            if end >= num_tokens:
+                break
+            covered = end
+            start = max(end - self.overlap, start + 1)
+        return chunks
+
+    def count_tokens(self, texts: list):
+        """
+        used to count the tokens of every text the way they will be embedded, special tokens included
+        :param texts:
+        :return: list of token counts
+        """
+        if not texts:
+            return []
+        return [len(input_ids) for input_ids in self.tokenizer(texts)["input_ids"]]
+
+    def split_text(self, text: str, budget: int):
+        """
+        used to cut a single text without paragraph structure
+        :param text:
+        :param budget: maximum number of tokens per chunk, without special tokens
+        :return: list of chunks
+        """
+        offsets = self.tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True
+        )["offset_mapping"]
+        return self.cut(text, offsets, [], budget)
+
+    def chunk_sections(self, sections: list):
+        """
+        used to chunk several sections at once
+        :param sections: list of paragraph lists
+        :return: list of chunk lists, one per section
+        """
+        joined_sections = [self.join_paragraphs(paragraphs) for paragraphs in sections]
+        texts = [text for text, _ in joined_sections]
+        offset_mappings = (
+            self.tokenizer(
+                texts, add_special_tokens=False, return_offsets_mapping=True
+            )["offset_mapping"]
+            if texts
+            else []
+        )
+        chunked_sections = [
+            self.cut(text, offsets, paragraph_ends, self.budget)
+            for (text, paragraph_ends), offsets in zip(joined_sections, offset_mappings)
+        ]
+
+        # a chunk cut out of its section can tokenize slightly differently at its edges, re-check them
+        # with one call per section and shrink the few that ended up over the context window
+        for chunks in chunked_sections:
+            token_counts = self.count_tokens(chunks)
+            idx = 0
+            while idx < len(chunks):
+                excess = token_counts[idx] - self.context_window
+                if excess > 0:
+                    smaller_chunks = self.split_text(
+                        chunks[idx], max(1, self.budget - excess)
+                    )
+                    chunks[idx : idx + 1] = smaller_chunks
+                    token_counts[idx : idx + 1] = self.count_tokens(smaller_chunks)
+                    continue
+                idx += 1
+        return chunked_sections
@@ -0,0 +1,332 @@
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Literal
+
+from tqdm import tqdm
+
+from pipeline.instrumentation import metrics
+from pipeline.jsonl_io import read_jsonl, write_jsonl
+from pipeline.manifest import file_hash
+
+# parser reused by every document a pool worker handles, built once in init_worker
+worker_parser = None
+
+
+def init_worker(output_type: str, num_threads: int):
+    """
+    used to build the per-process parser, so the DocumentConverter models and the tokenizer are loaded once per
+    worker instead of once per file
+    :param output_type:
+    :param num_threads: torch threads per worker so that workers don't oversubscribe the cpu
+    :return:
+    """
+    global worker_parser
+    import torch
+
+    from parser.docling_parser import PDFParser
+
+    torch.set_num_threads(num_threads)
+    # documents are already spread over the workers, so they are not split into page range shards again
+    worker_parser = PDFParser(
+        pdf_path=None,
+        output_path=None,
+        output_type=output_type,
+        pages_per_shard=0,
+        num_threads=num_threads,
+    )
+
+
+def parse_document(doc_id: str, pdf_path: str, output_path: str):
+    """
+    used to parse a single pdf inside a pool worker, any failure is returned instead of raised so one broken
+    file doesn't stop the corpus
+    :param doc_id:
+    :param pdf_path:
+    :param output_path: directory the per-document outputs are written to
+    :return: result dict with status, page count and elapsed seconds
+    """
+    start = time.perf_counter()
+    try:
+        os.makedirs(output_path, exist_ok=True)
+        worker_parser.pdf_path = pdf_path
+        worker_parser.output_path = output_path
+        doc = worker_parser.save()
+        return {
+            "doc_id": doc_id,
+            "pdf_path": pdf_path,
+            "status": "success",
+            "pages": worker_parser.get_num_pages(doc),
+            "seconds": time.perf_counter() - start,
+        }
+    except Exception as e:
+        return {
+            "doc_id": doc_id,
+            "pdf_path": pdf_path,
+            "status": "failed",
+            "error": f"{type(e).__name__}: {e}",
+            "seconds": time.perf_counter() - start,
+        }
+
+
+class CorpusParser:
+    """
+    parses a directory or manifest of pdfs across a process pool and merges the per-document outputs into
+    corpus level outputs whose section titles are prefixed with the document id
+    """
+
+    def __init__(
+        self,
+        input_path: str,
+        output_path: str = "parser/output/corpus",
+        output_type: Literal["json", "jsonl"] = "json",
+        num_workers: int | None = None,
+    ):
+        """
+        :param input_path: directory searched recursively for pdfs, or a manifest file (.txt with one path per
+        line, .json list of paths or {"doc_id", "path"} objects)
+        :param output_path: corpus output directory, each document gets a <doc_id> sub directory
+        :param output_type: json or jsonl
+        :param num_workers: number of parsing processes, defaults to the cpu count
+        """
+        self.input_path = input_path
+        self.output_path = output_path
+        self.output_type = output_type
+        self.num_workers = num_workers or os.cpu_count() or 1
+
+    @staticmethod
+    def get_document_id(pdf_path: str, root: str):
+        """
+        used to derive a stable document id from the pdf path relative to the corpus root
+        :param pdf_path:
+        :param root:
+        :return:
+        """
+        relative_path = os.path.splitext(os.path.relpath(pdf_path, root))[0]
+        return re.sub(r"[^A-Za-z0-9._-]+", "__", relative_path)
+
+    def get_documents(self):
+        """
+        used to list the documents of the corpus
+        :return: list of (doc_id, pdf_path)
+        """
+        if os.path.isdir(self.input_path):
+            pdf_paths = sorted(
+                os.path.join(dir_path, file_name)
+                for dir_path, _, file_names in os.walk(self.input_path)
+                for file_name in file_names
+                if file_name.lower().endswith(".pdf")
+            )
+            documents = [
+                (self.get_document_id(pdf_path, self.input_path), pdf_path)
+                for pdf_path in pdf_paths
+            ]
+            self.check_unique_document_ids(documents)
+            return documents
+
+        manifest_dir = os.path.dirname(self.input_path)
+        if self.input_path.endswith(".json"):
+            with open(self.input_path, "r") as f:
+                entries = json.load(f)
+        else:
+            with open(self.input_path, "r") as f:
+                entries = [line.strip() for line in f if line.strip()]
+        documents = []
+        for entry in entries:
+            if isinstance(entry, dict):
+                pdf_path = os.path.join(manifest_dir, entry["path"])
+                doc_id = entry.get("doc_id") or self.get_document_id(
+                    pdf_path, manifest_dir
+                )
+            else:
+                pdf_path = os.path.join(manifest_dir, entry)
+                doc_id = self.get_document_id(pdf_path, manifest_dir)
+            documents.append((doc_id, pdf_path))
+        self.check_unique_document_ids(documents)
+        return documents
+
+    @staticmethod
+    def check_unique_document_ids(documents: list):
+        """
+        used to reject documents that would share an output directory, e.g. "a b.pdf" and "a__b.pdf" or "x.pdf"
+        and "x.PDF". Ids are compared case-insensitively since they are directory names.
+        :param documents: list of (doc_id, pdf_path)
+        :return:
+        """
+        pdf_paths_by_id = {}
+        for doc_id, pdf_path in documents:
+            pdf_paths_by_id.setdefault(doc_id.lower(), []).append(pdf_path)
+        collisions = [
+            pdf_paths for pdf_paths in pdf_paths_by_id.values() if len(pdf_paths) > 1
+        ]
+        if collisions:
+            raise ValueError(
+                "Documents map to the same document id, rename them or list them in a manifest with a doc_id: "
+                + "; ".join(", ".join(pdf_paths) for pdf_paths in collisions)
+            )
+
+    def merge_outputs(self, doc_ids: list):
+        """
+        used to merge the tokenizer adjusted outputs of the successfully parsed documents, titles are keyed by
+        document id so identical section titles from different documents don't collide
+        :param doc_ids:
+        :return:
+        """
+        if self.output_type == "jsonl":
+
+            def iter_records():
+                for doc_id in doc_ids:
+                    for record in read_jsonl(
+                        os.path.join(
+                            self.output_path,
+                            doc_id,
+                            "tokenizer_adjusted_parsed_output.jsonl",
+                        )
+                    ):
+                        yield {
+                            **record,
+                            "doc_id": doc_id,
+                            "title": f"{doc_id}/{record['title']}",
+                        }
+
+            write_jsonl(
+                os.path.join(
+                    self.output_path, "tokenizer_adjusted_parsed_output.jsonl"
+                ),
+                iter_records(),
+            )
+        else:
+            merged_content = {}
+            for doc_id in doc_ids:
+                with open(
+                    os.path.join(
+                        self.output_path,
+                        doc_id,
+                        "tokenizer_adjusted_parsed_output.json",
+                    ),
+                    "r",
+                ) as f:
+                    for title, content in json.load(f).items():
+                        merged_content[f"{doc_id}/{title}"] = {
+                            **content,
+                            "doc_id": doc_id,
+                        }
+            with open(
+                os.path.join(self.output_path, "tokenizer_adjusted_parsed_output.json"),
+                "w",
+                encoding="utf-8",
+            ) as f:
+                json.dump(merged_content, f, ensure_ascii=False, indent=4)
+
+    def save(self, previous_document_hashes: dict | None = None):
+        """
+        parse every document of the corpus, merge the outputs and write a throughput report
+        :param previous_document_hashes: {doc_id: pdf hash} of an earlier run, documents with an unchanged hash
+        and existing outputs are not parsed again
+        :return: report dict, including the pdf hash of every successfully parsed or reused document
+        """
+        documents = self.get_documents()
+        os.makedirs(self.output_path, exist_ok=True)
+        previous_document_hashes = previous_document_hashes or {}
+        document_hashes = {
+            doc_id: file_hash(pdf_path) for doc_id, pdf_path in documents
+        }
+        extension = "jsonl" if self.output_type == "jsonl" else "json"
+        results = []
+        documents_to_parse = []
+        for doc_id, pdf_path in documents:
+            output_exists = os.path.exists(
+                os.path.join(
+                    self.output_path,
+                    doc_id,
+                    f"tokenizer_adjusted_parsed_output.{extension}",
+                )
+            )
+            if (
+                output_exists
+                and previous_document_hashes.get(doc_id) == document_hashes[doc_id]
+            ):
+                results.append(
+                    {"doc_id": doc_id, "pdf_path": pdf_path, "status": "unchanged"}
+                )
+            else:
+                documents_to_parse.append((doc_id, pdf_path))
+        num_workers = min(self.num_workers, len(documents_to_parse)) or 1
+
+        start = time.perf_counter()
+        if documents_to_parse:
+            with ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(
+                    self.output_type,
+                    max(1, (os.cpu_count() or 1) // num_workers),
+                ),
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        parse_document,
+                        doc_id,
+                        pdf_path,
+                        os.path.join(self.output_path, doc_id),
+                    ): (doc_id, pdf_path)
+                    for doc_id, pdf_path in documents_to_parse
+                }
+                for future in tqdm(
+                    as_completed(futures), total=len(futures), desc="Parsing corpus"
+                ):
+                    doc_id, pdf_path = futures[future]
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        # a crashed worker process surfaces here instead of inside parse_document
+                        results.append(
+                            {
+                                "doc_id": doc_id,
+                                "pdf_path": pdf_path,
+                                "status": "failed",
+                                "error": f"{type(e).__name__}: {e}",
+                            }
+                        )
+        elapsed = time.perf_counter() - start
+
+        document_order = {doc_id: idx for idx, (doc_id, _) in enumerate(documents)}
+        results.sort(key=lambda result: document_order[result["doc_id"]])
+        succeeded = [result for result in results if result["status"] == "success"]
+        usable = [result for result in results if result["status"] != "failed"]
+        self.merge_outputs([result["doc_id"] for result in usable])
+
+        pages = sum(result["pages"] for result in succeeded)
+        # the workers' own metrics stay in their processes, their per-document results are recorded instead
+        for result in succeeded:
+            metrics.observe("parse.convert", result["seconds"])
+            metrics.increment("parse.documents")
+            metrics.increment("parse.pages", result["pages"])
+        report = {
+            "documents": len(documents),
+            "succeeded": len(succeeded),
+            "unchanged": len(usable) - len(succeeded),
+            "failed": len(results) - len(usable),
+            "pages": pages,
+            "workers": num_workers,
+            "seconds": elapsed,
+            "docs_per_min": len(succeeded) * 60 / elapsed if elapsed else 0.0,
+            "pages_per_sec": pages / elapsed if elapsed else 0.0,
+            "results": results,
+            "document_hashes": {
+                result["doc_id"]: document_hashes[result["doc_id"]] for result in usable
+            },
+        }
+        with open(
+            os.path.join(self.output_path, "corpus_report.json"), "w", encoding="utf-8"
+        ) as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(
+            f"Parsed {report['succeeded']}/{report['documents']} documents "
+            f"({report['unchanged']} unchanged, {report['failed']} failed) at {report['docs_per_min']:.2f} docs/min"
+        )
+        return report
@@ -1,38 +1,295 @@
+import itertools
 import json
+import multiprocessing
 import os
-from typing import Any, Literal
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterable, Literal
 
-from docling.document_converter import DocumentConverter
+from docling.datamodel.accelerator_options import AcceleratorOptions
+from docling.datamodel.base_models import InputFormat
+from docling.datamodel.pipeline_options import PdfPipelineOptions
+from docling.document_converter import DocumentConverter, PdfFormatOption
 from dotenv import load_dotenv
-from huggingface_hub import login
 from transformers import AutoTokenizer
 
+from parser.chunking import TokenChunker
+from pipeline.hub import login_for_download
+from pipeline.instrumentation import metrics
+from pipeline.jsonl_io import iter_grouped_by_title, read_jsonl, write_jsonl
+
 load_dotenv()
-if os.getenv("HF_TOKEN") is None:
-    raise ValueError("HF_TOKEN not found in the environment variables")
-login(token=os.getenv("HF_TOKEN"))
+
+ParserProfile = Literal["fast", "full"]
+
+# converter reused by every shard a pool worker handles, built once in init_shard_worker
+worker_converter = None
+
+# item lists of a DoclingDocument json, whose items reference each other as "#/<list>/<index>"
+DOCUMENT_ITEM_LISTS = (
+    "texts",
+    "groups",
+    "tables",
+    "pictures",
+    "key_value_items",
+    "form_items",
+)
+ITEM_REF_PATTERN = re.compile(r"^#/(\w+)/(\d+)$")
+
+
+def build_converter(
+    profile: ParserProfile = "full",
+    num_threads: int | None = None,
+    device: str | None = None,
+):
+    """
+    used to build the docling converter of a speed profile. fast only runs the layout model on the pdf text
+    layer, without OCR and table structure, since only the text items are consolidated. full also OCRs
+    bitmaps and recognizes table structure (docling's default)
+    :param profile:
+    :param num_threads: threads of the docling models, None keeps docling's default
+    :param device: e.g. cpu or cuda, None lets docling pick
+    :return:
+    """
+    if profile == "fast":
+        pipeline_options = PdfPipelineOptions(do_ocr=False, do_table_structure=False)
+    elif profile == "full":
+        pipeline_options = PdfPipelineOptions(do_ocr=True, do_table_structure=True)
+    else:
+        raise ValueError("Invalid parser profile")
+    accelerator_options = {}
+    if num_threads is not None:
+        accelerator_options["num_threads"] = num_threads
+    if device is not None:
+        accelerator_options["device"] = device
+    if accelerator_options:
+        pipeline_options.accelerator_options = AcceleratorOptions(**accelerator_options)
+    return DocumentConverter(
+        format_options={
+            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+        }
+    )
+
+
+def init_shard_worker(profile: ParserProfile, num_threads: int, device: str | None):
+    """
+    used to build the per-process converter, so the docling models are loaded once per worker instead of once
+    per shard
+    :param profile:
+    :param num_threads: threads per worker so that workers don't oversubscribe the cpu
+    :param device:
+    :return:
+    """
+    global worker_converter
+    import torch
+
+    torch.set_num_threads(num_threads)
+    worker_converter = build_converter(profile, num_threads, device)
+
+
+def convert_shard(pdf_path: str, start_page: int, end_page: int):
+    """
+    used to convert a page range of a pdf inside a pool worker
+    :param pdf_path:
+    :param start_page: first page, 1-based
+    :param end_page: last page, inclusive
+    :return: parsed json of the page range, page numbers in it are those of the whole pdf
+    """
+    doc = worker_converter.convert(pdf_path, page_range=(start_page, end_page))
+    return doc.document.export_to_dict()
 
 
 class PDFParser:
     def __init__(
-        self, pdf_path: str, output_path: str, output_type: Literal["json", "markdown"]
+        self,
+        pdf_path: str,
+        output_path: str,
+        output_type: Literal["json", "jsonl", "markdown"],
+        profile: ParserProfile | None = None,
+        pages_per_shard: int | None = None,
+        num_workers: int | None = None,
+        num_threads: int | None = None,
+        device: str | None = None,
     ):
+        """
+        :param pdf_path:
+        :param output_path:
+        :param output_type:
+        :param profile: docling speed profile, fast or full, defaults to PARSER_PROFILE
+        :param pages_per_shard: pdfs with more pages are converted in page range shards across worker processes,
+        0 converts the whole pdf in this process, defaults to PARSER_PAGES_PER_SHARD
+        :param num_workers: number of shard worker processes, defaults to PARSER_SHARD_WORKERS or the cpu count
+        :param num_threads: threads of the docling models in this process, None keeps docling's default
+        :param device: device of the docling models, None lets docling pick
+        """
         self.pdf_path = pdf_path
         self.output_path = output_path
         self.output_type = output_type
+        self.profile = profile or os.getenv("PARSER_PROFILE", "full")
+        self.pages_per_shard = (
+            pages_per_shard
+            if pages_per_shard is not None
+            else int(os.getenv("PARSER_PAGES_PER_SHARD") or 0)
+        )
+        self.num_workers = (
+            num_workers
+            or int(os.getenv("PARSER_SHARD_WORKERS") or 0)
+            or os.cpu_count()
+            or 1
+        )
+        self.num_threads = num_threads
+        self.device = device
+        login_for_download(os.getenv("BI_ENCODER_MODEL_NAME"))
         self.tokenizer = AutoTokenizer.from_pretrained(
             os.getenv("BI_ENCODER_MODEL_NAME"), cache_dir=os.getenv("CACHE_DIR")
         )
+        self.chunker = TokenChunker(
+            self.tokenizer,
+            context_window=int(os.getenv("CONTEXT_WINDOW")),
+            overlap=int(os.getenv("CHUNK_OVERLAP", "0")),
+        )
+        self.converter = None
 
     def parse(self):
         """
-        parse the pdf file
-        :return:
+        parse the pdf file, the converter is built once and reused for every pdf parsed by this instance. Pdfs
+        longer than pages_per_shard are converted in page range shards across worker processes
+        :return: docling conversion result, or the merged parsed json of the shards
         """
-        converter = DocumentConverter()
-        doc = converter.convert(self.pdf_path)
+        if self.pages_per_shard:
+            num_pages = self.count_pdf_pages(self.pdf_path)
+            if num_pages > self.pages_per_shard:
+                return self.parse_sharded(num_pages)
+        if self.converter is None:
+            self.converter = build_converter(
+                self.profile, self.num_threads, self.device
+            )
+        with metrics.timer("parse.convert"):
+            doc = self.converter.convert(self.pdf_path)
+        metrics.increment("parse.documents")
+        metrics.increment("parse.pages", len(doc.document.pages))
         return doc
 
+    @staticmethod
+    def count_pdf_pages(pdf_path: str):
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    def parse_sharded(self, num_pages: int):
+        """
+        used to convert the pdf as page ranges of pages_per_shard pages in a process pool
+        :param num_pages: number of pages of the pdf
+        :return: merged parsed json of the shards
+        """
+        page_ranges = [
+            (start_page, min(start_page + self.pages_per_shard - 1, num_pages))
+            for start_page in range(1, num_pages + 1, self.pages_per_shard)
+        ]
+        num_workers = min(self.num_workers, len(page_ranges))
+        start = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_shard_worker,
+            initargs=(
+                self.profile,
+                max(1, (os.cpu_count() or 1) // num_workers),
+                self.device,
+            ),
+        ) as executor:
+            # map yields the shards in page order whatever order they finish in
+            shards = list(
+                executor.map(
+                    convert_shard,
+                    itertools.repeat(self.pdf_path),
+                    *zip(*page_ranges),
+                )
+            )
+        metrics.observe("parse.convert", time.perf_counter() - start)
+        parsed_dict = self.merge_shards(shards)
+        metrics.increment("parse.documents")
+        metrics.increment("parse.shards", len(shards))
+        metrics.increment("parse.pages", len(parsed_dict["pages"]))
+        return parsed_dict
+
+    @staticmethod
+    def merge_shards(shards: list):
+        """
+        used to merge the parsed json of page range shards, given in page order. The item lists (texts, groups,
+        tables, pictures, ...) and the body / furniture children are concatenated and every "#/<list>/<index>"
+        reference of a shard is shifted by the number of items of that list in the shards before it, so the
+        merged json has the layout of an unsharded parse. Consolidating the merged texts carries the current
+        section_header over shard boundaries: paragraphs at the start of a shard belong to the last section
+        header of the previous one
+        :param shards: parsed json per shard
+        :return: parsed json of the whole document
+        """
+        merged = {
+            **(
+                shards[0]
+                if shards
+                else {"schema_name": "DoclingDocument", "name": None}
+            ),
+            **{item_list: [] for item_list in DOCUMENT_ITEM_LISTS},
+            "pages": {},
+        }
+        for node in ("body", "furniture"):
+            if shards and node in shards[0]:
+                merged[node] = {**shards[0][node], "children": []}
+
+        for shard in shards:
+            offsets = {
+                item_list: len(merged[item_list]) for item_list in DOCUMENT_ITEM_LISTS
+            }
+
+            def shift_refs(value):
+                if isinstance(value, list):
+                    return [shift_refs(item) for item in value]
+                if not isinstance(value, dict):
+                    return value
+                shifted = {}
+                for key, item in value.items():
+                    match = (
+                        ITEM_REF_PATTERN.match(item)
+                        if key in ("self_ref", "$ref") and isinstance(item, str)
+                        else None
+                    )
+                    if match and match.group(1) in offsets:
+                        item_list, index = match.groups()
+                        shifted[key] = (
+                            f"#/{item_list}/{int(index) + offsets[item_list]}"
+                        )
+                    else:
+                        shifted[key] = shift_refs(item)
+                return shifted
+
+            for item_list in DOCUMENT_ITEM_LISTS:
+                merged[item_list].extend(shift_refs(shard.get(item_list, [])))
+            for node in ("body", "furniture"):
+                if node in merged:
+                    merged[node]["children"].extend(
+                        shift_refs(shard.get(node, {}).get("children", []))
+                    )
+            merged["pages"].update(shard.get("pages", {}))
+        return merged
+
+    @staticmethod
+    def get_num_pages(doc: Any):
+        """
+        used to count the pages of a parse result
+        :param doc: docling conversion result or merged parsed json of the shards
+        :return:
+        """
+        if isinstance(doc, dict):
+            return len(doc.get("pages", {}))
+        return len(doc.document.pages)
+
     def get_table_of_contents(self, doc: Any):
         """
         get the table of contents and page number from the parsed document
@@ -61,9 +318,11 @@ class PDFParser:
     def get_parsed_json(doc: Any):
         """
         get the parsed json from the document
-        :param doc:
+        :param doc: docling conversion result, merged shards are already parsed json
         :return:
         """
+        if isinstance(doc, dict):
+            return doc
         return doc.document.export_to_dict()
 
     @staticmethod
@@ -109,52 +368,78 @@ class PDFParser:
         token_count = len(input_ids)
         return token_count
 
+    def chunk_text_contents(self, text_contents: list):
+        """
+        used to merge the paragraphs of a section into chunks that fit the context window of the model
+        :param text_contents: paragraphs of a section
+        :return: list of chunks
+        """
+        return self.chunker.chunk_sections([text_contents])[0]
+
     def form_tokenizer_specific_content(self, parsed_content: dict):
         """
-        used to adjust the parsed content to fit the context window of the model
+        used to adjust the parsed content to fit the context window of the model, the paragraphs of all sections
+        are tokenized in one batched call
         :param parsed_content:
         :return:
         """
+        titles = list(parsed_content.keys())
+        chunked_sections = self.chunker.chunk_sections(
+            [parsed_content[title].get("text_contents", []) for title in titles]
+        )
         adjusted_content = {}
-        for title, content in parsed_content.items():
-            text_contents = content.get("text_contents", [])
-            if len(text_contents) == 1:
-                adjusted_content[title] = content
-            else:
-                accumulated_text = ""
-                accumulated_token_count = 0
-                accumulated_text_contents = []
-                spill_over_flag = False
-                for text in text_contents:
-                    token_count = self.count_tokens(text)
-                    if accumulated_token_count + token_count > int(
-                        os.getenv("CONTEXT_WINDOW")
-                    ):
-                        accumulated_text_contents.append(accumulated_text)
-                        accumulated_text = text
-                        accumulated_token_count = token_count
-                        spill_over_flag = True
-                    else:
-                        if accumulated_text == "":
-                            accumulated_text += text
-                        else:
-                            accumulated_text += ". " + text
-                        accumulated_token_count += token_count
-                        spill_over_flag = False
-                if spill_over_flag:
-                    accumulated_text_contents.append(accumulated_text)
-                else:
-                    accumulated_text_contents.append(accumulated_text)
-                adjusted_content[title] = {
-                    "start_page": content.get("start_page"),
-                    "text_contents": accumulated_text_contents,
-                }
+        for title, text_contents in zip(titles, chunked_sections):
+            adjusted_content[title] = {
+                "start_page": parsed_content[title].get("start_page"),
+                "text_contents": text_contents,
+            }
         return adjusted_content
 
+    def iter_consolidated_records(self, doc: Any):
+        """
+        used to stream the text of the parsed document as one record per paragraph, tagged with its title
+        :param doc:
+        :return: generator of {"title", "start_page", "text_content"} records
+        """
+        parsed_dict = self.get_parsed_json(doc)
+        cur_page_header = None
+        cur_start_page = None
+        for text in parsed_dict.get("texts", []):
+            if text.get("label", "") == "section_header":
+                cur_start_page = text.get("prov", [{}])[0].get("page_no")
+                cur_page_header = text.get("text") + "~" + str(cur_start_page)
+            if (
+                cur_page_header is not None
+                and text.get("label", "") != "section_header"
+                and text.get("text", "") != ""
+                and text.get("text", "") != "footnote"
+            ):
+                yield {
+                    "title": cur_page_header,
+                    "start_page": cur_start_page,
+                    "text_content": text.get("text"),
+                }
+
+    def iter_tokenizer_specific_records(self, records: Iterable[dict]):
+        """
+        used to stream context window sized chunks, only one section is held in memory at a time
+        :param records: paragraph records grouped by title, as produced by iter_consolidated_records
+        :return: generator of {"title", "start_page", "text_content"} records
+        """
+        for title, start_page, section_records in iter_grouped_by_title(records):
+            for text_content in self.chunk_text_contents(
+                [record["text_content"] for record in section_records]
+            ):
+                yield {
+                    "title": title,
+                    "start_page": start_page,
+                    "text_content": text_content,
+                }
+
     def save(self):
         """
-        save the parsed document to a file(json, markdown) in the output path
-        :return:
+        save the parsed document to a file(json, jsonl, markdown) in the output path
+        :return: parsed document
         """
         doc = self.parse()
         if self.output_type == "json":
@@ -191,7 +476,30 @@ class PDFParser:
                     indent=4,
                 )
 
+        elif self.output_type == "jsonl":
+            with open(
+                f"{self.output_path}/table_of_contents.json", "w", encoding="utf-8"
+            ) as f:
+                json.dump(
+                    self.get_table_of_contents(doc), f, ensure_ascii=False, indent=4
+                )
+            write_jsonl(
+                f"{self.output_path}/parsed_output.jsonl",
+                self.get_parsed_json(doc).get("texts", []),
+            )
+            write_jsonl(
+                f"{self.output_path}/consolidated_parsed_output.jsonl",
+                self.iter_consolidated_records(doc),
+            )
+            write_jsonl(
+                f"{self.output_path}/tokenizer_adjusted_parsed_output.jsonl",
+                self.iter_tokenizer_specific_records(
+                    read_jsonl(f"{self.output_path}/consolidated_parsed_output.jsonl")
+                ),
+            )
+
         elif self.output_type == "markdown":
             raise NotImplemented("Markdown yet to be implemented")
         else:
             raise ValueError("Invalid output type")
+        return doc
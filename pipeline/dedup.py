@@ -0,0 +1,255 @@
+"""
+Near-duplicate detection for chunks and generated questions. Texts are compared by the Jaccard similarity of their
+shingle sets, estimated from MinHash signatures; chunks are looked up through locality sensitive hashing (LSH) so
+a chunk is only compared with the chunks sharing a signature band instead of with the whole corpus. Question
+embeddings are compared by cosine similarity.
+"""
+
+import re
+import zlib
+from typing import Iterable, Iterator, Literal
+
+import numpy as np
+
+from pipeline.instrumentation import metrics
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# multiplier of the polynomial hash combining the tokens of a shingle
+SHINGLE_HASH_BASE = np.uint64(1000003)
+
+
+def normalize_text(text: str):
+    """
+    used to make case, punctuation and whitespace differences irrelevant to the comparison
+    :param text:
+    :return: lower case words separated by single spaces
+    """
+    return " ".join(TOKEN_PATTERN.findall(text.lower()))
+
+
+class MinHasher:
+    """
+    computes MinHash signatures of texts over their word or character shingles, the share of equal values in two
+    signatures estimates the Jaccard similarity of the two shingle sets. Hashes are seeded, so signatures are the
+    same across processes and runs.
+    """
+
+    def __init__(
+        self,
+        num_perm: int = 128,
+        shingle_size: int = 3,
+        shingle_unit: Literal["word", "char"] = "word",
+        seed: int = 1,
+        block_size: int = 4096,
+    ):
+        """
+        :param num_perm: number of hash functions, the signature length
+        :param shingle_size: number of words or characters per shingle, shorter texts are a single shingle
+        :param shingle_unit: word shingles for chunks, character shingles for short texts like questions
+        :param seed:
+        :param block_size: shingles hashed at once, bounds the memory of long texts to num_perm x block_size
+        """
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.shingle_unit = shingle_unit
+        self.block_size = block_size
+        # multiply-shift hash family: the products wrap around at 2**64 and the top 32 bits are kept
+        self.multipliers = rng.integers(
+            1, 2**64, size=num_perm, dtype=np.uint64
+        ) | np.uint64(1)
+        self.increments = rng.integers(0, 2**64, size=num_perm, dtype=np.uint64)
+
+    def get_shingle_hashes(self, text: str):
+        """
+        used to hash the distinct shingles of a normalized text
+        :param text:
+        :return: uint64 array of shingle hashes, empty for a text without words
+        """
+        text = normalize_text(text)
+        if self.shingle_unit == "word":
+            tokens = np.array(
+                [zlib.crc32(word.encode("utf-8")) for word in text.split()],
+                dtype=np.uint64,
+            )
+        else:
+            tokens = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(
+                np.uint64
+            )
+        size = min(self.shingle_size, len(tokens))
+        num_shingles = len(tokens) - size + 1 if size else 0
+        hashes = np.zeros(num_shingles, dtype=np.uint64)
+        for offset in range(size):
+            hashes = hashes * SHINGLE_HASH_BASE + tokens[offset : offset + num_shingles]
+        return np.unique(hashes)
+
+    def get_signature(self, text: str):
+        """
+        used to compute the MinHash signature of a text
+        :param text:
+        :return: uint32 array of num_perm values, texts without words share the all-max signature
+        """
+        hashes = self.get_shingle_hashes(text)
+        signature = np.full(self.num_perm, np.iinfo(np.uint32).max, dtype=np.uint64)
+        for start in range(0, len(hashes), self.block_size):
+            block = hashes[start : start + self.block_size]
+            permuted = (
+                self.multipliers[:, None] * block[None, :] + self.increments[:, None]
+            ) >> np.uint64(32)
+            signature = np.minimum(signature, permuted.min(axis=1))
+        return signature.astype(np.uint32)
+
+
+def estimate_jaccard(signature: np.ndarray, other_signature: np.ndarray):
+    return float(np.mean(signature == other_signature))
+
+
+def get_rows_per_band(
+    threshold: float, num_perm: int, min_candidate_probability: float = 0.95
+):
+    """
+    used to pick the LSH banding: two texts become candidates when all rows of at least one band match, which
+    happens with probability 1 - (1 - s**rows)**bands at Jaccard similarity s. More rows per band means fewer
+    dissimilar candidates, the largest rows keeping texts at the threshold likely candidates is used.
+    :param threshold: Jaccard similarity from which texts are near-duplicates
+    :param num_perm: signature length
+    :param min_candidate_probability: probability that a pair at the threshold is compared at all
+    :return: rows per band
+    """
+    rows_per_band = 1
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold**rows) ** bands >= min_candidate_probability:
+            rows_per_band = rows
+    return rows_per_band
+
+
+class MinHashLSH:
+    """
+    index of MinHash signatures for streaming near-duplicate lookups: every signature is split into bands, texts
+    sharing a band are candidates and a candidate is a near-duplicate when its estimated Jaccard similarity reaches
+    the threshold. A lookup costs the number of candidates, not the number of indexed texts.
+    """
+
+    def __init__(self, threshold: float = 0.85, min_hasher: MinHasher | None = None):
+        """
+        :param threshold: Jaccard similarity from which a text is a near-duplicate
+        :param min_hasher: signature settings, word 3-shingles by default
+        """
+        self.threshold = threshold
+        self.min_hasher = min_hasher or MinHasher()
+        self.rows_per_band = get_rows_per_band(threshold, self.min_hasher.num_perm)
+        self.num_bands = self.min_hasher.num_perm // self.rows_per_band
+        self.buckets = [{} for _ in range(self.num_bands)]
+        self.signatures = {}
+
+    def get_band_keys(self, signature: np.ndarray):
+        return [
+            signature[
+                band * self.rows_per_band : (band + 1) * self.rows_per_band
+            ].tobytes()
+            for band in range(self.num_bands)
+        ]
+
+    def query(self, signature: np.ndarray):
+        """
+        used to find an indexed near-duplicate of a signature
+        :param signature:
+        :return: key of the earliest indexed near-duplicate, None if there is none
+        """
+        candidates = set()
+        for bucket, band_key in zip(self.buckets, self.get_band_keys(signature)):
+            candidates.update(bucket.get(band_key, ()))
+        for key in sorted(candidates, key=lambda key: self.signatures[key][0]):
+            if estimate_jaccard(signature, self.signatures[key][1]) >= self.threshold:
+                return key
+        return None
+
+    def insert(self, key, signature: np.ndarray):
+        self.signatures[key] = (len(self.signatures), signature)
+        for bucket, band_key in zip(self.buckets, self.get_band_keys(signature)):
+            bucket.setdefault(band_key, []).append(key)
+
+    def add(self, key, text: str):
+        """
+        used to index a text unless it is a near-duplicate of an indexed one, so the first occurrence is kept
+        :param key: hashable id of the text
+        :param text:
+        :return: key of the near-duplicate it matched, None if the text was indexed
+        """
+        signature = self.min_hasher.get_signature(text)
+        duplicate_of = self.query(signature)
+        if duplicate_of is None:
+            self.insert(key, signature)
+        return duplicate_of
+
+
+def iter_unique_chunks(
+    records: Iterable[dict], threshold: float = 0.85
+) -> Iterator[dict]:
+    """
+    used to drop the chunk records whose text is a near-duplicate of an earlier chunk, e.g. repeated headers,
+    footers and captions. Records are streamed, only the signatures of the kept chunks are held in memory.
+    :param records: {"title", "start_page", "text_content"} records
+    :param threshold: Jaccard similarity of the word 3-shingles from which a chunk is dropped
+    :return: generator of the kept records, in input order
+    """
+    lsh = MinHashLSH(threshold)
+    for position, record in enumerate(records):
+        if not record.get("text_content"):
+            yield record
+            continue
+        metrics.increment("dedup.chunks")
+        with metrics.timer("dedup.chunk"):
+            duplicate_of = lsh.add(position, record["text_content"])
+        if duplicate_of is not None:
+            metrics.increment("dedup.chunks_removed")
+            continue
+        yield record
+
+
+def get_unique_questions(
+    questions: list, threshold: float = 0.8, min_hasher: MinHasher | None = None
+):
+    """
+    used to drop the questions of one chunk that are near-identical to an earlier question of the same chunk.
+    A chunk has a handful of questions, so they are compared pairwise.
+    :param questions:
+    :param threshold: Jaccard similarity of the character 5-shingles from which a question is dropped
+    :param min_hasher: signature settings, character 5-shingles by default
+    :return: kept questions, in input order
+    """
+    min_hasher = min_hasher or MinHasher(shingle_size=5, shingle_unit="char")
+    unique_questions = []
+    signatures = []
+    for question in questions:
+        signature = min_hasher.get_signature(question)
+        if any(
+            estimate_jaccard(signature, other_signature) >= threshold
+            for other_signature in signatures
+        ):
+            continue
+        unique_questions.append(question)
+        signatures.append(signature)
+    return unique_questions
+
+
+def get_cosine_duplicate_mask(embeddings: np.ndarray, threshold: float = 0.95):
+    """
+    used to flag the embeddings whose cosine similarity to an earlier kept embedding reaches the threshold,
+    compared pairwise so it is meant for the few questions of one chunk
+    :param embeddings: 2d array, one row per text
+    :param threshold:
+    :return: boolean array, True for the rows to drop
+    """
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+    similarities = normalized @ normalized.T
+    mask = np.zeros(len(embeddings), dtype=bool)
+    kept = []
+    for row in range(len(embeddings)):
+        if kept and similarities[row, kept].max() >= threshold:
+            mask[row] = True
+        else:
+            kept.append(row)
+    return mask
@@ -0,0 +1,40 @@
+import os
+import threading
+
+logged_in = False
+login_lock = threading.Lock()
+
+
+def login_to_hub(required: bool = True):
+    """
+    used to log in to the Hugging Face Hub with HF_TOKEN once per process, when the Hub is first needed instead of
+    at import time
+    :param required: raise without HF_TOKEN, e.g. for uploads. Downloads pass False, public models load without
+    a token and gated ones fail with the Hub's own error
+    :return: True if logged in
+    """
+    global logged_in
+    with login_lock:
+        if logged_in:
+            return True
+        if os.getenv("HF_TOKEN") is None:
+            if required:
+                raise ValueError("HF_TOKEN not found in the environment variables")
+            return False
+        from huggingface_hub import login
+
+        login(token=os.getenv("HF_TOKEN"))
+        logged_in = True
+        return True
+
+
+def login_for_download(model_name_or_path: str | None):
+    """
+    used to log in before a model is downloaded from the Hub, gated models need the token. Local model
+    directories don't touch the Hub
+    :param model_name_or_path:
+    :return: True if logged in
+    """
+    if model_name_or_path is None or os.path.isdir(model_name_or_path):
+        return False
+    return login_to_hub(required=False)
@@ -0,0 +1,365 @@
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds of the latency histogram buckets in milliseconds, the last bucket is unbounded
+LATENCY_BUCKETS_MS = (
+    1,
+    2,
+    5,
+    10,
+    20,
+    50,
+    100,
+    200,
+    500,
+    1000,
+    2000,
+    5000,
+    10000,
+    30000,
+    60000,
+)
+
+
+def get_rss_bytes():
+    """
+    used to read the current resident set size of the process
+    :return: bytes, None where /proc is not available
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_peak_rss_bytes():
+    """
+    used to read the peak resident set size of the process since it started
+    :return: bytes
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on linux and in bytes on macOS
+    return max_rss if os.uname().sysname == "Darwin" else max_rss * 1024
+
+
+class LatencyHistogram:
+    """
+    fixed bucket latency histogram, percentiles are reported as the upper bound of the bucket they fall in
+    """
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def observe(self, seconds: float):
+        milliseconds = seconds * 1000
+        bucket = 0
+        while (
+            bucket < len(LATENCY_BUCKETS_MS)
+            and milliseconds > LATENCY_BUCKETS_MS[bucket]
+        ):
+            bucket += 1
+        self.bucket_counts[bucket] += 1
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def get_percentile_ms(self, percentile: float):
+        if not self.count:
+            return 0.0
+        rank = percentile / 100 * self.count
+        cumulative = 0
+        for bucket, bucket_count in enumerate(self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank and bucket_count:
+                if bucket == len(LATENCY_BUCKETS_MS):
+                    return self.max_seconds * 1000
+                return float(min(LATENCY_BUCKETS_MS[bucket], self.max_seconds * 1000))
+        return self.max_seconds * 1000
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_seconds": self.total_seconds,
+            "mean_ms": self.total_seconds * 1000 / self.count if self.count else 0.0,
+            "p50_ms": self.get_percentile_ms(50),
+            "p95_ms": self.get_percentile_ms(95),
+            "p99_ms": self.get_percentile_ms(99),
+            "max_ms": self.max_seconds * 1000,
+            "buckets_ms": {
+                f"<={upper_bound}" if idx < len(LATENCY_BUCKETS_MS) else "inf": count
+                for idx, (upper_bound, count) in enumerate(
+                    zip(LATENCY_BUCKETS_MS + (None,), self.bucket_counts)
+                )
+                if count
+            },
+        }
+
+
+class Metrics:
+    """
+    thread safe registry of timers, counters and stage measurements of a run. Timers keep a latency histogram per
+    name, counters are plain sums (e.g. tokens), stages record wall time, the counters incremented while they ran
+    and the peak RSS sampled during the stage. PROFILE_STAGES (comma separated stage names or "all") runs the
+    matching stages under cProfile or pyinstrument (PROFILER=cprofile|pyinstrument).
+    """
+
+    def __init__(self, rss_sample_interval: float = 0.05):
+        """
+        :param rss_sample_interval: seconds between RSS samples while a stage runs
+        """
+        self.rss_sample_interval = rss_sample_interval
+        self.lock = threading.Lock()
+        self.profiling = False
+        self.reset()
+
+    def reset(self):
+        """
+        used to drop everything recorded so far, e.g. between benchmark runs
+        :return:
+        """
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+            self.stages = {}
+            self.started_at = time.time()
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            self.timers.setdefault(name, LatencyHistogram()).observe(seconds)
+
+    def increment(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_counter(self, name: str):
+        return self.counters.get(name, 0)
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        used to record the latency of a block, also when it raises
+        :param name:
+        :return:
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextmanager
+    def profile(self, name: str, output_dir: str = "pipeline/output/profiles"):
+        """
+        used to profile a block when it is selected by PROFILE_STAGES, cProfile only sees the calling thread
+        :param name: stage name, also the file name of the profile
+        :param output_dir:
+        :return:
+        """
+        profile_stages = {
+            stage.strip()
+            for stage in os.getenv("PROFILE_STAGES", "").split(",")
+            if stage.strip()
+        }
+        if self.profiling or not ("all" in profile_stages or name in profile_stages):
+            yield
+            return
+
+        profiler_name = os.getenv("PROFILER", "cprofile")
+        if profiler_name == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError as e:
+                raise ImportError(
+                    "PROFILER=pyinstrument needs pyinstrument, install it with pip install pyinstrument"
+                ) from e
+            profiler = Profiler()
+            profiler.start()
+        elif profiler_name == "cprofile":
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            raise ValueError("Invalid profiler")
+
+        self.profiling = True
+        try:
+            yield
+        finally:
+            self.profiling = False
+            os.makedirs(output_dir, exist_ok=True)
+            if profiler_name == "pyinstrument":
+                profiler.stop()
+                output_path = os.path.join(output_dir, f"{name}.html")
+                with open(output_path, "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+            else:
+                profiler.disable()
+                output_path = os.path.join(output_dir, f"{name}.prof")
+                profiler.dump_stats(output_path)
+            print(f"Profile of {name} written to {output_path}")
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        used to measure a pipeline stage: wall time, counters incremented during the stage and peak RSS
+        :param name:
+        :return:
+        """
+        with self.lock:
+            counters_before = dict(self.counters)
+        rss_start = get_rss_bytes()
+        peak_rss = [rss_start or 0]
+        stop_sampling = threading.Event()
+
+        def sample_rss():
+            while not stop_sampling.wait(self.rss_sample_interval):
+                peak_rss[0] = max(peak_rss[0], get_rss_bytes() or 0)
+
+        sampler = None
+        if rss_start is not None:
+            sampler = threading.Thread(target=sample_rss, daemon=True)
+            sampler.start()
+        start = time.perf_counter()
+        try:
+            with self.profile(name):
+                yield
+        finally:
+            wall_seconds = time.perf_counter() - start
+            stop_sampling.set()
+            if sampler is not None:
+                sampler.join()
+                peak_rss[0] = max(peak_rss[0], get_rss_bytes() or 0)
+            with self.lock:
+                stage = self.stages.setdefault(
+                    name, {"calls": 0, "wall_seconds": 0.0, "counters": {}}
+                )
+                stage["calls"] += 1
+                stage["wall_seconds"] += wall_seconds
+                for counter, value in self.counters.items():
+                    delta = value - counters_before.get(counter, 0)
+                    if delta:
+                        stage["counters"][counter] = (
+                            stage["counters"].get(counter, 0) + delta
+                        )
+                if rss_start is not None:
+                    stage["rss_start_mb"] = rss_start / 2**20
+                    stage["peak_rss_mb"] = max(
+                        stage.get("peak_rss_mb", 0.0), peak_rss[0] / 2**20
+                    )
+                stage["process_peak_rss_mb"] = get_peak_rss_bytes() / 2**20
+
+    def get_throughput(self):
+        """
+        used to derive rates from counters. Throughput is the work counted in the stages that did it over their
+        wall time, so overlapping calls (concurrent LLM requests, streaming workers) are not counted several times.
+        llm_completion_tokens_per_sec_per_request divides by the summed request latency instead, the generation
+        speed a single request sees.
+        :return:
+        """
+        rates = {
+            "parse_pages_per_sec": "parse.pages",
+            "encode_texts_per_sec": "encode.texts",
+            "llm_completion_tokens_per_sec": "llm.completion_tokens",
+            "train_samples_per_sec": "train.samples",
+        }
+        throughput = {}
+        for rate, counter in rates.items():
+            count = 0
+            wall_seconds = 0.0
+            for stage in self.stages.values():
+                if stage["counters"].get(counter):
+                    count += stage["counters"][counter]
+                    wall_seconds += stage["wall_seconds"]
+            if wall_seconds:
+                throughput[rate] = count / wall_seconds
+        histogram = self.timers.get("llm.request")
+        if (
+            "llm.completion_tokens" in self.counters
+            and histogram
+            and histogram.total_seconds
+        ):
+            throughput["llm_completion_tokens_per_sec_per_request"] = (
+                self.counters["llm.completion_tokens"] / histogram.total_seconds
+            )
+        return throughput
+
+    def get_rates(self):
+        """
+        used to derive failure and retry rates of the question generation from its counters
+        :return:
+        """
+        responses = self.get_counter("generate.attempts") - self.get_counter(
+            "generate.request_failures"
+        )
+        chunks = self.get_counter("generate.chunks")
+        rates = {}
+        if responses:
+            rates["generate_parse_failure_rate"] = (
+                self.get_counter("generate.parse_failures") / responses
+            )
+        if chunks:
+            rates["generate_retry_rate"] = self.get_counter("generate.retries") / chunks
+            rates["generate_failed_chunk_rate"] = (
+                self.get_counter("generate.failed_chunks") / chunks
+            )
+        return rates
+
+    def get_report(self):
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "wall_seconds": time.time() - self.started_at,
+                "peak_rss_mb": get_peak_rss_bytes() / 2**20,
+                "stages": json.loads(json.dumps(self.stages)),
+                "timers": {
+                    name: histogram.to_dict()
+                    for name, histogram in sorted(self.timers.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+                "throughput": self.get_throughput(),
+                "rates": self.get_rates(),
+            }
+
+    def write_report(self, path: str = "pipeline/output/run_report.json"):
+        """
+        used to write the run report as json
+        :param path:
+        :return: the report
+        """
+        report = self.get_report()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        return report
+
+
+# process wide registry the instrumented modules record into
+metrics = Metrics()
+
+
+def measure_stage(name: str):
+    """
+    used to decorate a function so every call is measured as the stage name
+    :param name:
+    :return:
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with metrics.stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
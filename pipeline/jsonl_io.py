@@ -0,0 +1,193 @@
+import argparse
+import io
+import itertools
+import json
+import os
+from typing import Iterable, Iterator
+
+
+def is_jsonl_path(path: str):
+    """
+    used to check whether a path points to a record-per-line file, optionally zstd compressed
+    :param path:
+    :return:
+    """
+    return path.endswith(".jsonl") or path.endswith(".jsonl.zst")
+
+
+def open_text(path: str, mode: str):
+    """
+    used to open a text file for reading("r") or writing("w"), paths ending with .zst are zstd (de)compressed
+    :param path:
+    :param mode:
+    :return: text file object
+    """
+    if not path.endswith(".zst"):
+        return open(path, mode, encoding="utf-8")
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            "zstandard is required to read or write .zst files, install it with `uv add zstandard`"
+        ) from e
+    if mode == "r":
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+    elif mode == "w":
+        stream = zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+    else:
+        raise ValueError("Invalid mode")
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+
+def read_jsonl(path: str) -> Iterator[dict]:
+    """
+    used to lazily read the records of a jsonl file
+    :param path:
+    :return: generator of records
+    """
+    with open_text(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class JsonlWriter:
+    """
+    incremental jsonl writer, records are written as they come so callers never hold the whole output
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.count = 0
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open_text(self.path, "w")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.file.close()
+
+    def write(self, record: dict):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def write_all(self, records: Iterable[dict]):
+        for record in records:
+            self.write(record)
+
+
+def write_jsonl(path: str, records: Iterable[dict]):
+    """
+    used to write records to a jsonl file
+    :param path:
+    :param records: any iterable of records, consumed lazily
+    :return: number of records written
+    """
+    with JsonlWriter(path) as writer:
+        writer.write_all(records)
+    return writer.count
+
+
+def iter_section_records(sections: dict) -> Iterator[dict]:
+    """
+    used to flatten the section keyed json outputs into one record per chunk
+    :param sections: {title: {"start_page", "text_contents"}} or {title: {"start_page", "text_with_questions"}}
+    :return: generator of {"title", "start_page", "text_content"[, "questions"]} records
+    """
+    for title, content in sections.items():
+        for text_content in content.get("text_contents", []):
+            yield {
+                "title": title,
+                "start_page": content.get("start_page"),
+                "text_content": text_content,
+            }
+        for text_with_question in content.get("text_with_questions", []):
+            yield {
+                "title": title,
+                "start_page": content.get("start_page"),
+                **text_with_question,
+            }
+
+
+def read_records(path: str) -> Iterator[dict]:
+    """
+    used to stream the chunk records of a json or jsonl(.zst) stage output
+    :param path:
+    :return: generator of {"title", "start_page", "text_content"[, "questions"]} records
+    """
+    if is_jsonl_path(path):
+        yield from read_jsonl(path)
+    else:
+        with open(path, "r") as f:
+            yield from iter_section_records(json.load(f))
+
+
+def iter_grouped_by_title(records: Iterable[dict]) -> Iterator[tuple]:
+    """
+    used to group consecutive chunk records of the same section. Records are not sorted, all records of a section
+    must be adjacent in the input (e.g. sorted by title, or in document order as the parser writes them); a title
+    that shows up again after another section is yielded as a separate group.
+    :param records: records grouped by title
+    :return: generator of (title, start_page, records of the section)
+    """
+    for title, section_records in itertools.groupby(
+        records, key=lambda record: record.get("title")
+    ):
+        section_records = list(section_records)
+        yield title, section_records[0].get("start_page"), section_records
+
+
+def records_to_sections(records: Iterable[dict], with_questions: bool = False):
+    """
+    used to rebuild the section keyed json layout from chunk records, the inverse of iter_section_records
+    :param records:
+    :param with_questions: build the text_with_questions layout instead of text_contents
+    :return:
+    """
+    sections = {}
+    for record in records:
+        section = sections.setdefault(
+            record.get("title"), {"start_page": record.get("start_page")}
+        )
+        if with_questions:
+            text_with_question = {"text_content": record["text_content"]}
+            if record.get("questions"):
+                text_with_question["questions"] = record["questions"]
+            section.setdefault("text_with_questions", []).append(text_with_question)
+        else:
+            section.setdefault("text_contents", []).append(record["text_content"])
+    return sections
+
+
+def convert_json_to_jsonl(json_path: str, jsonl_path: str):
+    """
+    used to convert a pipeline json output into its jsonl counterpart so existing outputs stay usable.
+    Section keyed outputs become one record per chunk, list outputs (training data) one record per item and
+    the raw docling output one record per text item.
+    :param json_path:
+    :param jsonl_path: output path, a .zst suffix compresses it
+    :return: number of records written
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        content = json.load(f)
+    if isinstance(content, list):
+        records = content
+    elif "texts" in content and isinstance(content["texts"], list):
+        records = content["texts"]
+    else:
+        records = iter_section_records(content)
+    return write_jsonl(jsonl_path, records)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="convert a pipeline json output into jsonl"
+    )
+    arg_parser.add_argument("json_path")
+    arg_parser.add_argument("jsonl_path")
+    args = arg_parser.parse_args()
+    print(
+        f"Wrote {convert_json_to_jsonl(args.json_path, args.jsonl_path)} records to {args.jsonl_path}"
+    )
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import time
+
+
+def fingerprint(*parts):
+    """
+    used to fingerprint the inputs and config of a stage
+    :param parts: json serializable values
+    :return: sha256 hex digest of their canonical json
+    """
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def file_hash(path: str, block_size: int = 1024 * 1024):
+    """
+    used to hash a file without loading it at once
+    :param path:
+    :param block_size:
+    :return: sha256 hex digest of the file content, None if the file doesn't exist
+    """
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RunManifest:
+    """
+    records the fingerprint of every completed stage, and optionally of the items (documents, chunks) it
+    processed, so that reruns can skip stages and items whose inputs and config didn't change
+    """
+
+    def __init__(self, path: str = "pipeline/output/run_manifest.json"):
+        self.path = path
+        self.stages = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.stages = json.load(f).get("stages", {})
+
+    def is_up_to_date(self, stage: str, stage_fingerprint: str, outputs: list = ()):
+        """
+        used to check whether a stage already completed with the same fingerprint and its outputs still exist
+        :param stage:
+        :param stage_fingerprint:
+        :param outputs: paths the stage writes
+        :return:
+        """
+        record = self.stages.get(stage)
+        return (
+            record is not None
+            and record.get("fingerprint") == stage_fingerprint
+            and all(os.path.exists(output) for output in outputs)
+        )
+
+    def get_items(self, stage: str):
+        """
+        used to get the item fingerprints recorded by the last completed run of a stage
+        :param stage:
+        :return: {item id: item fingerprint}
+        """
+        return self.stages.get(stage, {}).get("items", {})
+
+    def get_config_fingerprint(self, stage: str):
+        """
+        used to get the config fingerprint recorded by the last completed run of a stage, items of that run
+        can only be reused when the config didn't change
+        :param stage:
+        :return:
+        """
+        return self.stages.get(stage, {}).get("config_fingerprint")
+
+    def mark_complete(
+        self,
+        stage: str,
+        stage_fingerprint: str,
+        items: dict | None = None,
+        config_fingerprint: str | None = None,
+    ):
+        """
+        used to record a completed stage and persist the manifest
+        :param stage:
+        :param stage_fingerprint: fingerprint of the inputs and config of the stage
+        :param items: optional {item id: item fingerprint} of the items the stage processed
+        :param config_fingerprint: optional fingerprint of the config alone
+        :return:
+        """
+        self.stages[stage] = {
+            "fingerprint": stage_fingerprint,
+            "config_fingerprint": config_fingerprint,
+            "completed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "items": items or {},
+        }
+        self.save()
+
+    def invalidate(self, stage: str):
+        """
+        used to force a stage to run again
+        :param stage:
+        :return:
+        """
+        if self.stages.pop(stage, None) is not None:
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"stages": self.stages}, f, ensure_ascii=False, indent=4)
+        os.replace(self.path + ".tmp", self.path)
@@ -0,0 +1,552 @@
+import json
+import os
+
+from model_trainer.export import get_onnx_file_name
+from pipeline.instrumentation import measure_stage, metrics
+from pipeline.jsonl_io import (
+    read_jsonl,
+    read_records,
+    records_to_sections,
+    write_jsonl,
+)
+from pipeline.manifest import RunManifest, file_hash, fingerprint
+from question_generator.llm_cache import LLMResponseCache
+from question_generator.llm_utils import LLM_MODEL_NAME, LLM_STRUCTURED_OUTPUT
+from question_generator.prompts import system_prompt, user_prompt
+
+
+class PipelineStages:
+    """
+    runs the pipeline stage by stage and skips every stage whose inputs and config fingerprint match the one
+    recorded in the run manifest. Inside a stage only changed items are processed: unchanged documents are not
+    re-parsed, cached LLM responses are reused, chunks already in the vector index are not re-embedded and
+    unchanged chunks reuse their mined triplets. Docling, torch and sentence-transformers are imported by the
+    stages that use them, so running a single stage only pays for its own dependencies.
+    """
+
+    def __init__(self, manifest: RunManifest | None = None, force: bool = False):
+        """
+        :param manifest: run manifest, defaults to pipeline/output/run_manifest.json
+        :param force: run every stage regardless of the manifest
+        """
+        self.manifest = manifest or RunManifest()
+        self.force = force
+        # json keeps the pretty-printed documents, jsonl streams one record per chunk between the stages
+        self.interchange_format = os.getenv("INTERCHANGE_FORMAT", "json")
+        extension = "jsonl" if self.interchange_format == "jsonl" else "json"
+        self.corpus_path = os.getenv("CORPUS_PATH")
+        self.pdf_path = "parser/data/AWQ.pdf"
+        self.parser_output_path = (
+            "parser/output/corpus" if self.corpus_path else "parser/output"
+        )
+        self.tokenizer_adjusted_parsed_output_path = (
+            f"{self.parser_output_path}/tokenizer_adjusted_parsed_output.{extension}"
+        )
+        # chunks near-identical to an earlier chunk are dropped before questions are generated for them
+        self.dedup_chunks = os.getenv("DEDUP_CHUNKS", "true").lower() == "true"
+        self.deduplicated_parsed_output_path = (
+            f"{self.parser_output_path}/deduplicated_parsed_output.{extension}"
+        )
+        self.question_input_path = (
+            self.deduplicated_parsed_output_path
+            if self.dedup_chunks
+            else self.tokenizer_adjusted_parsed_output_path
+        )
+        self.parsed_content_with_questions_path = (
+            f"question_generator/output/parsed_content_with_questions.{extension}"
+        )
+        # arrow: deduplicated chunk table plus id triplets, memory-mapped by train; json/jsonl: flat text triplets
+        training_data_format = os.getenv("TRAINING_DATA_FORMAT", "arrow")
+        if training_data_format not in ("arrow", "json", "jsonl"):
+            raise ValueError("Invalid training data format")
+        self.training_data_path = (
+            f"model_trainer/training_data/training_data.{training_data_format}"
+        )
+        self.mining_cache_path = "model_trainer/training_data/mining_cache.jsonl"
+        # live: chat completion requests to the vLLM server, batch: offline OpenAI batch files
+        self.question_generation_mode = os.getenv("QUESTION_GENERATION_MODE", "live")
+        self.batch_requests_path = os.getenv(
+            "QUESTION_BATCH_REQUESTS_PATH", "question_generator/batch/requests.jsonl"
+        )
+        self.batch_results_path = os.getenv(
+            "QUESTION_BATCH_RESULTS_PATH", "question_generator/batch/results.jsonl"
+        )
+        self.awaiting_batch_results = False
+        self.index_backend = os.getenv("VECTOR_INDEX_BACKEND", "chroma")
+        self.bi_encoder_trainer = None
+
+    def is_up_to_date(self, stage: str, stage_fingerprint: str, outputs: list = ()):
+        up_to_date = not self.force and self.manifest.is_up_to_date(
+            stage, stage_fingerprint, outputs
+        )
+        if up_to_date:
+            print(f"Skipping {stage}, inputs and config unchanged")
+        return up_to_date
+
+    def get_index_options(self):
+        """
+        used to read the truncation and quantization of the compact index backend
+        :return: index arguments, empty for the other backends
+        """
+        if self.index_backend != "compact":
+            return {}
+        return {
+            "truncate_dim": (
+                int(os.getenv("VECTOR_INDEX_TRUNCATE_DIM"))
+                if os.getenv("VECTOR_INDEX_TRUNCATE_DIM")
+                else None
+            ),
+            "quantization": os.getenv("VECTOR_INDEX_QUANTIZATION", "int8"),
+            "rescore_multiplier": int(
+                os.getenv("VECTOR_INDEX_RESCORE_MULTIPLIER", "4")
+            ),
+        }
+
+    def get_index_output_path(self):
+        """
+        used to get a file every save of the vector index writes, so deleting the index runs embed again
+        :return:
+        """
+        if self.index_backend == "chroma":
+            return os.path.join("db", "chroma.sqlite3")
+        return os.path.join("db", f"{self.index_backend}_index", "sidecar.json")
+
+    def get_trainer(self):
+        """
+        used to build the trainer only when a stage that needs the bi-encoder actually runs
+        :return:
+        """
+        if self.bi_encoder_trainer is None:
+            from model_trainer.embedding_cache import EmbeddingCache
+            from model_trainer.trainer import BiEncoderTrainer
+
+            self.bi_encoder_trainer = BiEncoderTrainer(
+                index_backend=self.index_backend,
+                index_options=self.get_index_options(),
+                embedding_cache=EmbeddingCache(
+                    path=os.getenv(
+                        "EMBEDDING_CACHE_PATH", "model_trainer/cache/embeddings"
+                    ),
+                    max_size_bytes=int(
+                        os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(1024 * 1024 * 1024))
+                    ),
+                ),
+            )
+        return self.bi_encoder_trainer
+
+    def parse_config_fingerprint(self):
+        return fingerprint(
+            os.getenv("BI_ENCODER_MODEL_NAME"),
+            os.getenv("CONTEXT_WINDOW"),
+            os.getenv("CHUNK_OVERLAP", "0"),
+            os.getenv("PARSER_PROFILE", "full"),
+            self.interchange_format,
+        )
+
+    @measure_stage("parse")
+    def parse(self):
+        """
+        used to parse the pdf, or the corpus when CORPUS_PATH is set, re-parsing only changed documents
+        :return: True if the stage ran
+        """
+        config_fingerprint = self.parse_config_fingerprint()
+        if self.corpus_path:
+            from parser.corpus import CorpusParser
+
+            corpus_parser = CorpusParser(
+                input_path=self.corpus_path,
+                output_path=self.parser_output_path,
+                output_type=self.interchange_format,
+                num_workers=(
+                    int(os.getenv("PARSER_NUM_WORKERS"))
+                    if os.getenv("PARSER_NUM_WORKERS")
+                    else None
+                ),
+            )
+            document_hashes = {
+                doc_id: file_hash(pdf_path)
+                for doc_id, pdf_path in corpus_parser.get_documents()
+            }
+        else:
+            document_hashes = {self.pdf_path: file_hash(self.pdf_path)}
+        stage_fingerprint = fingerprint(config_fingerprint, document_hashes)
+        if self.is_up_to_date(
+            "parse", stage_fingerprint, [self.tokenizer_adjusted_parsed_output_path]
+        ):
+            return False
+
+        if self.corpus_path:
+            previous_document_hashes = {}
+            if (
+                not self.force
+                and self.manifest.get_config_fingerprint("parse") == config_fingerprint
+            ):
+                previous_document_hashes = self.manifest.get_items("parse")
+            report = corpus_parser.save(previous_document_hashes)
+            document_hashes = report["document_hashes"]
+        else:
+            from parser.docling_parser import PDFParser
+
+            pdf_parser = PDFParser(
+                pdf_path=self.pdf_path,
+                output_path=self.parser_output_path,
+                output_type=self.interchange_format,
+            )
+            pdf_parser.save()
+        self.manifest.mark_complete(
+            "parse",
+            stage_fingerprint,
+            items=document_hashes,
+            config_fingerprint=config_fingerprint,
+        )
+        return True
+
+    @measure_stage("dedup")
+    def dedup(self):
+        """
+        used to drop the chunks that are near-duplicates of an earlier chunk, e.g. repeated headers, footers and
+        captions, so no LLM call, embedding or triplets are spent on them
+        :return: True if the stage ran
+        """
+        if not self.dedup_chunks:
+            return False
+        threshold = float(os.getenv("DEDUP_CHUNK_THRESHOLD", "0.85"))
+        stage_fingerprint = fingerprint(
+            file_hash(self.tokenizer_adjusted_parsed_output_path), "dedup", threshold
+        )
+        if self.is_up_to_date(
+            "dedup", stage_fingerprint, [self.deduplicated_parsed_output_path]
+        ):
+            return False
+
+        from pipeline.dedup import iter_unique_chunks
+
+        chunks_before = metrics.get_counter("dedup.chunks")
+        removed_before = metrics.get_counter("dedup.chunks_removed")
+        records = iter_unique_chunks(
+            read_records(self.tokenizer_adjusted_parsed_output_path), threshold
+        )
+        if self.interchange_format == "jsonl":
+            write_jsonl(self.deduplicated_parsed_output_path, records)
+        else:
+            with open(self.deduplicated_parsed_output_path, "w", encoding="utf-8") as f:
+                json.dump(records_to_sections(records), f, ensure_ascii=False, indent=4)
+        num_chunks = int(metrics.get_counter("dedup.chunks") - chunks_before)
+        num_removed = int(metrics.get_counter("dedup.chunks_removed") - removed_before)
+        print(
+            f"Dropped {num_removed} of {num_chunks} chunks as near-duplicates, saving {num_removed} LLM calls and "
+            f"chunk embeddings"
+        )
+        self.manifest.mark_complete("dedup", stage_fingerprint)
+        return True
+
+    def generate_config_fingerprint(self):
+        return fingerprint(
+            system_prompt, user_prompt, LLM_MODEL_NAME, LLM_STRUCTURED_OUTPUT
+        )
+
+    def generate_fingerprint(self):
+        return fingerprint(
+            file_hash(self.question_input_path),
+            system_prompt,
+            user_prompt,
+            LLM_MODEL_NAME,
+            LLM_STRUCTURED_OUTPUT,
+        )
+
+    @staticmethod
+    def get_llm_cache():
+        return LLMResponseCache(
+            path=os.getenv(
+                "LLM_CACHE_PATH", "question_generator/cache/llm_cache.sqlite"
+            ),
+            max_size_bytes=int(
+                os.getenv("LLM_CACHE_MAX_BYTES", str(512 * 1024 * 1024))
+            ),
+        )
+
+    def get_question_generator(self):
+        """
+        used to build the question generator with the concurrency, timeout and LLM cache of the environment
+        :return:
+        """
+        from question_generator.generate_questions import GenerateQuestions
+
+        return GenerateQuestions(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "1")),
+            request_timeout=(
+                float(os.getenv("LLM_REQUEST_TIMEOUT"))
+                if os.getenv("LLM_REQUEST_TIMEOUT")
+                else None
+            ),
+            cache=self.get_llm_cache(),
+            retry_backoff_seconds=float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", "1")),
+        )
+
+    @measure_stage("generate")
+    def generate(self):
+        """
+        used to generate questions for every chunk, chunks with a cached LLM response don't call the LLM
+        :return: True if the stage ran
+        """
+        stage_fingerprint = self.generate_fingerprint()
+        if self.is_up_to_date(
+            "generate", stage_fingerprint, [self.parsed_content_with_questions_path]
+        ):
+            return False
+
+        if self.question_generation_mode == "batch":
+            return self.generate_from_batch(stage_fingerprint)
+
+        generate_questions = self.get_question_generator()
+        if self.interchange_format == "jsonl":
+            write_jsonl(
+                self.parsed_content_with_questions_path,
+                generate_questions.iter_questions_generation(
+                    read_jsonl(self.question_input_path)
+                ),
+            )
+        else:
+            with open(self.question_input_path, "r") as f:
+                generate_questions.parsed_content = json.load(f)
+            parsed_content_with_questions = (
+                generate_questions.orchestrate_questions_generation()
+            )
+            with open(
+                self.parsed_content_with_questions_path,
+                "w",
+                encoding="utf-8",
+            ) as f:
+                json.dump(
+                    parsed_content_with_questions,
+                    f,
+                    ensure_ascii=False,
+                    indent=4,
+                )
+        self.manifest.mark_complete("generate", stage_fingerprint)
+        return True
+
+    def generate_from_batch(self, stage_fingerprint: str):
+        """
+        used to generate questions through offline batch files: unless the results answer every chunk missing
+        from the LLM cache with questions, the answered ones are cached, the requests of the others (new, failed or
+        unparsable) are written and the run has to wait for the batch to be run, otherwise the parsed content with
+        questions is rebuilt from the results
+        :param stage_fingerprint:
+        :return: True if the stage ran
+        """
+        from question_generator.batch import BatchQuestionGeneration
+
+        batch = BatchQuestionGeneration(cache=self.get_llm_cache())
+        # results of an older input or config don't answer the current chunks, however recent the file is
+        missing_custom_ids = batch.get_missing_custom_ids(
+            read_records(self.question_input_path), self.batch_results_path
+        )
+        if missing_custom_ids:
+            batch.cache_results(
+                read_records(self.question_input_path), self.batch_results_path
+            )
+            num_requests = batch.write_requests(
+                read_records(self.question_input_path),
+                self.batch_requests_path,
+            )
+            self.awaiting_batch_results = True
+            print(
+                f"{len(missing_custom_ids)} chunks have no batch result, wrote {num_requests} requests to "
+                f"{self.batch_requests_path}, run them offline e.g. with\n"
+                f"python -m vllm.entrypoints.openai.run_batch -i {self.batch_requests_path} "
+                f"-o {self.batch_results_path} --model {LLM_MODEL_NAME}\n"
+                f"and run the pipeline again"
+            )
+            return False
+
+        num_chunks, num_failed = batch.save_questions(
+            read_records(self.question_input_path),
+            self.batch_results_path,
+            self.parsed_content_with_questions_path,
+        )
+        print(f"Questions for {num_chunks - num_failed} of {num_chunks} chunks read")
+        if num_failed:
+            # not marked complete, the next run writes a batch of the chunks still without questions
+            print(f"{num_failed} chunks have no questions, run the pipeline again")
+            return True
+        self.manifest.mark_complete("generate", stage_fingerprint)
+        return True
+
+    def embed_config_fingerprint(self):
+        return fingerprint(
+            os.getenv("BI_ENCODER_MODEL_NAME"),
+            os.getenv("BI_ENCODER_MODEL_REVISION"),
+            self.index_backend,
+        )
+
+    def embed_fingerprint(self):
+        return fingerprint(
+            self.embed_config_fingerprint(),
+            file_hash(self.parsed_content_with_questions_path),
+        )
+
+    @measure_stage("embed")
+    def embed(self):
+        """
+        used to embed new chunks into the vector index and drop the chunks that no longer exist
+        :return: True if the stage ran
+        """
+        config_fingerprint = self.embed_config_fingerprint()
+        stage_fingerprint = self.embed_fingerprint()
+        if self.is_up_to_date(
+            "embed", stage_fingerprint, [self.get_index_output_path()]
+        ):
+            return False
+
+        bi_encoder_trainer = self.get_trainer()
+        chunk_ids = bi_encoder_trainer.get_chunk_ids(
+            self.parsed_content_with_questions_path
+        )
+        incremental = (
+            not self.force
+            and self.manifest.get_config_fingerprint("embed") == config_fingerprint
+        )
+        if incremental:
+            stale_chunk_ids = set(self.manifest.get_items("embed")) - chunk_ids
+            bi_encoder_trainer.index.delete(sorted(stale_chunk_ids))
+        bi_encoder_trainer.upload_embeddings(
+            input_path=self.parsed_content_with_questions_path,
+            skip_existing=incremental,
+        )
+        print(f"Encoded {bi_encoder_trainer.num_encoded_texts} chunks with the model")
+        self.manifest.mark_complete(
+            "embed",
+            stage_fingerprint,
+            items={chunk_id: "" for chunk_id in chunk_ids},
+            config_fingerprint=config_fingerprint,
+        )
+        return True
+
+    @staticmethod
+    def get_question_dedup_options():
+        """
+        used to read the thresholds from which a question is a near-duplicate of an earlier question of its chunk,
+        DEDUP_QUESTIONS=false keeps every question
+        :return: prepare_training_data arguments
+        """
+        if os.getenv("DEDUP_QUESTIONS", "true").lower() != "true":
+            return {
+                "question_jaccard_threshold": None,
+                "question_cosine_threshold": None,
+            }
+        return {
+            "question_jaccard_threshold": float(
+                os.getenv("DEDUP_QUESTION_THRESHOLD", "0.8")
+            ),
+            "question_cosine_threshold": float(
+                os.getenv("DEDUP_QUESTION_COSINE_THRESHOLD", "0.95")
+            ),
+        }
+
+    @staticmethod
+    def get_holdout_fraction():
+        from model_trainer.evaluation import get_holdout_fraction
+
+        return get_holdout_fraction()
+
+    def mine_fingerprint(self):
+        return fingerprint(
+            self.embed_fingerprint(),
+            "mine",
+            self.get_holdout_fraction(),
+            self.get_index_options(),
+            self.get_question_dedup_options(),
+        )
+
+    @measure_stage("mine")
+    def mine(self):
+        """
+        used to prepare the training triplets, chunks whose questions didn't change reuse their triplets
+        :return: True if the stage ran
+        """
+        stage_fingerprint = self.mine_fingerprint()
+        if self.is_up_to_date("mine", stage_fingerprint, [self.training_data_path]):
+            return False
+
+        if self.force and os.path.exists(self.mining_cache_path):
+            os.remove(self.mining_cache_path)
+        bi_encoder_trainer = self.get_trainer()
+        num_encoded_texts = bi_encoder_trainer.num_encoded_texts
+        bi_encoder_trainer.prepare_training_data(
+            input_path=self.parsed_content_with_questions_path,
+            output_path=self.training_data_path,
+            mining_cache_path=self.mining_cache_path,
+            holdout_fraction=self.get_holdout_fraction(),
+            **self.get_question_dedup_options(),
+        )
+        print(
+            f"Encoded {bi_encoder_trainer.num_encoded_texts - num_encoded_texts} questions with the model"
+        )
+        self.manifest.mark_complete("mine", stage_fingerprint)
+        return True
+
+    def get_train_config(self):
+        return {
+            "num_epochs": int(os.getenv("TRAIN_EPOCHS", "5")),
+            "batch_size": int(os.getenv("TRAIN_BATCH_SIZE", "1")),
+            "mini_batch_size": (
+                int(os.getenv("TRAIN_MINI_BATCH_SIZE"))
+                if os.getenv("TRAIN_MINI_BATCH_SIZE")
+                else None
+            ),
+            "matryoshka_dims": (
+                [int(dim) for dim in os.getenv("TRAIN_MATRYOSHKA_DIMS").split(",")]
+                if os.getenv("TRAIN_MATRYOSHKA_DIMS")
+                else None
+            ),
+        }
+
+    def train_fingerprint(self):
+        return fingerprint(self.mine_fingerprint(), "train", self.get_train_config())
+
+    @measure_stage("train")
+    def train(self):
+        """
+        used to fine-tune the bi-encoder on the mined triplets
+        :return: True if the stage ran
+        """
+        stage_fingerprint = self.train_fingerprint()
+        if self.is_up_to_date(
+            "train", stage_fingerprint, ["models/finetuned_bi_encoder"]
+        ):
+            return False
+
+        self.get_trainer().train(
+            training_data_path=self.training_data_path, **self.get_train_config()
+        )
+        self.manifest.mark_complete("train", stage_fingerprint)
+        return True
+
+    @measure_stage("export")
+    def export(self):
+        """
+        used to export the fine-tuned model to onnx and int8 quantized onnx for cpu inference
+        :return: True if the stage ran
+        """
+        quantization_config = os.getenv("ONNX_QUANTIZATION_CONFIG", "avx2")
+        stage_fingerprint = fingerprint(
+            self.train_fingerprint(), "export", quantization_config
+        )
+        outputs = [
+            os.path.join(
+                "models/finetuned_bi_encoder",
+                get_onnx_file_name(variant, quantization_config),
+            )
+            for variant in ("onnx", "onnx-int8")
+        ]
+        if self.is_up_to_date("export", stage_fingerprint, outputs):
+            return False
+
+        from model_trainer.trainer import BiEncoderTrainer
+
+        BiEncoderTrainer.export_trained_model(
+            "models/finetuned_bi_encoder", quantization_config=quantization_config
+        )
+        self.manifest.mark_complete("export", stage_fingerprint)
+        return True
@@ -0,0 +1,499 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+from model_trainer.evaluation import get_holdout_fraction, is_holdout_question
+from model_trainer.trainer import BiEncoderTrainer
+from pipeline.dedup import MinHasher, get_unique_questions
+from pipeline.instrumentation import measure_stage, metrics
+from pipeline.jsonl_io import records_to_sections, write_jsonl
+from pipeline.stages import PipelineStages
+
+# marks the end of a stage's input, every worker of the stage consumes one
+STOP = object()
+
+
+class StreamingStage:
+    """
+    pool of worker threads taking items from a bounded input queue and passing their results on to the input
+    queues of the downstream stages. A full downstream queue blocks the workers, so a fast stage can't run
+    ahead of a slow one by more than queue_size items (backpressure).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        process: Callable[[list], list],
+        abort: threading.Event,
+        num_workers: int = 1,
+        queue_size: int = 256,
+        batch_size: int = 1,
+        max_wait_seconds: float = 0.5,
+    ):
+        """
+        :param name:
+        :param process: called with a batch of items, returns the items passed downstream
+        :param abort: shared by all stages of a pipeline, set when a worker fails
+        :param num_workers: number of worker threads
+        :param queue_size: capacity of the input queue
+        :param batch_size: maximum number of items processed per call
+        :param max_wait_seconds: maximum time a partial batch waits for more items
+        """
+        self.name = name
+        self.process = process
+        self.abort = abort
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.input_queue = queue.Queue(maxsize=queue_size)
+        self.downstream_stages = []
+        self.lock = threading.Lock()
+        self.num_running = 0
+        self.num_items = 0
+        self.busy_seconds = 0.0
+        self.error = None
+        self.threads = []
+
+    def connect(self, stage: "StreamingStage"):
+        self.downstream_stages.append(stage)
+        return stage
+
+    def put(self, item):
+        """
+        used to enqueue an item, blocks while the queue is full unless the pipeline is aborted
+        :param item:
+        :return:
+        """
+        while not self.abort.is_set():
+            try:
+                self.input_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        """
+        used to signal that no more items follow, the workers exit once the queue is drained
+        :return:
+        """
+        for _ in range(self.num_workers):
+            self.put(STOP)
+
+    def get_batch(self):
+        """
+        used to collect up to batch_size items, a partial batch is returned after max_wait_seconds
+        :return: (items, stopped)
+        """
+        items = []
+        while len(items) < self.batch_size:
+            try:
+                item = self.input_queue.get(
+                    timeout=self.max_wait_seconds if items else 0.1
+                )
+            except queue.Empty:
+                if self.abort.is_set():
+                    return items, True
+                if items:
+                    break
+                continue
+            if item is STOP:
+                return items, True
+            items.append(item)
+        return items, False
+
+    def work(self):
+        try:
+            stopped = False
+            while not stopped:
+                items, stopped = self.get_batch()
+                if not items or self.abort.is_set():
+                    continue
+                start = time.perf_counter()
+                results = self.process(items)
+                busy_seconds = time.perf_counter() - start
+                with self.lock:
+                    self.busy_seconds += busy_seconds
+                    self.num_items += len(items)
+                metrics.observe(f"stream.{self.name}", busy_seconds)
+                for result in results:
+                    for stage in self.downstream_stages:
+                        stage.put(result)
+        except BaseException as e:
+            self.error = e
+            self.abort.set()
+        finally:
+            with self.lock:
+                self.num_running -= 1
+                last_worker = self.num_running == 0
+            if last_worker:
+                for stage in self.downstream_stages:
+                    stage.close()
+
+    def start(self):
+        self.num_running = self.num_workers
+        self.threads = [
+            threading.Thread(target=self.work, name=f"{self.name}-{idx}", daemon=True)
+            for idx in range(self.num_workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+
+class QuestionCheckpoint:
+    """
+    questions generated per chunk in an SQLite file, written as every chunk finishes. A killed run resumes without
+    asking the LLM again for the chunks it holds, and the streamed questions are read back from it instead of
+    being kept in memory until the end of the run.
+    """
+
+    def __init__(self, path: str, reset: bool = False):
+        """
+        :param path: SQLite file
+        :param reset: drop the questions of an earlier run
+        """
+        if reset and os.path.exists(path):
+            os.remove(path)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS questions (
+                chunk_id TEXT PRIMARY KEY,
+                questions TEXT NOT NULL
+            )
+            """)
+        self.connection.commit()
+
+    def get(self, chunk_id: str):
+        """
+        used to read the checkpointed questions of a chunk
+        :param chunk_id:
+        :return: questions, None if the chunk has none yet
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT questions FROM questions WHERE chunk_id = ?", (chunk_id,)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, chunk_id: str, questions: list):
+        # committed per chunk so an interrupted run keeps everything generated before it
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO questions (chunk_id, questions) VALUES (?, ?)",
+                (chunk_id, json.dumps(questions, ensure_ascii=False)),
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class StreamingPipeline:
+    """
+    runs question generation, chunk embedding and question encoding for negative mining concurrently instead of
+    one stage after the other: a chunk is embedded and its questions are encoded as soon as they come back from
+    the LLM, while the LLM works on later chunks. Parsing and near-duplicate removal finish before the stream
+    starts, mining and training run after it. Question encodings land in the embedding cache, so the mining pass
+    only searches the finished index before the single training call. Generated questions are checkpointed per
+    chunk, a resumed run only asks the LLM for the chunks missing from the checkpoint.
+    """
+
+    def __init__(
+        self,
+        pipeline_stages: PipelineStages | None = None,
+        queue_size: int = 256,
+        generation_workers: int | None = None,
+        embedding_batch_size: int = 32,
+        checkpoint_dir: str = "pipeline/output/streaming",
+    ):
+        """
+        :param pipeline_stages: stage runner whose paths, manifest and trainer are used
+        :param queue_size: capacity of every stage's input queue
+        :param generation_workers: number of concurrent LLM requests, defaults to LLM_MAX_CONCURRENCY
+        :param embedding_batch_size: number of chunks / questions encoded per forward pass
+        :param checkpoint_dir: directory of the generated questions checkpoints
+        """
+        self.stages = pipeline_stages or PipelineStages()
+        self.queue_size = queue_size
+        self.generation_workers = generation_workers or int(
+            os.getenv("LLM_MAX_CONCURRENCY", "1")
+        )
+        self.embedding_batch_size = embedding_batch_size
+        self.checkpoint_dir = checkpoint_dir
+        self.holdout_fraction = get_holdout_fraction()
+
+    def get_checkpoint_path(self):
+        """
+        used to get the checkpoint of the current prompts and LLM, a changed config starts a new checkpoint
+        :return:
+        """
+        return os.path.join(
+            self.checkpoint_dir,
+            f"questions_{self.stages.generate_config_fingerprint()[:16]}.sqlite",
+        )
+
+    def iter_records_with_questions(self, checkpoint: QuestionCheckpoint):
+        """
+        used to add the checkpointed questions to the chunk records, streamed in input order
+        :param checkpoint:
+        :return: generator of records, with a "questions" key for the chunks that got questions
+        """
+        bi_encoder_trainer = self.stages.get_trainer()
+        for record in BiEncoderTrainer.iter_chunk_records(
+            self.stages.question_input_path
+        ):
+            if record.get("text_content"):
+                questions = checkpoint.get(
+                    bi_encoder_trainer.get_chunk_id(
+                        record["title"], record["text_content"]
+                    )
+                )
+                if questions:
+                    record = {**record, "questions": questions}
+            yield record
+
+    @measure_stage("stream")
+    def stream(self):
+        """
+        used to generate questions, embed the chunks and encode the questions concurrently, then write the
+        parsed content with questions and record the generate and embed stages in the manifest
+        :return: per stage statistics
+        """
+        stages = self.stages
+        bi_encoder_trainer = stages.get_trainer()
+        if bi_encoder_trainer.embedding_cache is None:
+            raise ValueError(
+                "Streaming needs the embedding cache to hand questions to mining"
+            )
+        question_generator = stages.get_question_generator()
+        embed_config_fingerprint = stages.embed_config_fingerprint()
+        incremental = (
+            not stages.force
+            and stages.manifest.get_config_fingerprint("embed")
+            == embed_config_fingerprint
+        )
+
+        checkpoint_path = self.get_checkpoint_path()
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        checkpoint = QuestionCheckpoint(checkpoint_path, reset=stages.force)
+
+        def generate(items: list):
+            # one chunk per call, generation_workers of them in flight
+            generated = []
+            for chunk_id, record in items:
+                questions = checkpoint.get(chunk_id)
+                if questions is None:
+                    # a worker waits out the backoff of its own chunk, the other workers keep generating
+                    questions = question_generator.get_questions_with_backoff(
+                        record["text_content"]
+                    )
+                    if questions:
+                        checkpoint.set(chunk_id, questions)
+                if questions:
+                    record = {**record, "questions": questions}
+                generated.append((chunk_id, record))
+            return generated
+
+        def embed_chunks(items: list):
+            chunks = dict(items)
+            if incremental:
+                for chunk_id in bi_encoder_trainer.index.get_existing_ids(
+                    list(chunks.keys())
+                ):
+                    del chunks[chunk_id]
+            if chunks:
+                documents = [record["text_content"] for record in chunks.values()]
+                embeddings = bi_encoder_trainer.embed_texts(
+                    documents, batch_size=self.embedding_batch_size
+                )
+                with metrics.timer("index.upsert"):
+                    bi_encoder_trainer.index.upsert(
+                        ids=list(chunks.keys()),
+                        documents=documents,
+                        embeddings=embeddings,
+                        metadatas=[
+                            bi_encoder_trainer.get_chunk_metadata(record)
+                            for record in chunks.values()
+                        ],
+                    )
+            return []
+
+        question_jaccard_threshold = stages.get_question_dedup_options()[
+            "question_jaccard_threshold"
+        ]
+        min_hasher = MinHasher(shingle_size=5, shingle_unit="char")
+
+        def encode_questions(items: list):
+            # the near-duplicates mine drops by text are not worth encoding
+            questions = [
+                question
+                for _, record in items
+                for question in (
+                    get_unique_questions(
+                        record.get("questions", []),
+                        question_jaccard_threshold,
+                        min_hasher,
+                    )
+                    if question_jaccard_threshold is not None
+                    else record.get("questions", [])
+                )
+                if not is_holdout_question(question, self.holdout_fraction)
+            ]
+            if questions:
+                bi_encoder_trainer.embed_texts(
+                    list(dict.fromkeys(questions)),
+                    batch_size=self.embedding_batch_size,
+                )
+            return []
+
+        abort = threading.Event()
+        generation_stage = StreamingStage(
+            "generate",
+            generate,
+            abort,
+            num_workers=self.generation_workers,
+            queue_size=self.queue_size,
+        )
+        embedding_stage = generation_stage.connect(
+            StreamingStage(
+                "embed",
+                embed_chunks,
+                abort,
+                queue_size=self.queue_size,
+                batch_size=self.embedding_batch_size,
+            )
+        )
+        mining_stage = generation_stage.connect(
+            StreamingStage(
+                "encode questions",
+                encode_questions,
+                abort,
+                queue_size=self.queue_size,
+                batch_size=self.embedding_batch_size,
+            )
+        )
+        pipeline = [generation_stage, embedding_stage, mining_stage]
+
+        start = time.perf_counter()
+        for stage in pipeline:
+            stage.start()
+        chunk_ids = set()
+        try:
+            for record in BiEncoderTrainer.iter_chunk_records(
+                stages.question_input_path
+            ):
+                if not record.get("text_content"):
+                    continue
+                chunk_id = bi_encoder_trainer.get_chunk_id(
+                    record["title"], record["text_content"]
+                )
+                chunk_ids.add(chunk_id)
+                generation_stage.put((chunk_id, record))
+                if abort.is_set():
+                    break
+        except BaseException:
+            abort.set()
+            raise
+        finally:
+            generation_stage.close()
+            for stage in pipeline:
+                stage.join()
+            # keep what was embedded so far for the resumed run
+            bi_encoder_trainer.index.save()
+        for stage in pipeline:
+            if stage.error is not None:
+                checkpoint.close()
+                raise RuntimeError(
+                    f"Streaming stage {stage.name} failed"
+                ) from stage.error
+        wall_seconds = time.perf_counter() - start
+
+        # the questions are read back from the checkpoint, only the json layout needs every record at once
+        records = self.iter_records_with_questions(checkpoint)
+        if stages.interchange_format == "jsonl":
+            write_jsonl(stages.parsed_content_with_questions_path, records)
+        else:
+            with open(
+                stages.parsed_content_with_questions_path, "w", encoding="utf-8"
+            ) as f:
+                json.dump(
+                    records_to_sections(records, with_questions=True),
+                    f,
+                    ensure_ascii=False,
+                    indent=4,
+                )
+        checkpoint.close()
+        if incremental:
+            stale_chunk_ids = set(stages.manifest.get_items("embed")) - chunk_ids
+            bi_encoder_trainer.index.delete(sorted(stale_chunk_ids))
+            bi_encoder_trainer.index.save()
+        stages.manifest.mark_complete("generate", stages.generate_fingerprint())
+        stages.manifest.mark_complete(
+            "embed",
+            stages.embed_fingerprint(),
+            items={chunk_id: "" for chunk_id in chunk_ids},
+            config_fingerprint=embed_config_fingerprint,
+        )
+        # the outputs and the manifest now cover everything the checkpoint held
+        os.remove(checkpoint_path)
+
+        report = {
+            "wall_seconds": wall_seconds,
+            "stages": {
+                stage.name: {
+                    "items": stage.num_items,
+                    "workers": stage.num_workers,
+                    "busy_seconds": stage.busy_seconds,
+                }
+                for stage in pipeline
+            },
+        }
+        question_generator.print_generation_stats()
+        sequential_seconds = sum(
+            stage.busy_seconds / stage.num_workers for stage in pipeline
+        )
+        for stage in pipeline:
+            print(
+                f"{stage.name}: {stage.num_items} items, {stage.busy_seconds:.1f}s busy "
+                f"across {stage.num_workers} workers"
+            )
+        print(
+            f"Streamed {len(chunk_ids)} chunks in {wall_seconds:.1f}s, "
+            f"{sequential_seconds:.1f}s when the stages run one after the other"
+        )
+        return report
+
+    def run(self, confirm_training: Callable[[], bool] = lambda: True):
+        """
+        used to run the whole pipeline with the streaming stages and end in a single training call
+        :param confirm_training: called before training when the LLM was used in this run, e.g. to make sure
+        vLLM released the GPU; training is skipped when it returns False
+        :return: True if the model was trained, None if training was not confirmed
+        """
+        stages = self.stages
+        # not overlapped with the stream: the generate fingerprint hashes the deduplicated chunks, dedup keeps
+        # the first copy in corpus order and the stale chunks of the index are only known once the input is complete
+        stages.parse()
+        stages.dedup()
+        if stages.is_up_to_date(
+            "generate",
+            stages.generate_fingerprint(),
+            [stages.parsed_content_with_questions_path],
+        ):
+            stages.embed()
+        else:
+            self.stream()
+            if not confirm_training():
+                return None
+        stages.mine()
+        return stages.train()
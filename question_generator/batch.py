@@ -0,0 +1,315 @@
+"""
+Offline question generation through OpenAI batch files: the prompts of every chunk are written as one
+/v1/chat/completions request per line, the file is run by vLLM's batch runner (or any OpenAI batch compatible
+tool) without a live server, and the chunks get their questions back from the results file by custom_id.
+
+usage: python -m question_generator.batch write --input parser/output/tokenizer_adjusted_parsed_output.json
+       python -m vllm.entrypoints.openai.run_batch -i question_generator/batch/requests.jsonl \
+           -o question_generator/batch/results.jsonl --model meta-llama/Llama-3.2-3B-Instruct
+       python -m question_generator.batch read --input parser/output/tokenizer_adjusted_parsed_output.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from typing import Iterable, Iterator
+
+from pipeline.instrumentation import metrics
+from pipeline.jsonl_io import (
+    JsonlWriter,
+    is_jsonl_path,
+    read_jsonl,
+    read_records,
+    records_to_sections,
+    write_jsonl,
+)
+from question_generator.generate_questions import GenerateQuestions
+from question_generator.llm_cache import LLMResponseCache
+from question_generator.llm_utils import build_llm_request
+
+
+class BatchQuestionGeneration:
+    """
+    writes the question generation requests of chunk records to an OpenAI batch input file and merges the
+    questions of a batch output file back into the records. Chunks with a cached response are answered from the
+    LLM cache and left out of the batch, parsed batch responses are added to the cache.
+    """
+
+    def __init__(self, cache: LLMResponseCache | None = None):
+        """
+        :param cache: optional LLM response cache shared with the live generation
+        """
+        self.cache = cache
+
+    @staticmethod
+    def get_custom_id(record: dict):
+        """
+        used to identify a chunk in the batch files, chunks with the same title and request share an id. The
+        request covers model, prompts and sampling params, so results of a batch run with another config don't
+        match the chunk.
+        :param record: chunk record
+        :return:
+        """
+        request = json.dumps(build_llm_request(record["text_content"]), sort_keys=True)
+        return hashlib.sha256(
+            f"{record['title']}\x00{request}".encode("utf-8")
+        ).hexdigest()
+
+    @staticmethod
+    def build_batch_request(custom_id: str, text_content: str):
+        """
+        used to build one line of the batch input file, vLLM specific parameters are part of the body
+        :param custom_id:
+        :param text_content:
+        :return:
+        """
+        request = build_llm_request(text_content)
+        body = {key: value for key, value in request.items() if key != "extra_body"}
+        body.update(request.get("extra_body", {}))
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body,
+        }
+
+    def get_cached_questions(self, text_content: str):
+        if self.cache is None:
+            return []
+        cached_response = self.cache.get(
+            self.cache.build_key(build_llm_request(text_content))
+        )
+        if cached_response is None:
+            return []
+        return GenerateQuestions.parse_questions(cached_response)
+
+    def iter_pending_records(self, records: Iterable[dict]) -> Iterator[tuple]:
+        """
+        used to find the chunks a batch has to answer, the ones without a cached response
+        :param records: {"title", "start_page", "text_content"} records
+        :return: generator of (custom id, record), once per custom id
+        """
+        custom_ids = set()
+        for record in records:
+            if not record.get("text_content"):
+                continue
+            custom_id = self.get_custom_id(record)
+            if custom_id in custom_ids or self.get_cached_questions(
+                record["text_content"]
+            ):
+                continue
+            custom_ids.add(custom_id)
+            yield custom_id, record
+
+    def write_requests(self, records: Iterable[dict], requests_path: str):
+        """
+        used to write the batch input file for the chunks without a cached response
+        :param records: {"title", "start_page", "text_content"} records
+        :param requests_path:
+        :return: number of requests written
+        """
+        with JsonlWriter(requests_path) as writer:
+            for custom_id, record in self.iter_pending_records(records):
+                writer.write(
+                    self.build_batch_request(custom_id, record["text_content"])
+                )
+        return writer.count
+
+    @staticmethod
+    def get_response_content(result: dict):
+        """
+        used to get the response content of one line of a batch output file
+        :param result:
+        :return: content of the first choice, None for a failed request
+        """
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code", 200) != 200:
+            return None
+        choices = (response.get("body") or {}).get("choices") or []
+        if not choices:
+            return None
+        return choices[0].get("message", {}).get("content") or None
+
+    def read_result_ids(self, results_path: str):
+        """
+        used to read which requests a batch output file answered with questions. Failed requests and unparsable
+        responses are left out, so their chunks are requested again like the live mode retries them.
+        :param results_path:
+        :return: set of custom ids, empty without a results file
+        """
+        if not os.path.exists(results_path):
+            return set()
+        result_ids = set()
+        for result in read_jsonl(results_path):
+            content = self.get_response_content(result)
+            if content is not None and GenerateQuestions.parse_questions(content):
+                result_ids.add(result["custom_id"])
+        return result_ids
+
+    def get_missing_custom_ids(self, records: Iterable[dict], results_path: str):
+        """
+        used to check that a batch output file belongs to the current chunks: every chunk without a cached
+        response needs questions from the results, whatever the age of the file. Results of chunks that no longer
+        exist are ignored.
+        :param records: {"title", "start_page", "text_content"} records
+        :param results_path:
+        :return: custom ids of the chunks the results file doesn't answer, failed and unparsable ones included
+        """
+        result_ids = self.read_result_ids(results_path)
+        return {
+            custom_id
+            for custom_id, _ in self.iter_pending_records(records)
+            if custom_id not in result_ids
+        }
+
+    @staticmethod
+    def read_results(results_path: str):
+        """
+        used to read the response contents of a batch output file
+        :param results_path:
+        :return: {custom_id: response content}, failed requests are left out, empty without a results file
+        """
+        responses = {}
+        if not os.path.exists(results_path):
+            return responses
+        for result in read_jsonl(results_path):
+            content = BatchQuestionGeneration.get_response_content(result)
+            if content is None:
+                continue
+            responses[result["custom_id"]] = content
+            usage = (result["response"].get("body") or {}).get("usage")
+            if usage:
+                metrics.increment("llm.prompt_tokens", usage.get("prompt_tokens", 0))
+                metrics.increment(
+                    "llm.completion_tokens", usage.get("completion_tokens", 0)
+                )
+        return responses
+
+    def cache_results(self, records: Iterable[dict], results_path: str):
+        """
+        used to add the parsable responses of a batch output file to the LLM cache before a retry batch is written,
+        so the retry only asks for the chunks that failed and the answered ones survive the next results file
+        :param records: {"title", "start_page", "text_content"} records
+        :param results_path:
+        :return: number of responses cached
+        """
+        if self.cache is None:
+            return 0
+        responses = self.read_results(results_path)
+        num_cached = 0
+        for custom_id, record in list(self.iter_pending_records(records)):
+            response = responses.get(custom_id)
+            if response is not None and GenerateQuestions.parse_questions(response):
+                self.cache.set(
+                    self.cache.build_key(build_llm_request(record["text_content"])),
+                    response,
+                )
+                num_cached += 1
+        return num_cached
+
+    def iter_questions_from_results(
+        self, records: Iterable[dict], results_path: str
+    ) -> Iterator[dict]:
+        """
+        used to add the questions of the batch output file, or of the LLM cache, to the chunk records
+        :param records: {"title", "start_page", "text_content"} records, in output order
+        :param results_path:
+        :return: generator of records with a "questions" key added for successful chunks, in input order
+        """
+        responses = self.read_results(results_path)
+        for record in records:
+            if not record.get("text_content"):
+                yield record
+                continue
+            metrics.increment("generate.chunks")
+            questions = self.get_cached_questions(record["text_content"])
+            response = responses.get(self.get_custom_id(record))
+            if not questions and response is not None:
+                metrics.increment("generate.attempts")
+                questions = GenerateQuestions.parse_questions(response)
+                if questions and self.cache is not None:
+                    self.cache.set(
+                        self.cache.build_key(build_llm_request(record["text_content"])),
+                        response,
+                    )
+                elif not questions:
+                    metrics.increment("generate.parse_failures")
+            if questions:
+                metrics.increment("generate.questions", len(questions))
+                yield {**record, "questions": questions}
+            else:
+                metrics.increment("generate.failed_chunks")
+                yield record
+
+    def save_questions(
+        self, records: Iterable[dict], results_path: str, output_path: str
+    ):
+        """
+        used to write the parsed content with questions from a batch output file. Failed chunks are not cached, so
+        writing the requests again afterwards gives a batch of only the failed and missing chunks.
+        :param records: {"title", "start_page", "text_content"} records, in output order
+        :param results_path: batch output file
+        :param output_path: parsed content with questions, json or jsonl(.zst)
+        :return: (number of chunks, number of chunks without questions)
+        """
+        chunks_before = metrics.get_counter("generate.chunks")
+        failed_before = metrics.get_counter("generate.failed_chunks")
+        records = self.iter_questions_from_results(records, results_path)
+        if is_jsonl_path(output_path):
+            write_jsonl(output_path, records)
+        else:
+            with open(output_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    records_to_sections(records, with_questions=True),
+                    f,
+                    ensure_ascii=False,
+                    indent=4,
+                )
+        return (
+            int(metrics.get_counter("generate.chunks") - chunks_before),
+            int(metrics.get_counter("generate.failed_chunks") - failed_before),
+        )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("command", choices=["write", "read"])
+    arg_parser.add_argument(
+        "--input",
+        default="parser/output/tokenizer_adjusted_parsed_output.json",
+        help="parsed chunks, json or jsonl(.zst)",
+    )
+    arg_parser.add_argument(
+        "--requests", default="question_generator/batch/requests.jsonl"
+    )
+    arg_parser.add_argument(
+        "--results", default="question_generator/batch/results.jsonl"
+    )
+    arg_parser.add_argument(
+        "--output",
+        default="question_generator/output/parsed_content_with_questions.json",
+    )
+    args = arg_parser.parse_args()
+
+    batch = BatchQuestionGeneration(
+        cache=LLMResponseCache(
+            path=os.getenv(
+                "LLM_CACHE_PATH", "question_generator/cache/llm_cache.sqlite"
+            )
+        )
+    )
+    if args.command == "write":
+        num_requests = batch.write_requests(read_records(args.input), args.requests)
+        print(f"Wrote {num_requests} requests to {args.requests}")
+    else:
+        num_chunks, num_failed = batch.save_questions(
+            read_records(args.input), args.results, args.output
+        )
+        print(
+            f"Questions for {num_chunks - num_failed} of {num_chunks} chunks written to {args.output}"
+        )
+
+
+if __name__ == "__main__":
+    main()
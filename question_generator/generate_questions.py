@@ -1,14 +1,45 @@
+import heapq
+import itertools
 import json
+import random
 import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator
 
 from tqdm import tqdm
 
-from question_generator.llm_utils import get_llm_response
+from pipeline.instrumentation import metrics
+from question_generator.llm_cache import LLMResponseCache
+from question_generator.llm_utils import build_llm_request, get_llm_response
 
 
 class GenerateQuestions:
-    def __init__(self, parsed_content: dict):
+    def __init__(
+        self,
+        parsed_content: dict | None = None,
+        max_concurrency: int = 1,
+        request_timeout: float | None = None,
+        cache: LLMResponseCache | None = None,
+        max_retries: int = 3,
+        retry_backoff_seconds: float = 1.0,
+    ):
+        """
+        :param parsed_content: tokenizer adjusted parsed content, not needed for the streaming mode
+        :param max_concurrency: maximum number of in-flight LLM requests, 1 keeps the sequential behaviour
+        :param request_timeout: per-request timeout in seconds, a timed out chunk is left without questions
+        :param cache: optional LLM response cache, only successfully parsed responses are kept in it
+        :param max_retries: number of retries for chunks without questions
+        :param retry_backoff_seconds: wait before the first retry of a chunk, doubled for every further retry
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
         self.parsed_content = parsed_content
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.cache = cache
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
 
     @staticmethod
     def extract_dict_from_text(text_with_json: str):
@@ -45,80 +76,197 @@ class GenerateQuestions:
             print(f"An error occurred while decoding JSON: {e}")
             return None
 
+    @classmethod
+    def parse_questions(cls, llm_response: str):
+        """
+        used to get the questions from an LLM response, schema constrained responses are plain JSON and are
+        parsed directly, free text responses go through extract_dict_from_text
+        :param llm_response:
+        :return: list of non empty question strings, empty if the response could not be parsed
+        """
+        try:
+            structured_llm_response = json.loads(llm_response)
+        except json.JSONDecodeError:
+            structured_llm_response = cls.extract_dict_from_text(
+                text_with_json=llm_response
+            )
+        if not isinstance(structured_llm_response, dict):
+            return []
+        questions = structured_llm_response.get("questions")
+        if not isinstance(questions, list):
+            return []
+        return [
+            question.strip()
+            for question in questions
+            if isinstance(question, str) and question.strip()
+        ]
+
+    def get_questions(self, text_content: str):
+        """
+        used to request questions for a single text content and parse them from the LLM response
+        :param text_content: text chunk the questions are generated from
+        :return: list of questions, empty if the request failed or the response could not be parsed
+        """
+        metrics.increment("generate.attempts")
+        try:
+            raw_llm_response = get_llm_response(
+                content=text_content, timeout=self.request_timeout, cache=self.cache
+            )
+        except Exception as e:
+            print(f"An error occurred while requesting questions: {e}")
+            metrics.increment("generate.request_failures")
+            return []
+        with metrics.timer("generate.parse_response"):
+            questions = self.parse_questions(raw_llm_response or "")
+        if not questions:
+            metrics.increment("generate.parse_failures")
+            if self.cache is not None:
+                # drop unusable responses so that a retry goes back to the LLM instead of replaying the failure
+                self.cache.delete(self.cache.build_key(build_llm_request(text_content)))
+        return questions
+
+    def get_retry_delay(self, attempt: int):
+        """
+        used to get the exponential backoff before a retry, with jitter so retries of a burst don't hit the
+        server at the same moment
+        :param attempt: number of the retry, starting at 1
+        :return: seconds
+        """
+        return self.retry_backoff_seconds * 2 ** (attempt - 1) * random.uniform(0.5, 1)
+
+    def get_questions_with_backoff(self, text_content: str):
+        """
+        used to generate the questions of a single chunk, retrying up to max_retries times with backoff. Blocks
+        the calling thread while it waits, used by workers that handle one chunk at a time.
+        :param text_content:
+        :return: list of questions, empty if every attempt failed
+        """
+        metrics.increment("generate.chunks")
+        questions = self.get_questions(text_content)
+        for attempt in range(1, self.max_retries + 1):
+            if questions:
+                break
+            metrics.increment("generate.retries")
+            time.sleep(self.get_retry_delay(attempt))
+            questions = self.get_questions(text_content)
+        if not questions:
+            metrics.increment("generate.failed_chunks")
+        metrics.increment("generate.questions", len(questions))
+        return questions
+
+    def get_questions_for_contents(
+        self,
+        text_contents: list,
+        desc: str,
+        show_progress: bool = True,
+        max_retries: int | None = None,
+    ):
+        """
+        used to generate questions for a list of text contents with at most max_concurrency requests in flight.
+        Chunks without questions go to a retry queue and are resubmitted once their backoff elapsed, so only
+        the failed chunks are retried and their wait doesn't hold up the other requests.
+        :param text_contents: text chunks the questions are generated from
+        :param desc: progress bar description
+        :param show_progress: show a progress bar for this call
+        :param max_retries: retries per chunk, defaults to the max_retries of the instance
+        :return: list of questions lists in the same order as text_contents, empty for chunks that failed every
+        attempt
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        generated_questions = [[] for _ in text_contents]
+        attempts = [0] * len(text_contents)
+        # (ready time, position) of the chunks waiting for their retry
+        retry_queue = []
+        progress = tqdm(total=len(text_contents), desc=desc, disable=not show_progress)
+        metrics.increment("generate.chunks", len(text_contents))
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            pending = {
+                executor.submit(self.get_questions, text_content): idx
+                for idx, text_content in enumerate(text_contents)
+            }
+            while pending or retry_queue:
+                while retry_queue and retry_queue[0][0] <= time.monotonic():
+                    _, idx = heapq.heappop(retry_queue)
+                    metrics.increment("generate.retries")
+                    pending[executor.submit(self.get_questions, text_contents[idx])] = (
+                        idx
+                    )
+                if not pending:
+                    time.sleep(max(0.0, retry_queue[0][0] - time.monotonic()))
+                    continue
+                done, _ = wait(
+                    pending,
+                    timeout=(
+                        max(0.0, retry_queue[0][0] - time.monotonic())
+                        if retry_queue
+                        else None
+                    ),
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    idx = pending.pop(future)
+                    questions = future.result()
+                    if not questions and attempts[idx] < max_retries:
+                        attempts[idx] += 1
+                        heapq.heappush(
+                            retry_queue,
+                            (
+                                time.monotonic() + self.get_retry_delay(attempts[idx]),
+                                idx,
+                            ),
+                        )
+                        continue
+                    generated_questions[idx] = questions
+                    metrics.increment("generate.questions", len(questions))
+                    if not questions:
+                        metrics.increment("generate.failed_chunks")
+                    progress.update(1)
+        progress.close()
+        return generated_questions
+
     def generate_questions(self):
         """
-        Generate questions for each text content in the parsed content.
+        Generate questions for each text content in the parsed content, failed chunks are retried with backoff.
         :return:
         """
         parsed_content_with_questions = {}
-        for title, content in tqdm(
-            self.parsed_content.items(), desc="Generating questions"
-        ):
+        text_contents = []
+        for title, content in self.parsed_content.items():
             parsed_content_with_questions[title] = {
                 "start_page": content.get("start_page"),
                 "text_with_questions": [],
             }
-            text_contents = content.get("text_contents", [])
-            for text_content in text_contents:
-                raw_llm_response = get_llm_response(content=text_content)
-                structured_llm_response = self.extract_dict_from_text(
-                    text_with_json=raw_llm_response
-                )
-                if structured_llm_response is not None:
-                    questions = structured_llm_response.get("questions", [])
-                    if questions:
-                        parsed_content_with_questions[title][
-                            "text_with_questions"
-                        ].append({"text_content": text_content, "questions": questions})
-                    else:
-                        parsed_content_with_questions[title][
-                            "text_with_questions"
-                        ].append({"text_content": text_content})
-                else:
-                    parsed_content_with_questions[title]["text_with_questions"].append(
-                        {"text_content": text_content}
-                    )
-        return parsed_content_with_questions
+            for text_content in content.get("text_contents", []):
+                text_contents.append((title, text_content))
 
-    def retry_failed_question_generation(self, parsed_content_with_questions: dict):
-        """
-        Retry failed question generation for each text content in the parsed content.
-        :param parsed_content_with_questions: parsed content with LLM generated questions
-        :return:
-        """
-        for title, content in tqdm(
-            parsed_content_with_questions.items(),
-            desc="Retrying failed question generation",
-        ):
-            text_with_questions = content.get("text_with_questions", [])
-            for idx in range(len(text_with_questions)):
-                if not text_with_questions[idx].get("questions"):
-                    text_content = text_with_questions[idx].get("text_content")
-                    raw_llm_response = get_llm_response(content=text_content)
-                    structured_llm_response = self.extract_dict_from_text(
-                        text_with_json=raw_llm_response
-                    )
-                    if structured_llm_response is not None:
-                        questions = structured_llm_response.get("questions", [])
-                        if questions:
-                            parsed_content_with_questions[title]["text_with_questions"][
-                                idx
-                            ]["questions"] = questions
+        generated_questions = self.get_questions_for_contents(
+            [text_content for _, text_content in text_contents],
+            desc="Generating questions",
+        )
+        for (title, text_content), questions in zip(text_contents, generated_questions):
+            if questions:
+                parsed_content_with_questions[title]["text_with_questions"].append(
+                    {"text_content": text_content, "questions": questions}
+                )
+            else:
+                parsed_content_with_questions[title]["text_with_questions"].append(
+                    {"text_content": text_content}
+                )
         return parsed_content_with_questions
 
     @staticmethod
-    def check_question_generation_completion(parsed_content_with_questions: dict):
+    def print_generation_stats():
         """
-        used to check if all questions are generated for each text content in the parsed content.
-        :param parsed_content_with_questions:
+        used to print the parse failure and retry rates of the question generation so far
         :return:
         """
-        for title, content in parsed_content_with_questions.items():
-            text_with_questions = content.get("text_with_questions", [])
-            for text_content in text_with_questions:
-                if not text_content.get("questions"):
-                    return False
-        return True
+        rates = metrics.get_rates()
+        print(
+            f"Question generation: {metrics.get_counter('generate.failed_chunks'):.0f} of "
+            f"{metrics.get_counter('generate.chunks'):.0f} chunks failed, "
+            f"parse failure rate {rates.get('generate_parse_failure_rate', 0.0):.2%}, "
+            f"retry rate {rates.get('generate_retry_rate', 0.0):.2%}"
+        )
 
     def orchestrate_questions_generation(self):
         """
@@ -126,12 +274,39 @@ class GenerateQuestions:
         :return:
         """
         parsed_content_with_questions = self.generate_questions()
-        retry_count = 0
-        while retry_count < 3:
-            if self.check_question_generation_completion(parsed_content_with_questions):
-                break
-            parsed_content_with_questions = self.retry_failed_question_generation(
-                parsed_content_with_questions
-            )
-            retry_count += 1
+        self.print_generation_stats()
         return parsed_content_with_questions
+
+    def iter_questions_generation(
+        self,
+        records: Iterable[dict],
+        max_retries: int | None = None,
+        window_size: int | None = None,
+    ) -> Iterator[dict]:
+        """
+        Streams question generation over chunk records, only one window of chunks is held in memory at a time.
+        Failed chunks are retried with backoff up to max_retries times within their window.
+        :param records: {"title", "start_page", "text_content"} records
+        :param max_retries: number of retries for chunks without questions, defaults to the max_retries of the
+        instance
+        :param window_size: number of chunks in flight per window, defaults to 4 x max_concurrency
+        :return: generator of records with a "questions" key added for successful chunks, in input order
+        """
+        window_size = window_size or 4 * self.max_concurrency
+        records = iter(records)
+        progress = tqdm(desc="Generating questions", unit="chunk")
+        while window := list(itertools.islice(records, window_size)):
+            generated_questions = self.get_questions_for_contents(
+                [record["text_content"] for record in window],
+                desc="Generating questions",
+                show_progress=False,
+                max_retries=max_retries,
+            )
+            progress.update(len(window))
+            for record, questions in zip(window, generated_questions):
+                if questions:
+                    yield {**record, "questions": questions}
+                else:
+                    yield record
+        progress.close()
+        self.print_generation_stats()
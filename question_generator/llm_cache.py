@@ -0,0 +1,137 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class LLMResponseCache:
+    """
+    disk backed, content addressed cache of raw LLM responses stored in SQLite.
+    Entries are keyed by a hash of the full request (model, messages, sampling params) and the least recently
+    used entries are evicted once the stored responses grow beyond max_size_bytes. The total size is summed once
+    when the cache is opened and kept up to date on every write, so a write does not scan the table.
+    """
+
+    def __init__(
+        self,
+        path: str = "question_generator/cache/llm_cache.sqlite",
+        max_size_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_accessed REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS llm_responses_last_accessed "
+            "ON llm_responses (last_accessed)"
+        )
+        self.connection.commit()
+        self.total_size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM llm_responses"
+        ).fetchone()[0]
+
+    @staticmethod
+    def build_key(request: dict):
+        """
+        used to build the cache key of a chat completion request
+        :param request: model name, messages and sampling params sent to the LLM
+        :return: sha256 hex digest of the canonical json of the request
+        """
+        canonical_request = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        used to fetch a cached response and mark it as recently used
+        :param key:
+        :return: cached response, None on a cache miss
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE llm_responses SET last_accessed = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            self.connection.commit()
+            return row[0]
+
+    def set(self, key: str, response: str):
+        """
+        used to store a response and evict the least recently used entries if the cache is over its size limit
+        :param key:
+        :param response: raw LLM response
+        :return:
+        """
+        size = len(response.encode("utf-8"))
+        with self.lock:
+            self.total_size += size - self.get_size(key)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self.evict()
+            self.connection.commit()
+
+    def delete(self, key: str):
+        """
+        used to drop an entry, e.g. a response that could not be parsed and should be requested again
+        :param key:
+        :return:
+        """
+        with self.lock:
+            self.total_size -= self.get_size(key)
+            self.connection.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+            self.connection.commit()
+
+    def get_size(self, key: str):
+        """
+        used to look up the stored size of an entry, expects the lock held
+        :param key:
+        :return: size in bytes, 0 if the key is not cached
+        """
+        row = self.connection.execute(
+            "SELECT size FROM llm_responses WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def evict(self):
+        """
+        used to delete the least recently used entries until the cache fits max_size_bytes, expects the lock held
+        :return:
+        """
+        if self.total_size <= self.max_size_bytes:
+            return
+        # walks the last_accessed index from the oldest entry and stops as soon as the cache fits
+        rows = self.connection.execute(
+            "SELECT key, size FROM llm_responses ORDER BY last_accessed ASC"
+        )
+        evicted_keys = []
+        for key, size in rows:
+            if self.total_size <= self.max_size_bytes:
+                break
+            evicted_keys.append((key,))
+            self.total_size -= size
+        rows.close()
+        self.connection.executemany(
+            "DELETE FROM llm_responses WHERE key = ?", evicted_keys
+        )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
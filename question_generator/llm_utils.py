@@ -1,24 +1,148 @@
-from openai import OpenAI
+import os
+import threading
 
+from pipeline.instrumentation import metrics
+from question_generator.llm_cache import LLMResponseCache
 from question_generator.prompts import system_prompt, user_prompt
 
-client = OpenAI(
-    base_url="http://localhost:8000/v1",
-    api_key="praveen@123",
-)
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "http://localhost:8000/v1")
+LLM_API_KEY = os.getenv("LLM_API_KEY", "praveen@123")
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "meta-llama/Llama-3.2-3B-Instruct")
+# json_schema: OpenAI response_format, guided_json: vLLM guided decoding parameter, none: free text parsed afterwards
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "json_schema")
 
+QUESTIONS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "questions": {
+            "type": "array",
+            "items": {"type": "string"},
+            "minItems": 5,
+            "maxItems": 5,
+        }
+    },
+    "required": ["questions"],
+    "additionalProperties": False,
+}
 
-def get_llm_response(content: str):
+# switched to "none" for the rest of the process when the server rejects the structured output parameters
+structured_output_mode = LLM_STRUCTURED_OUTPUT
+
+# built on the first request, importing openai is only paid for by runs that call the LLM
+client = None
+client_lock = threading.Lock()
+
+
+def get_client():
     """
-    used to generate 5 questions based on the given content
+    used to get the OpenAI client of the LLM server, created once per process
+    :return:
+    """
+    global client
+    with client_lock:
+        if client is None:
+            from openai import OpenAI
+
+            client = OpenAI(
+                base_url=LLM_BASE_URL,
+                api_key=LLM_API_KEY,
+            )
+    return client
+
+
+def build_llm_request(content: str):
     """
-    completion = client.chat.completions.create(
-        model="meta-llama/Llama-3.2-3B-Instruct",
-        messages=[
+    used to build the chat completion request for the given content
+    :param content: text chunk the questions are generated from
+    :return: model name, messages, sampling params and the output constraint of the request
+    """
+    request = {
+        "model": LLM_MODEL_NAME,
+        "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt.format(content=content)},
         ],
-        temperature=0,
-    )
+        "temperature": 0,
+    }
+    if structured_output_mode == "json_schema":
+        request["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "questions",
+                "schema": QUESTIONS_SCHEMA,
+                "strict": True,
+            },
+        }
+    elif structured_output_mode == "guided_json":
+        request["extra_body"] = {"guided_json": QUESTIONS_SCHEMA}
+    elif structured_output_mode != "none":
+        raise ValueError("Invalid structured output mode")
+    return request
+
+
+def disable_structured_output():
+    """
+    used to fall back to free text responses once the server rejected the structured output parameters
+    :return:
+    """
+    global structured_output_mode
+    if structured_output_mode != "none":
+        print(
+            f"LLM server rejected {structured_output_mode} structured output, falling back to parsing free text"
+        )
+        structured_output_mode = "none"
+        metrics.increment("llm.structured_output_fallbacks")
+
+
+def get_llm_response(
+    content: str,
+    timeout: float | None = None,
+    cache: LLMResponseCache | None = None,
+):
+    """
+    used to generate 5 questions based on the given content
+    :param content: text chunk the questions are generated from
+    :param timeout: per-request timeout in seconds, None falls back to the client default
+    :param cache: optional response cache consulted before and populated after the request
+    """
+    request = build_llm_request(content)
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.build_key(request)
+        cached_response = cache.get(cache_key)
+        if cached_response is not None:
+            metrics.increment("llm.cache_hits")
+            return cached_response
+
+    from openai import BadRequestError
+
+    request_kwargs = {}
+    if timeout is not None:
+        request_kwargs["timeout"] = timeout
+    metrics.increment("llm.requests")
+    try:
+        with metrics.timer("llm.request"):
+            completion = get_client().chat.completions.create(
+                **request, **request_kwargs
+            )
+    except BadRequestError as e:
+        metrics.increment("llm.errors")
+        if structured_output_mode == "none" or not any(
+            parameter in str(e).lower()
+            for parameter in ("response_format", "json_schema", "guided", "structured")
+        ):
+            raise
+        # servers without structured output support reject the request, it is repeated as free text
+        disable_structured_output()
+        return get_llm_response(content, timeout=timeout, cache=cache)
+    except Exception:
+        metrics.increment("llm.errors")
+        raise
+    if completion.usage is not None:
+        metrics.increment("llm.prompt_tokens", completion.usage.prompt_tokens)
+        metrics.increment("llm.completion_tokens", completion.usage.completion_tokens)
 
-    return completion.choices[0].message.content
+    response = completion.choices[0].message.content
+    if cache is not None and response is not None:
+        cache.set(cache_key, response)
+    return response
@@ -0,0 +1,60 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    collects items submitted concurrently from many threads and hands them to process_batch together, a batch is
+    dispatched once it holds max_batch_size items or its first item waited max_wait_ms
+    """
+
+    def __init__(self, process_batch, max_batch_size: int = 32, max_wait_ms: float = 5):
+        """
+        :param process_batch: callable taking a list of items and returning a list of results in the same order
+        :param max_batch_size: maximum number of items per process_batch call
+        :param max_wait_ms: maximum time the first item of a batch waits for more items
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.num_batches = 0
+        self.num_items = 0
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, item):
+        """
+        used to process an item as part of the next batch
+        :param item:
+        :return: result of the item, exceptions raised by process_batch are re-raised
+        """
+        future = Future()
+        self.queue.put((item, future))
+        return future.result()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            items = [item for item, _ in batch]
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.num_batches += 1
+            self.num_items += len(items)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
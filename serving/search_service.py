@@ -0,0 +1,345 @@
+"""
+Local search service over the embedded chunks. Concurrent queries are micro-batched into single encode and index
+query calls and query embeddings are kept in an LRU cache.
+
+usage: python -m serving.search_service --host 127.0.0.1 --port 8080 --max-batch-size 32 --max-wait-ms 5
+
+POST /search {"query": "...", "top_k": 5} returns {"results": [{"id", "text", "title", "start_page", "distance"}]}
+GET /stats returns batching and cache statistics
+"""
+
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import torch
+from dotenv import load_dotenv
+
+from model_trainer.export import ModelVariant, load_model
+from model_trainer.vector_index import NumpyVectorIndex, get_vector_index
+from pipeline.manifest import fingerprint
+from serving.micro_batcher import MicroBatcher
+
+
+class QueryEmbeddingCache:
+    """
+    thread safe in-memory LRU cache of query embeddings, keyed by the query text
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query: str):
+        with self.lock:
+            embedding = self.entries.get(query)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(query)
+            self.hits += 1
+            return embedding
+
+    def set(self, query: str, embedding: np.ndarray):
+        with self.lock:
+            self.entries[query] = embedding
+            self.entries.move_to_end(query)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+class SearchService:
+    """
+    serves top-k chunk search with the fine-tuned bi-encoder. The chunks of the vector index were embedded with
+    the base model, so they are re-embedded once with the serving model into an exact numpy index under
+    <db_path>/serving_index that is reused as long as the model and the chunks don't change.
+    """
+
+    def __init__(
+        self,
+        model_path: str = "models/finetuned_bi_encoder",
+        model_variant: ModelVariant = "torch",
+        db_path: str = "db",
+        collection_name: str = "doc_embeddings",
+        index_backend: str = "chroma",
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5,
+        cache_size: int = 10000,
+        max_top_k: int = 100,
+    ):
+        """
+        :param model_path: saved SentenceTransformer, loaded the way BiEncoderTrainer.load_trained_model does
+        :param model_variant: pytorch weights or the exported onnx / int8 quantized onnx model
+        :param db_path: directory of the vector index the chunks are read from
+        :param collection_name: chroma collection name, only used by the chroma backend
+        :param index_backend: backend the chunks were uploaded to
+        :param max_batch_size: maximum number of queries encoded and searched together
+        :param max_wait_ms: maximum time a query waits for others to join its batch
+        :param cache_size: number of query embeddings kept in the LRU cache
+        :param max_top_k: upper bound of the top_k a request may ask for
+        """
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model_path = model_path
+        self.model_variant = model_variant
+        self.model = load_model(model_path, variant=model_variant, device=self.device)
+        self.max_top_k = max_top_k
+        if index_backend == "chroma":
+            source_index = get_vector_index(
+                index_backend, path=db_path, collection_name=collection_name
+            )
+        else:
+            source_index = get_vector_index(index_backend, path=db_path)
+        self.index = self.build_index(
+            source_index, os.path.join(db_path, "serving_index")
+        )
+        self.query_embedding_cache = QueryEmbeddingCache(cache_size)
+        self.batcher = MicroBatcher(
+            self.search_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms
+        )
+
+    def get_model_fingerprint(self):
+        """
+        used to identify the weights of the serving model without hashing them
+        :return:
+        """
+        model_files = []
+        for dir_path, _, file_names in os.walk(self.model_path):
+            for file_name in sorted(file_names):
+                file_stat = os.stat(os.path.join(dir_path, file_name))
+                model_files.append(
+                    [
+                        os.path.relpath(
+                            os.path.join(dir_path, file_name), self.model_path
+                        ),
+                        file_stat.st_size,
+                        file_stat.st_mtime,
+                    ]
+                )
+        return fingerprint(
+            os.path.abspath(self.model_path), self.model_variant, sorted(model_files)
+        )
+
+    def build_index(self, source_index, serving_index_path: str, batch_size: int = 32):
+        """
+        used to load the serving index, or to re-embed the chunks of the source index with the serving model
+        :param source_index: vector index the chunks were uploaded to
+        :param serving_index_path:
+        :param batch_size: number of chunks encoded per forward pass
+        :return: NumpyVectorIndex
+        """
+        stored = source_index.get_all()
+        serving_fingerprint = fingerprint(
+            self.get_model_fingerprint(), sorted(stored["ids"])
+        )
+        fingerprint_path = os.path.join(serving_index_path, "fingerprint.json")
+        if os.path.exists(fingerprint_path):
+            with open(fingerprint_path, "r") as f:
+                if json.load(f).get("fingerprint") == serving_fingerprint:
+                    return NumpyVectorIndex.load(serving_index_path)
+
+        print(f"Embedding {len(stored['ids'])} chunks with {self.model_path}")
+        index = NumpyVectorIndex(path=serving_index_path)
+        if stored["ids"]:
+            index.add(
+                stored["ids"],
+                self.model.encode(stored["documents"], batch_size=batch_size),
+                stored["documents"],
+                stored["metadatas"],
+            )
+        index.save()
+        with open(fingerprint_path, "w") as f:
+            json.dump({"fingerprint": serving_fingerprint}, f)
+        return index
+
+    def search_batch(self, requests: list):
+        """
+        used to answer a micro batch of (query, top_k) requests with one encode call for the uncached queries
+        and one index query
+        :param requests:
+        :return: list of result lists, one per request
+        """
+        embeddings = [self.query_embedding_cache.get(query) for query, _ in requests]
+        missing_queries = list(
+            dict.fromkeys(
+                query
+                for (query, _), embedding in zip(requests, embeddings)
+                if embedding is None
+            )
+        )
+        if missing_queries:
+            encoded = dict(
+                zip(
+                    missing_queries,
+                    self.model.encode(missing_queries, batch_size=len(missing_queries)),
+                )
+            )
+            for query, embedding in encoded.items():
+                self.query_embedding_cache.set(query, embedding)
+            embeddings = [
+                encoded[query] if embedding is None else embedding
+                for (query, _), embedding in zip(requests, embeddings)
+            ]
+
+        n_results = max(top_k for _, top_k in requests)
+        query_results = self.index.query_batch(np.stack(embeddings), n_results)
+        return [
+            [
+                {
+                    "id": id_,
+                    "text": document,
+                    "title": (metadata or {}).get("title"),
+                    "start_page": (metadata or {}).get("start_page"),
+                    "distance": float(distance),
+                }
+                for id_, document, metadata, distance in zip(
+                    ids, documents, metadatas, distances
+                )
+            ][:top_k]
+            for (_, top_k), ids, documents, metadatas, distances in zip(
+                requests,
+                query_results["ids"],
+                query_results["documents"],
+                query_results["metadatas"],
+                query_results["distances"],
+            )
+        ]
+
+    def search(self, query: str, top_k: int = 5):
+        """
+        used to search the chunks closest to a query, blocks until the micro batch it joined is processed
+        :param query:
+        :param top_k:
+        :return: list of result dicts, nearest first
+        """
+        top_k = max(1, min(int(top_k), self.max_top_k))
+        return self.batcher.submit((query, top_k))
+
+    def get_stats(self):
+        return {
+            "batches": self.batcher.num_batches,
+            "queries": self.batcher.num_items,
+            "mean_batch_size": (
+                self.batcher.num_items / self.batcher.num_batches
+                if self.batcher.num_batches
+                else 0.0
+            ),
+            "cache_hits": self.query_embedding_cache.hits,
+            "cache_misses": self.query_embedding_cache.misses,
+            "indexed_chunks": self.index.count(),
+        }
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.service.get_stats())
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/search":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(content_length) or b"{}")
+            query = request["query"]
+            if not isinstance(query, str) or not query:
+                raise ValueError("query must be a non empty string")
+            top_k = request.get("top_k", 5)
+            if not isinstance(top_k, int) or isinstance(top_k, bool):
+                raise ValueError("top_k must be an integer")
+            top_k = max(1, min(top_k, self.service.max_top_k))
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json(400, {"error": f"{type(e).__name__}: {e}"})
+            return
+        try:
+            results = self.service.search(query, top_k)
+        except Exception as e:
+            # encode or index failures of the micro batch, the client gets an answer instead of a dropped connection
+            self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self.send_json(200, {"results": results})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SearchHTTPServer(ThreadingHTTPServer):
+    # the default listen backlog of 5 drops connections as soon as a few dozen clients connect at once
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def create_server(service: SearchService, host: str = "127.0.0.1", port: int = 8080):
+    """
+    used to build the http server of a search service, call serve_forever to start it
+    :param service:
+    :param host:
+    :param port: 0 picks a free port
+    :return:
+    """
+    handler = type(
+        "ConfiguredSearchRequestHandler", (SearchRequestHandler,), {"service": service}
+    )
+    return SearchHTTPServer((host, port), handler)
+
+
+def main():
+    load_dotenv()
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "--model-path",
+        default=os.getenv("TRAINED_MODEL_SAVE_DIR", "models/finetuned_bi_encoder"),
+    )
+    arg_parser.add_argument(
+        "--model-variant", default="torch", choices=["torch", "onnx", "onnx-int8"]
+    )
+    arg_parser.add_argument("--db-path", default="db")
+    arg_parser.add_argument(
+        "--index-backend",
+        default=os.getenv("VECTOR_INDEX_BACKEND", "chroma"),
+        choices=["chroma", "numpy"],
+    )
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8080)
+    arg_parser.add_argument("--max-batch-size", type=int, default=32)
+    arg_parser.add_argument("--max-wait-ms", type=float, default=5)
+    arg_parser.add_argument("--cache-size", type=int, default=10000)
+    args = arg_parser.parse_args()
+
+    service = SearchService(
+        model_path=args.model_path,
+        model_variant=args.model_variant,
+        db_path=args.db_path,
+        index_backend=args.index_backend,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        cache_size=args.cache_size,
+    )
+    server = create_server(service, args.host, args.port)
+    print(f"Serving search on http://{args.host}:{server.server_address[1]}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
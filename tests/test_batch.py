@@ -0,0 +1,137 @@
+import json
+
+import pytest
+
+from pipeline.jsonl_io import read_jsonl, write_jsonl
+from question_generator.batch import BatchQuestionGeneration
+from question_generator.llm_cache import LLMResponseCache
+
+
+def answer_requests(requests_path: str, results_path: str, failed_chunks=()):
+    """
+    used to stand in for the batch runner, every request is answered with a question naming its custom id
+    """
+    results = []
+    for request in read_jsonl(requests_path):
+        user_prompt = request["body"]["messages"][-1]["content"]
+        if any(chunk in user_prompt for chunk in failed_chunks):
+            results.append(
+                {
+                    "custom_id": request["custom_id"],
+                    "response": None,
+                    "error": {"message": "failed"},
+                }
+            )
+            continue
+        content = json.dumps({"questions": [f"About {request['custom_id']}?"]})
+        results.append(
+            {
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "body": {"choices": [{"message": {"content": content}}]},
+                },
+            }
+        )
+    write_jsonl(results_path, results)
+
+
+@pytest.fixture
+def batch(tmp_path):
+    cache = LLMResponseCache(path=str(tmp_path / "llm_cache.sqlite"))
+    yield BatchQuestionGeneration(cache=cache)
+    cache.close()
+
+
+def build_records(num_chunks: int):
+    return [
+        {"title": f"section {idx % 2}", "start_page": 1, "text_content": f"chunk {idx}"}
+        for idx in range(num_chunks)
+    ]
+
+
+def test_custom_id_depends_on_title_and_text():
+    get_custom_id = BatchQuestionGeneration.get_custom_id
+    record = {"title": "a", "text_content": "chunk"}
+
+    assert get_custom_id(record) == get_custom_id(dict(record))
+    assert get_custom_id(record) != get_custom_id({**record, "title": "b"})
+    assert get_custom_id(record) != get_custom_id({**record, "text_content": "x"})
+
+
+def test_requests_cover_each_distinct_chunk_once(batch, tmp_path):
+    records = build_records(4)
+    records += [records[0], {"title": "section 0", "text_content": ""}]
+    requests_path = str(tmp_path / "requests.jsonl")
+
+    assert batch.write_requests(records, requests_path) == 4
+    requests = list(read_jsonl(requests_path))
+    assert {request["custom_id"] for request in requests} == {
+        batch.get_custom_id(record) for record in records[:4]
+    }
+    assert all(request["url"] == "/v1/chat/completions" for request in requests)
+
+
+def test_results_are_merged_back_by_custom_id(batch, tmp_path):
+    records = build_records(6) + [{"title": "section 0", "text_content": ""}]
+    requests_path = str(tmp_path / "requests.jsonl")
+    results_path = str(tmp_path / "results.jsonl")
+    output_path = str(tmp_path / "questions.jsonl")
+    batch.write_requests(records, requests_path)
+    answer_requests(requests_path, results_path)
+
+    assert batch.get_missing_custom_ids(records, results_path) == set()
+    assert batch.save_questions(records, results_path, output_path) == (6, 0)
+
+    output = list(read_jsonl(output_path))
+    assert [record["text_content"] for record in output] == [
+        record["text_content"] for record in records
+    ]
+    for record in output[:6]:
+        assert record["questions"] == [f"About {batch.get_custom_id(record)}?"]
+
+
+def test_failed_requests_are_requested_again(batch, tmp_path):
+    records = build_records(6)
+    requests_path = str(tmp_path / "requests.jsonl")
+    results_path = str(tmp_path / "results.jsonl")
+    batch.write_requests(records, requests_path)
+    answer_requests(requests_path, results_path, failed_chunks=["chunk 3"])
+    # an answer without questions counts as failed too
+    results = list(read_jsonl(results_path))
+    for result in results:
+        if result["custom_id"] == batch.get_custom_id(records[4]):
+            result["response"]["body"]["choices"][0]["message"]["content"] = "none"
+    write_jsonl(results_path, results)
+    failed_ids = {batch.get_custom_id(records[3]), batch.get_custom_id(records[4])}
+
+    assert batch.get_missing_custom_ids(records, results_path) == failed_ids
+    # the answered chunks are cached, so the retry batch only asks for the failed ones
+    assert batch.cache_results(records, results_path) == 4
+    assert batch.write_requests(records, requests_path) == 2
+    assert {request["custom_id"] for request in read_jsonl(requests_path)} == failed_ids
+
+    answer_requests(requests_path, results_path)
+    assert batch.get_missing_custom_ids(records, results_path) == set()
+    output_path = str(tmp_path / "questions.jsonl")
+    assert batch.save_questions(records, results_path, output_path) == (6, 0)
+    assert all(record["questions"] for record in read_jsonl(output_path))
+
+
+def test_results_of_an_older_input_leave_new_chunks_missing(batch, tmp_path):
+    requests_path = str(tmp_path / "requests.jsonl")
+    results_path = str(tmp_path / "results.jsonl")
+    old_records = build_records(3)
+    batch.write_requests(old_records, requests_path)
+    answer_requests(requests_path, results_path)
+
+    new_records = old_records[:2] + [
+        {"title": "section 0", "start_page": 2, "text_content": "new chunk"}
+    ]
+
+    assert batch.get_missing_custom_ids(new_records, results_path) == {
+        batch.get_custom_id(new_records[2])
+    }
+    assert batch.get_missing_custom_ids(new_records, str(tmp_path / "missing")) == {
+        batch.get_custom_id(record) for record in new_records
+    }
@@ -0,0 +1,99 @@
+import re
+
+import pytest
+
+from parser.chunking import TokenChunker
+
+
+class WhitespaceTokenizer:
+    """
+    fast tokenizer stand-in with one token per word, wrapped in a start and an end special token
+    """
+
+    is_fast = True
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+    def __call__(self, texts, add_special_tokens=True, return_offsets_mapping=False):
+        batch = [texts] if isinstance(texts, str) else texts
+        offset_mappings = [
+            [(match.start(), match.end()) for match in re.finditer(r"\S+", text)]
+            for text in batch
+        ]
+        encoding = {
+            "input_ids": [
+                [0] * (len(offsets) + (2 if add_special_tokens else 0))
+                for offsets in offset_mappings
+            ]
+        }
+        if return_offsets_mapping:
+            encoding["offset_mapping"] = offset_mappings
+        if isinstance(texts, str):
+            encoding = {key: values[0] for key, values in encoding.items()}
+        return encoding
+
+
+def words(start: int, count: int):
+    return " ".join(f"w{idx}" for idx in range(start, start + count))
+
+
+def test_chunks_fit_the_context_window_and_keep_every_word():
+    paragraphs = [words(idx * 10, 1 + idx % 6) for idx in range(12)]
+    chunker = TokenChunker(WhitespaceTokenizer(), context_window=9)
+
+    [chunks] = chunker.chunk_sections([paragraphs])
+
+    assert all(count <= 9 for count in chunker.count_tokens(chunks))
+    assert " ".join(chunks).split() == " ".join(paragraphs).split()
+
+
+def test_chunks_end_at_paragraph_boundaries():
+    paragraphs = [words(idx * 3, 3) for idx in range(6)]
+    chunker = TokenChunker(WhitespaceTokenizer(), context_window=9)
+
+    [chunks] = chunker.chunk_sections([paragraphs])
+
+    assert chunks == ["\n".join(paragraphs[idx : idx + 2]) for idx in range(0, 6, 2)]
+
+
+def test_paragraph_longer_than_the_window_is_split():
+    chunker = TokenChunker(WhitespaceTokenizer(), context_window=9)
+
+    [chunks] = chunker.chunk_sections([[words(0, 20)]])
+
+    assert chunks == [words(0, 7), words(7, 7), words(14, 6)]
+
+
+def test_overlap_repeats_the_end_of_the_previous_chunk():
+    chunker = TokenChunker(WhitespaceTokenizer(), context_window=9, overlap=2)
+
+    [chunks] = chunker.chunk_sections([[words(0, 20)]])
+
+    assert chunks == [words(0, 7), words(5, 7), words(10, 7), words(15, 5)]
+
+
+def test_sections_are_chunked_independently():
+    chunker = TokenChunker(WhitespaceTokenizer(), context_window=9)
+
+    chunked_sections = chunker.chunk_sections([[], ["", words(0, 2)], [words(2, 3)]])
+
+    assert chunked_sections == [[], [words(0, 2)], [words(2, 3)]]
+
+
+@pytest.mark.parametrize(
+    "context_window, overlap",
+    [(2, 0), (9, 7), (9, -1)],
+)
+def test_invalid_settings_are_rejected(context_window, overlap):
+    with pytest.raises(ValueError):
+        TokenChunker(
+            WhitespaceTokenizer(), context_window=context_window, overlap=overlap
+        )
+
+
+def test_slow_tokenizer_is_rejected():
+    tokenizer = WhitespaceTokenizer()
+    tokenizer.is_fast = False
+    with pytest.raises(ValueError):
+        TokenChunker(tokenizer, context_window=9)
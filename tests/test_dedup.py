@@ -0,0 +1,122 @@
+import random
+
+import numpy as np
+
+from pipeline.dedup import (
+    MinHasher,
+    MinHashLSH,
+    estimate_jaccard,
+    get_cosine_duplicate_mask,
+    get_rows_per_band,
+    get_unique_questions,
+    iter_unique_chunks,
+)
+
+
+def build_text(seed: int, num_words: int = 300):
+    rng = random.Random(seed)
+    return " ".join(f"word{rng.randrange(20000)}" for _ in range(num_words))
+
+
+def edit_words(text: str, num_edits: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = text.split()
+    for position in rng.sample(range(len(words)), num_edits):
+        words[position] = "edited"
+    return " ".join(words)
+
+
+def get_shingle_jaccard(text: str, other_text: str):
+    min_hasher = MinHasher()
+    shingles = set(min_hasher.get_shingle_hashes(text).tolist())
+    other_shingles = set(min_hasher.get_shingle_hashes(other_text).tolist())
+    return len(shingles & other_shingles) / len(shingles | other_shingles)
+
+
+def test_signatures_are_seeded():
+    text = build_text(0)
+
+    np.testing.assert_array_equal(
+        MinHasher().get_signature(text), MinHasher().get_signature(text)
+    )
+    assert not np.array_equal(
+        MinHasher().get_signature(text), MinHasher(seed=2).get_signature(text)
+    )
+
+
+def test_case_punctuation_and_whitespace_are_ignored():
+    min_hasher = MinHasher()
+
+    np.testing.assert_array_equal(
+        min_hasher.get_signature("The model, trained  on PDFs."),
+        min_hasher.get_signature("the model trained on pdfs"),
+    )
+
+
+def test_signatures_estimate_the_jaccard_similarity():
+    min_hasher = MinHasher(num_perm=256)
+    text = build_text(0)
+
+    for num_edits in (5, 30, 100):
+        edited_text = edit_words(text, num_edits)
+        estimate = estimate_jaccard(
+            min_hasher.get_signature(text), min_hasher.get_signature(edited_text)
+        )
+        assert abs(estimate - get_shingle_jaccard(text, edited_text)) < 0.1
+
+
+def test_banding_makes_pairs_at_the_threshold_likely_candidates():
+    for threshold in (0.5, 0.85, 0.95):
+        rows = get_rows_per_band(threshold, 128)
+        assert 1 - (1 - threshold**rows) ** (128 // rows) >= 0.95
+
+
+def test_lsh_returns_the_earliest_near_duplicate():
+    lsh = MinHashLSH(threshold=0.85)
+    text = build_text(0)
+
+    assert lsh.add("original", text) is None
+    assert lsh.add("unrelated", build_text(1)) is None
+    assert lsh.add("copy", edit_words(text, 3, seed=1)) == "original"
+    assert lsh.add("second copy", edit_words(text, 3, seed=2)) == "original"
+    assert lsh.add("rewrite", edit_words(text, 150)) is None
+    assert set(lsh.signatures) == {"original", "unrelated", "rewrite"}
+
+
+def test_unique_chunks_keep_the_first_occurrence_in_order():
+    texts = [build_text(seed) for seed in range(4)]
+    records = [
+        {"title": "a", "text_content": texts[0]},
+        {"title": "a", "text_content": texts[1]},
+        {"title": "b", "text_content": edit_words(texts[0], 2).upper()},
+        {"title": "b", "text_content": ""},
+        {"title": "c", "text_content": texts[2]},
+        {"title": "c", "text_content": texts[1]},
+    ]
+
+    assert list(iter_unique_chunks(records)) == [
+        records[0],
+        records[1],
+        records[3],
+        records[4],
+    ]
+
+
+def test_near_identical_questions_are_dropped():
+    questions = [
+        "What is the main goal of AWQ?",
+        "What is the main goal of AWQ ?",
+        "How does AWQ protect salient weights?",
+        "what is the main goal of awq",
+    ]
+
+    assert get_unique_questions(questions) == [questions[0], questions[2]]
+
+
+def test_cosine_duplicates_are_flagged_against_kept_rows():
+    embeddings = np.array([[1.0, 0.0], [0.99, 0.05], [0.0, 1.0], [0.05, 2.0]])
+
+    np.testing.assert_array_equal(
+        get_cosine_duplicate_mask(embeddings, threshold=0.95),
+        [False, True, False, True],
+    )
@@ -0,0 +1,31 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline.instrumentation import Metrics
+
+
+def test_throughput_of_concurrent_requests_uses_the_stage_wall_time():
+    metrics = Metrics()
+
+    def request(_):
+        with metrics.timer("llm.request"):
+            time.sleep(0.1)
+        metrics.increment("llm.completion_tokens", 100)
+
+    with metrics.stage("generate"):
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(request, range(8)))
+
+    throughput = metrics.get_throughput()
+    wall_seconds = metrics.stages["generate"]["wall_seconds"]
+    assert throughput["llm_completion_tokens_per_sec"] == 800 / wall_seconds
+    assert throughput["llm_completion_tokens_per_sec_per_request"] < 1000
+    assert throughput["llm_completion_tokens_per_sec"] > 4000
+
+
+def test_counters_outside_stages_have_no_throughput():
+    metrics = Metrics()
+    with metrics.timer("encode"):
+        metrics.increment("encode.texts", 10)
+
+    assert "encode_texts_per_sec" not in metrics.get_throughput()
@@ -0,0 +1,75 @@
+import pytest
+
+from pipeline.manifest import RunManifest, file_hash, fingerprint
+from pipeline.stages import PipelineStages
+
+
+def test_fingerprint_ignores_key_order_but_not_values():
+    assert fingerprint({"a": 1, "b": 2}, "x") == fingerprint({"b": 2, "a": 1}, "x")
+    assert fingerprint({"a": 1}, "x") != fingerprint({"a": 2}, "x")
+    assert fingerprint("a", "b") != fingerprint("b", "a")
+
+
+def test_file_hash_follows_the_content(tmp_path):
+    path = tmp_path / "input.json"
+    assert file_hash(str(path)) is None
+
+    path.write_text("one")
+    first_hash = file_hash(str(path), block_size=2)
+    path.write_text("two")
+
+    assert first_hash is not None
+    assert file_hash(str(path)) != first_hash
+
+
+def test_stage_is_up_to_date_with_its_fingerprint_and_outputs(tmp_path):
+    output = tmp_path / "output.json"
+    output.write_text("{}")
+    manifest = RunManifest(str(tmp_path / "manifest.json"))
+    assert not manifest.is_up_to_date("parse", "fp")
+
+    manifest.mark_complete(
+        "parse", "fp", items={"doc": "hash"}, config_fingerprint="config"
+    )
+
+    assert manifest.is_up_to_date("parse", "fp", [str(output)])
+    assert not manifest.is_up_to_date("parse", "other", [str(output)])
+    output.unlink()
+    assert not manifest.is_up_to_date("parse", "fp", [str(output)])
+
+
+def test_manifest_is_persisted(tmp_path):
+    path = str(tmp_path / "output" / "manifest.json")
+    RunManifest(path).mark_complete(
+        "embed", "fp", items={"chunk": ""}, config_fingerprint="config"
+    )
+
+    manifest = RunManifest(path)
+
+    assert manifest.is_up_to_date("embed", "fp")
+    assert manifest.get_items("embed") == {"chunk": ""}
+    assert manifest.get_config_fingerprint("embed") == "config"
+    manifest.invalidate("embed")
+    assert not RunManifest(path).is_up_to_date("embed", "fp")
+    assert RunManifest(path).get_items("embed") == {}
+
+
+@pytest.mark.parametrize("backend", ["chroma", "numpy", "compact"])
+def test_embed_runs_again_when_the_index_is_deleted(tmp_path, monkeypatch, backend):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("VECTOR_INDEX_BACKEND", backend)
+    stages = PipelineStages(manifest=RunManifest(str(tmp_path / "manifest.json")))
+    stages.manifest.mark_complete("embed", stages.embed_fingerprint())
+
+    def get_trainer():
+        raise RuntimeError("embed ran")
+
+    monkeypatch.setattr(stages, "get_trainer", get_trainer)
+    index_path = tmp_path / stages.get_index_output_path()
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    index_path.write_text("")
+    assert stages.embed() is False
+
+    index_path.unlink()
+    with pytest.raises(RuntimeError, match="embed ran"):
+        stages.embed()
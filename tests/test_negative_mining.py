@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from model_trainer.negative_mining import HardNegativeMiner
+from model_trainer.vector_index import NumpyVectorIndex, top_k_l2
+from pipeline.instrumentation import metrics
+
+
+def build_index(embeddings: np.ndarray, titles: list, **kwargs):
+    index = NumpyVectorIndex(**kwargs)
+    index.upsert(
+        ids=[str(row) for row in range(len(embeddings))],
+        embeddings=embeddings,
+        documents=[f"chunk {row}" for row in range(len(embeddings))],
+        metadatas=[{"title": title} for title in titles],
+    )
+    return index
+
+
+def query_per_question(query_embedding: np.ndarray, document_embeddings: np.ndarray):
+    # the per question chroma query the vectorized mining replaced: 5 nearest chunks, the positive dropped and
+    # the 3 nearest of the others kept, ordered from the least to the most similar
+    distances = ((document_embeddings - query_embedding) ** 2).sum(axis=1)
+    return [f"chunk {row}" for row in np.argsort(distances, kind="stable")[:5]]
+
+
+def test_top_k_l2_matches_a_full_sort():
+    rng = np.random.default_rng(0)
+    queries = rng.normal(size=(7, 16)).astype(np.float32)
+    documents = rng.normal(size=(50, 16)).astype(np.float32)
+    distances = ((queries[:, None, :] - documents[None, :, :]) ** 2).sum(axis=2)
+
+    indices, top_distances = top_k_l2(queries, documents, 5)
+
+    np.testing.assert_array_equal(indices, np.argsort(distances, axis=1)[:, :5])
+    np.testing.assert_allclose(
+        top_distances, np.sort(distances, axis=1)[:, :5], rtol=1e-4, atol=1e-4
+    )
+
+
+def test_top_k_l2_returns_every_document_when_k_exceeds_them():
+    rng = np.random.default_rng(1)
+    queries = rng.normal(size=(3, 8))
+    documents = rng.normal(size=(4, 8))
+
+    indices, top_distances = top_k_l2(queries, documents, 10)
+
+    assert indices.shape == (3, 4)
+    assert np.all(np.diff(top_distances, axis=1) >= 0)
+
+
+@pytest.mark.parametrize("document_block_size", [65536, 7])
+@pytest.mark.parametrize("backend", ["numpy", "index"])
+def test_default_mining_gives_the_triplets_of_the_per_question_query(
+    backend, document_block_size
+):
+    rng = np.random.default_rng(2)
+    chunk_embeddings = rng.normal(size=(40, 16)).astype(np.float32)
+    index = build_index(
+        chunk_embeddings,
+        [f"section {row // 4}" for row in range(40)],
+        document_block_size=document_block_size,
+    )
+    anchors = []
+    query_embeddings = []
+    for row in range(40):
+        for question in range(2):
+            anchors.append(
+                (f"section {row // 4}", f"chunk {row}", f"q{row}-{question}")
+            )
+            query_embeddings.append(chunk_embeddings[row] + rng.normal(size=16))
+    query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+
+    triplets = HardNegativeMiner(backend=backend).mine(anchors, query_embeddings, index)
+
+    expected = []
+    for (_, positive, question), query_embedding in zip(anchors, query_embeddings):
+        documents = query_per_question(query_embedding, chunk_embeddings)
+        documents = [document for document in documents if document != positive]
+        for document in documents[::-1][-3:]:
+            expected.append(
+                {"anchor": question, "positive": positive, "negative": document}
+            )
+    assert triplets == expected
+
+
+def test_select_negatives_drops_the_positive_the_top_and_the_same_section():
+    candidates = [
+        ("positive", {"title": "a"}),
+        ("same section", {"title": "a"}),
+        ("first", {"title": "b"}),
+        ("second", {"title": "c"}),
+        ("third", None),
+        ("fourth", {"title": "b"}),
+    ]
+    miner = HardNegativeMiner(num_negatives=2, skip_top=1, exclude_same_title=True)
+
+    assert miner.select_negatives(candidates, "positive", "a") == ["third", "second"]
+
+
+def test_same_section_filtering_retrieves_more_candidates():
+    rng = np.random.default_rng(3)
+    # 4 tight sections of 10 chunks, the nearest chunks of a question are all from its own section
+    centers = rng.normal(size=(4, 8)) * 10
+    chunk_embeddings = (
+        np.repeat(centers, 10, axis=0) + rng.normal(size=(40, 8))
+    ).astype(np.float32)
+    titles = [f"section {row // 10}" for row in range(40)]
+    index = build_index(chunk_embeddings, titles)
+    anchors = [(titles[row], f"chunk {row}", f"q{row}") for row in range(40)]
+    short_before = metrics.get_counter("mine.short_of_negatives")
+
+    negatives = HardNegativeMiner(exclude_same_title=True).mine_per_anchor(
+        anchors, chunk_embeddings + 0.01, index
+    )
+
+    for (title, _, _), triplets in zip(anchors, negatives):
+        assert len(triplets) == 3
+        assert all(
+            titles[int(triplet["negative"].split()[1])] != title for triplet in triplets
+        )
+    assert metrics.get_counter("mine.short_of_negatives") == short_before
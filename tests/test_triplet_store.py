@@ -0,0 +1,62 @@
+import pytest
+
+from model_trainer.triplet_store import TripletStore, is_triplet_store_path
+
+pytest.importorskip("pyarrow")
+pytest.importorskip("datasets")
+
+
+def build_triplets():
+    return [
+        {
+            "anchor": f"question {question} of chunk {chunk}",
+            "positive": f"chunk {chunk}",
+            "negative": f"chunk {(chunk + offset) % 5}",
+        }
+        for chunk in range(5)
+        for question in range(2)
+        for offset in (1, 2)
+    ]
+
+
+def test_triplets_read_back_as_texts(tmp_path):
+    triplets = build_triplets()
+    store = TripletStore(str(tmp_path / "training_data.arrow"), write_batch_size=3)
+
+    assert store.write(iter(triplets)) == (len(triplets), 5)
+
+    dataset = store.load()
+    assert dataset.num_rows == len(triplets)
+    assert [dataset[row] for row in range(len(triplets))] == triplets
+    assert dataset[2:4] == {
+        column: [triplet[column] for triplet in triplets[2:4]]
+        for column in ("anchor", "positive", "negative")
+    }
+
+
+def test_chunk_texts_are_stored_once(tmp_path):
+    triplets = build_triplets()
+    store = TripletStore(str(tmp_path / "training_data.arrow"))
+    store.write(triplets)
+    long_store = TripletStore(str(tmp_path / "long_positives.arrow"))
+    num_triplets, num_chunks = long_store.write(
+        {**triplet, "positive": triplet["positive"] * 100} for triplet in triplets
+    )
+
+    # the 5 long positives are written once each instead of once per triplet
+    assert (num_triplets, num_chunks) == (len(triplets), 10)
+    growth = long_store.get_size_bytes() - store.get_size_bytes()
+    long_positive_size = 100 * len("chunk 0")
+    assert growth < 2 * 5 * long_positive_size < len(triplets) * long_positive_size
+
+
+def test_empty_store_loads_as_none(tmp_path):
+    store = TripletStore(str(tmp_path / "training_data.arrow"))
+
+    assert store.write([]) == (0, 0)
+    assert store.load() is None
+
+
+def test_store_paths_end_in_arrow():
+    assert is_triplet_store_path("model_trainer/training_data/training_data.arrow/")
+    assert not is_triplet_store_path("model_trainer/training_data/training_data.json")